@@ -0,0 +1,151 @@
+import heapq
+
+from django.conf import settings
+
+from .models import ActivityEvent, ActivityInbox, Message, Room
+from .tasks import task
+
+# The activity feeds.
+#
+# Instead of sorting Message every time, signals.py appends an ActivityEvent
+# when a message is created, edited or deleted and when a room is created or
+# updated. Events are never updated, so the newest events are the highest ids
+# and every feed is an index read backwards from a cursor:
+#   - everyone's activity: the primary key
+#   - the activity of a user (profile): event_user_feed_idx
+#   - the activity in the rooms a user joined: with ACTIVITY_FAN_OUT each event
+#     is copied to the inbox of every participant of the room when it happens
+#     (fan-out on write, a deferred task), and the feed is inbox_user_feed_idx. Without it, the
+#     events are joined with Room.participants when the feed is read.
+
+
+def record(verb, user_id, room_id, message=None):
+    if user_id is None:
+        # A room without a host, there's nobody to show
+        return None
+    event = ActivityEvent.objects.create(
+        verb=verb, user_id=user_id, room_id=room_id,
+        message_id=message.id if message else None,
+        body=message.body if message and verb != ActivityEvent.MESSAGE_DELETED else '',
+    )
+    if settings.ACTIVITY_FAN_OUT:
+        fan_out.defer([[event.id, event.room_id]])
+    return event
+
+
+def record_messages(messages):
+    '''record() for a batch of new messages (ingest.py), in one INSERT'''
+    if not messages:
+        return []
+    events = ActivityEvent.objects.bulk_create([
+        ActivityEvent(verb=ActivityEvent.MESSAGE_CREATED, user_id=message.user_id,
+                      room_id=message.room_id, message_id=message.id, body=message.body,
+                      created=message.created)
+        for message in messages
+    ])
+    if settings.ACTIVITY_FAN_OUT:
+        fan_out.defer([[event.id, event.room_id] for event in events])
+    return events
+
+
+@task
+def fan_out(events):
+    '''Copies the events, [event id, room id] pairs, to the inboxes of the
+    participants of their rooms. The ones already copied are skipped, so it can
+    run again after a failure'''
+    done = set(ActivityInbox.objects.filter(event_id__in=[event_id for event_id, _ in events])
+               .values_list('event_id', flat=True).distinct())
+    events = [(event_id, room_id) for event_id, room_id in events if event_id not in done]
+    members = {}
+    for room_id, user_id in Room.participants.through.objects.filter(
+            room_id__in={room_id for _, room_id in events}).values_list('room_id', 'user_id'):
+        members.setdefault(room_id, []).append(user_id)
+    ActivityInbox.objects.bulk_create(
+        ActivityInbox(user_id=user_id, event_id=event_id)
+        for event_id, room_id in events for user_id in members.get(room_id, []))
+
+
+def forget_message(message):
+    '''A deleted message disappears from the feeds, only the "deleted" event is left'''
+    ActivityEvent.objects.filter(message_id=message.id).delete()
+
+
+def unlink_messages(ids):
+    '''The messages were archived. Their events stay in the feeds, but without
+    the id, so they don't link to a Message that isn't there any more'''
+    ActivityEvent.objects.filter(message_id__in=ids).update(message_id=None)
+
+
+def rebuild(batch_size=1000):
+    '''Replaces every event with one per room and message that exists, oldest
+    first. For data inserted without signals, like bulk_create'''
+    ActivityEvent.objects.all().delete()
+    rooms = (
+        ActivityEvent(verb=ActivityEvent.ROOM_CREATED, user_id=room.host_id, room_id=room.id,
+                      created=room.created)
+        for room in Room.objects.exclude(host=None).order_by('created', 'id').iterator(chunk_size=batch_size)
+    )
+    messages = (
+        ActivityEvent(verb=ActivityEvent.MESSAGE_CREATED, user_id=message.user_id,
+                      room_id=message.room_id, message_id=message.id, body=message.body,
+                      created=message.created)
+        for message in Message.objects.order_by('created', 'id').iterator(chunk_size=batch_size)
+    )
+    batch = []
+    for event in heapq.merge(rooms, messages, key=lambda event: event.created):
+        batch.append(event)
+        if len(batch) == batch_size:
+            ActivityEvent.objects.bulk_create(batch)
+            batch = []
+    ActivityEvent.objects.bulk_create(batch)
+    if settings.ACTIVITY_FAN_OUT:
+        fill_inboxes(batch_size)
+
+
+def fill_inboxes(batch_size=1000):
+    '''Fans out the events that happened before ACTIVITY_FAN_OUT was turned on'''
+    ActivityInbox.objects.all().delete()
+    members = {}
+    for room_id, user_id in Room.participants.through.objects.values_list('room_id', 'user_id').iterator():
+        members.setdefault(room_id, []).append(user_id)
+    batch = []
+    for event_id, room_id in ActivityEvent.objects.order_by('id').values_list('id', 'room_id').iterator():
+        batch.extend(ActivityInbox(user_id=user_id, event_id=event_id)
+                     for user_id in members.get(room_id, []))
+        if len(batch) >= batch_size:
+            ActivityInbox.objects.bulk_create(batch)
+            batch = []
+    ActivityInbox.objects.bulk_create(batch)
+
+
+# Reading
+
+def events():
+    return ActivityEvent.objects.select_related('user', 'room')
+
+
+def paginate(queryset, cursor=None, page_size=None, key='id'):
+    '''Returns (rows, next_cursor), newest first. The cursor is the last id of
+    the page, the next page is everything below it'''
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    queryset = queryset.order_by(f'-{key}')
+    if cursor and cursor.isdigit():
+        queryset = queryset.filter(**{f'{key}__lt': int(cursor)})
+    rows = list(queryset[:page_size + 1])
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, str(getattr(rows[-1], key))
+    return rows, None
+
+
+def everyone(cursor=None, page_size=None):
+    return paginate(events(), cursor, page_size)
+
+
+def joined_rooms(user, cursor=None, page_size=None):
+    '''The activity in the rooms the user participates in'''
+    if settings.ACTIVITY_FAN_OUT:
+        inbox = ActivityInbox.objects.filter(user=user).select_related('event__user', 'event__room')
+        rows, next_cursor = paginate(inbox, cursor, page_size, key='event_id')
+        return [row.event for row in rows], next_cursor
+    return paginate(events().filter(room__participants=user), cursor, page_size)
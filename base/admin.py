@@ -2,8 +2,9 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Room, Topic, Message  # User is already imported by default
+from .models import Room, Topic, Message, Task  # User is already imported by default
 
 admin.site.register(Room)
 admin.site.register(Topic)
 admin.site.register(Message)
+admin.site.register(Task)
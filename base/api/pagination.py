@@ -0,0 +1,21 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class FeedPagination(CursorPagination):
+    '''Cursor pagination in the same order as the feeds (and their indexes)'''
+    page_size = settings.FEED_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-updated', '-created', '-id')
+
+
+class TopicPagination(FeedPagination):
+    # By id, which never changes. room_count moves with every room, so a cursor
+    # on it would skip or repeat topics when a room is added between two pages
+    ordering = ('id',)
+
+
+class UserPagination(FeedPagination):
+    # Newest first. date_joined has no index, but the id follows the same order
+    ordering = ('-id',)
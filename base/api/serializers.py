@@ -1,8 +1,174 @@
-from rest_framework.serializers import ModelSerializer
-from base.models import Room
+from abc import ABC, abstractmethod
 
+from rest_framework.serializers import CharField, DateTimeField, ModelSerializer, Serializer
+from django.contrib.auth.models import User
+from base.models import Room, Topic, Message
 
-class RoomSerializer(ModelSerializer):
+
+class DynamicFieldsModelSerializer(ModelSerializer):
+    '''A ModelSerializer that takes a `fields` argument, to only serialize some
+    of its fields. It's what ?fields=id,name uses.
+    https://www.django-rest-framework.org/api-guide/serializers/#dynamically-modifying-fields'''
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+# What rooms and messages nest, instead of a bare id that needs another request
+
+class UserSummarySerializer(ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
+
+class TopicSummarySerializer(ModelSerializer):
+    class Meta:
+        model = Topic
+        fields = ['id', 'name']
+
+
+class RoomSummarySerializer(ModelSerializer):
     class Meta:
         model = Room
+        fields = ['id', 'name']
+
+
+class RoomSerializer(DynamicFieldsModelSerializer):
+    # The queryset needs select_related('host', 'topic') and the participants
+    # prefetched, see api_rooms() in views.py
+    host = UserSummarySerializer(read_only=True)
+    topic = TopicSummarySerializer(read_only=True)
+    participants = UserSummarySerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Room
+        fields = '__all__'
+
+
+class TopicSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = Topic
+        fields = '__all__'
+
+
+class MessageSerializer(DynamicFieldsModelSerializer):
+    # The queryset needs select_related('user', 'room')
+    user = UserSummarySerializer(read_only=True)
+    room = RoomSummarySerializer(read_only=True)
+
+    class Meta:
+        model = Message
         fields = '__all__'
+
+
+class UserSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = User
+        # Only the public fields, never the password or the email
+        fields = ['id', 'username', 'date_joined']
+
+
+class NewMessageSerializer(Serializer):
+    '''One message of POST /api/rooms/<pk>/messages/. The author is the user
+    making the request'''
+    body = CharField()
+
+
+# The fast path of the big lists.
+#
+# For a page of rooms, most of the time of a ModelSerializer goes to creating
+# the model instances and running every row through every field object. The
+# values serializers give the same JSON as the ones above, but read plain
+# dicts from queryset.values() and build the output by hand. They take the
+# same arguments (rows, many=True, fields=...), so paginated_response() can
+# use them as they are, and the tests check that both give the same output.
+
+# DRF's own field, so the dates are formatted exactly like the serializers do
+DATETIME = DateTimeField()
+
+
+def nested(id, **fields):
+    '''The output of a summary serializer, or None if there's no related object'''
+    if id is None:
+        return None
+    return {'id': id, **fields}
+
+
+class _ValuesSerializer(ABC):
+    '''The base of the values serializers, not a serializer of its own'''
+    # The columns to read with .values()
+    values = ()
+
+    def __init__(self, rows, many=True, fields=None):
+        self.rows = rows
+        self.fields = fields
+
+    @classmethod
+    def queryset(cls, queryset):
+        return queryset.values(*cls.values)
+
+    def wants(self, field):
+        return self.fields is None or field in self.fields
+
+    @abstractmethod
+    def to_representation(self, row):
+        '''The output of one row of .values()'''
+
+    @property
+    def data(self):
+        items = [self.to_representation(row) for row in self.rows]
+        if self.fields is not None:
+            items = [{field: item[field] for field in self.fields if field in item} for item in items]
+        return items
+
+
+class RoomValuesSerializer(_ValuesSerializer):
+    values = ('id', 'host_id', 'host__username', 'topic_id', 'topic__name', 'name', 'description',
+              'participant_count', 'message_count', 'archived_count', 'updated', 'created')
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            # Both are SET_NULL, so they can be missing
+            'host': nested(row['host_id'], username=row['host__username']),
+            'topic': nested(row['topic_id'], name=row['topic__name']),
+            'participants': self.participants.get(row['id'], []),
+            'name': row['name'],
+            'description': row['description'],
+            'participant_count': row['participant_count'],
+            'message_count': row['message_count'],
+            'archived_count': row['archived_count'],
+            'updated': DATETIME.to_representation(row['updated']),
+            'created': DATETIME.to_representation(row['created']),
+        }
+
+    @property
+    def data(self):
+        # The participants of the whole page in one query, like a prefetch
+        self.participants = {}
+        if self.wants('participants') and self.rows:
+            members = Room.participants.through.objects.filter(
+                room_id__in=[row['id'] for row in self.rows]
+            ).order_by('user_id').values_list('room_id', 'user_id', 'user__username')
+            for room_id, user_id, username in members:
+                self.participants.setdefault(room_id, []).append({'id': user_id, 'username': username})
+        return super().data
+
+
+class MessageValuesSerializer(_ValuesSerializer):
+    values = ('id', 'user_id', 'user__username', 'room_id', 'room__name', 'body', 'updated', 'created')
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'user': nested(row['user_id'], username=row['user__username']),
+            'room': nested(row['room_id'], name=row['room__name']),
+            'body': row['body'],
+            'updated': DATETIME.to_representation(row['updated']),
+            'created': DATETIME.to_representation(row['created']),
+        }
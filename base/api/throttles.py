@@ -0,0 +1,37 @@
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from base import ratelimit
+
+
+class RateLimitThrottle(BaseThrottle):
+    '''The limits of ratelimit.py as a DRF throttle, so a client has one
+    counter for the site and the API. DRF answers with the 429 and Retry-After'''
+    scope = None
+
+    def allow_request(self, request, view):
+        self.retry_after = ratelimit.check(self.scope, ratelimit.client_key(request),
+                                           self.cost(request))
+        return self.retry_after is None
+
+    def cost(self, request):
+        return 1
+
+    def wait(self):
+        return self.retry_after
+
+
+class MessageThrottle(RateLimitThrottle):
+    scope = 'message'
+
+
+class IngestThrottle(RateLimitThrottle):
+    '''Counts the messages of a batch, not the requests'''
+    scope = 'ingest'
+
+    def cost(self, request):
+        # It runs before the validation. A batch over INGEST_MAX_BATCH gets a
+        # 400, so it's only charged like the biggest valid batch
+        if not isinstance(request.data, list):
+            return 1
+        return max(1, min(len(request.data), settings.INGEST_MAX_BATCH))
@@ -3,6 +3,10 @@ from . import views
 
 urlpatterns = [
     path('', views.getRoutes),
-    path('rooms/', views.getRoom),
-    path('rooms/<str:pk>/', views.getRoom)
+    path('rooms/', views.getRooms),
+    path('rooms/<str:pk>/', views.getRoom),
+    path('rooms/<str:pk>/messages/', views.postRoomMessages),
+    path('topics/', views.getTopics),
+    path('messages/', views.getMessages),
+    path('users/', views.getUsers),
 ]
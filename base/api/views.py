@@ -1,32 +1,127 @@
-from rest_framework.decorators import api_view
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from base.models import Room
-from .serializers import RoomSerializer
+from base import conditional
+from base.models import Room, Topic, Message
+from .pagination import FeedPagination, TopicPagination, UserPagination
+from .throttles import IngestThrottle, MessageThrottle
+from .serializers import (RoomSerializer, TopicSerializer, UserSerializer, NewMessageSerializer,
+                          RoomValuesSerializer, MessageValuesSerializer)
 
 
 @api_view(['GET'])
 def getRoutes(request):
     routes = [
         'GET /api',
-        'GET /api/rooms',
-        'GET /api/rooms/:id'
+        'GET /api/rooms?topic=:id&host=:id',
+        'GET /api/rooms/:id',
+        'POST /api/rooms/:id/messages [{"body": ...}, ...] (logged in)',
+        'GET /api/topics',
+        'GET /api/messages?room=:id&user=:id',
+        'GET /api/users',
+        'Every endpoint takes ?fields=a,b to only get some fields',
     ]
     return Response(routes)
 
 
-@api_view(['GET'])
-def getRooms(request):
-    rooms = Room.objects.all()
+def requested_fields(request):
+    '''The fields asked for with ?fields=id,name, or None for all of them'''
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def filter_by(queryset, request, filters):
+    '''Applies the id filters in the query string. `filters` maps each query
+    parameter to the field it filters, like {'topic': 'topic_id'}'''
+    for param, field in filters.items():
+        value = request.query_params.get(param)
+        if value is None:
+            continue
+        if not value.isdigit():
+            raise ValidationError({param: 'Has to be an id'})
+        queryset = queryset.filter(**{field: value})
+    return queryset
+
+
+def paginated_response(request, queryset, serializer_class, pagination_class=FeedPagination):
+    paginator = pagination_class()
+    page = paginator.paginate_queryset(queryset, request)
     # many = Many objects to serialize
-    serializer = RoomSerializer(rooms, many=True)
+    serializer = serializer_class(page, many=True, fields=requested_fields(request))
+    return paginator.get_paginated_response(serializer.data)
 
-    return Response(serializer.data)
+
+def api_rooms(fields=None):
+    '''The rooms for RoomSerializer, with what it nests in the same queries'''
+    rooms = Room.objects.select_related('host', 'topic')
+    if fields is None or 'participants' in fields:
+        # RoomSerializer only needs the participant ids and names, so that's all we prefetch
+        rooms = rooms.prefetch_related(
+            Prefetch('participants', queryset=User.objects.only('id', 'username').order_by('id')))
+    return rooms
+
+
+# condition() goes outside api_view(), so a 304 skips DRF entirely. The ETag
+# has the version of everything the response nests: a room has the names of
+# its host, topic and participants, a message the names of its user and room
+@condition(etag_func=conditional.api_version_etag('rooms', 'topics', 'users'))
+@api_view(['GET'])
+def getRooms(request):
+    # The values() fast path, same output as RoomSerializer
+    rooms = filter_by(Room.objects.all(), request, {'topic': 'topic_id', 'host': 'host_id'})
+    return paginated_response(request, RoomValuesSerializer.queryset(rooms), RoomValuesSerializer)
 
 
+@condition(etag_func=conditional.api_room_etag,
+           last_modified_func=conditional.api_room_last_modified)
 @api_view(['GET'])
 def getRoom(request, pk):
-    room = Room.objects.get(id=pk)
+    room = get_object_or_404(api_rooms(requested_fields(request)), id=pk)
     # many = Many objects to serialize
-    serializer = RoomSerializer(room, many=False)
+    serializer = RoomSerializer(room, many=False, fields=requested_fields(request))
 
     return Response(serializer.data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([MessageThrottle, IngestThrottle])
+def postRoomMessages(request, pk):
+    '''Posts a list of messages in one go, for bots and imports (ingest.py)'''
+    # Only this endpoint writes, the GETs don't need to import the write path
+    from base import ingest
+    room = get_object_or_404(Room, id=pk)
+    serializer = NewMessageSerializer(
+        data=request.data, many=True, allow_empty=False, max_length=settings.INGEST_MAX_BATCH)
+    serializer.is_valid(raise_exception=True)
+    messages = ingest.ingest(room, [{'user_id': request.user.id, 'body': message['body']}
+                                    for message in serializer.validated_data])
+    return Response({'ids': [message.id for message in messages]}, status=status.HTTP_201_CREATED)
+
+
+@condition(etag_func=conditional.api_version_etag('topics'))
+@api_view(['GET'])
+def getTopics(request):
+    return paginated_response(request, Topic.objects.all(), TopicSerializer, TopicPagination)
+
+
+@condition(etag_func=conditional.api_version_etag('messages', 'rooms', 'users'))
+@api_view(['GET'])
+def getMessages(request):
+    messages = filter_by(Message.objects.all(), request, {'room': 'room_id', 'user': 'user_id'})
+    return paginated_response(request, MessageValuesSerializer.queryset(messages), MessageValuesSerializer)
+
+
+@condition(etag_func=conditional.api_version_etag('users'))
+@api_view(['GET'])
+def getUsers(request):
+    return paginated_response(request, User.objects.all(), UserSerializer, UserPagination)
@@ -0,0 +1,129 @@
+import heapq
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import activity, caching, counters, pagination
+from .models import ArchivedMessage, Message, Room
+
+# Cold storage for old messages.
+#
+# Message only keeps the hot messages. `python manage.py archive_messages`
+# moves the ones that weren't updated in MESSAGE_ARCHIVE_DAYS to
+# ArchivedMessage, which can be a database of its own (see db.py). That keeps
+# the Message table and its indexes the size of the recent history, however
+# old the site gets.
+# An archived message is usually older than the hot ones, but not always:
+# history imported with its dates (ingest.py) is archived right away, and can
+# be newer than messages that are still hot. So paginate() doesn't read one
+# table after the other, it merges both in the (-updated, -created, -id)
+# order of the feeds, under the same cursor.
+
+
+def archive(older_than, batch_size=1000, compress=False):
+    '''Moves the messages not updated since `older_than` to the archive,
+    returns how many were moved'''
+    moved = 0
+    while True:
+        batch = list(Message.objects.filter(updated__lt=older_than).order_by('id')[:batch_size])
+        if not batch:
+            return moved
+        move(batch, compress)
+        moved += len(batch)
+
+
+def move(messages, compress=False):
+    # The archive can be in another database, so this can't be one
+    # transaction. The copy goes first and keeps the ids, so if we stop halfway
+    # the next run copies the same rows again (ignored) and deletes them
+    ArchivedMessage.objects.bulk_create([
+        ArchivedMessage(
+            id=message.id, room_id=message.room_id, user_id=message.user_id,
+            data=pack(message.body, compress), compressed=compress,
+            updated=message.updated, created=message.created,
+        ) for message in messages
+    ], ignore_conflicts=True)
+
+    room_ids = {message.room_id for message in messages}
+    ids = [message.id for message in messages]
+    db = router.db_for_write(Message)
+    with transaction.atomic(using=db), connections[db].cursor() as cursor:
+        # A plain DELETE instead of .delete(), on purpose. Nothing has a
+        # foreign key to Message, so there's nothing to cascade. And the
+        # post_delete signals would update the counters one message at a time
+        # and record a "deleted" activity event for messages that were only
+        # moved. The rooms are recounted below instead
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(f'DELETE FROM {Message._meta.db_table} WHERE id IN ({placeholders})', ids)
+        activity.unlink_messages(ids)
+        rooms = Room.objects.filter(id__in=room_ids)
+        rooms.update(message_count=counters.room_messages())
+        for room_id, count in archived_counts(room_ids).items():
+            Room.objects.filter(id=room_id).update(archived_count=count)
+    # message_count and archived_count of the rooms changed too
+    caching.bump_version('rooms')
+    caching.bump_version('messages')
+
+
+def pack(body, compress):
+    data = body.encode()
+    return zlib.compress(data) if compress else data
+
+
+def archived_counts(room_ids):
+    '''{room id: archived messages}. It's in the archive database, so it can't
+    be a subquery of the UPDATE like the other counters'''
+    rows = ArchivedMessage.objects.filter(room_id__in=room_ids).order_by().values('room_id')
+    return {row['room_id']: row['count'] for row in rows.annotate(count=Count('*'))}
+
+
+def forget(room_ids=(), user_ids=()):
+    '''Deletes the archived messages of deleted rooms and users'''
+    if room_ids:
+        ArchivedMessage.objects.filter(room_id__in=room_ids).delete()
+    if user_ids:
+        ArchivedMessage.objects.filter(user_id__in=user_ids).delete()
+
+
+def cutoff(days):
+    return timezone.now() - timedelta(days=days)
+
+
+# Reading
+
+def attach(messages):
+    '''Loads the user and the room of archived messages, so the templates can
+    use them like Messages (message.user.username, message.room.name...)'''
+    users = User.objects.in_bulk({message.user_id for message in messages})
+    rooms = Room.objects.in_bulk({message.room_id for message in messages})
+    for message in messages:
+        message.user = users.get(message.user_id)
+        message.room = rooms.get(message.room_id)
+    return [message for message in messages if message.user and message.room]
+
+
+def paginate(hot, archived, cursor=None, page_size=None, *, check):
+    '''pagination.paginate() over the hot and the archived messages together.
+    `archived` is the ArchivedMessage queryset with the same filter as `hot`,
+    and `check()` says if it's worth looking at it at all (for a room,
+    room.archived_count > 0)'''
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    if not check():
+        return pagination.paginate(hot, cursor, page_size)
+    # Each side reads at most one page after the cursor, so the first
+    # page_size rows of the merge are the right ones
+    hot_rows, more_hot = pagination.paginate(hot, cursor, page_size)
+    archived_rows, more_archived = pagination.paginate(archived, cursor, page_size)
+    rows = list(heapq.merge(hot_rows, archived_rows, key=pagination.position, reverse=True))
+    more = len(rows) > page_size or more_hot or more_archived
+    rows = rows[:page_size]
+    next_cursor = pagination.encode_cursor(rows[-1]) if more and rows else None
+    # The archived messages of deleted users or rooms are left out
+    attach([row for row in rows if isinstance(row, ArchivedMessage)])
+    rows = [row for row in rows if not isinstance(row, ArchivedMessage) or (row.user and row.room)]
+    return rows, next_cursor
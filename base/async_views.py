@@ -0,0 +1,132 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.http import Http404
+from django.shortcuts import render
+
+from . import activity, caching, conditional, search, views
+from .models import Room
+from .pagination import apaginate
+from .topics import get_registry
+from .views import feed_rooms, sidebar_topics
+
+# Async versions of the read only pages, used when ASYNC_VIEWS=1 and the site
+# runs under ASGI (daphne, see asgi.py).
+# The sync views hold a worker thread for the whole request, most of it waiting
+# on the database. These ones use the async ORM (async for, aget, acount...), so
+# while a query runs the event loop serves other requests, and the queries that
+# don't depend on each other are started together with asyncio.gather.
+# Rendering stays sync: the templates read the session and the user lazily,
+# and the cached fragments run their querysets while rendering, so render()
+# goes to a thread with sync_to_async. The same goes for the raw SQL of the
+# search index and the cache.
+# The same goes for the room history, that can run into the archive (archive.py).
+# Forms and writes are still handled by views.py.
+
+arender = sync_to_async(render)
+
+
+async def alist(queryset):
+    return [row async for row in queryset]
+
+
+async def aget_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except (queryset.model.DoesNotExist, ValueError):
+        raise Http404
+
+
+@conditional.acondition(etag_func=conditional.home_etag)
+async def home(request):
+    q = request.GET.get('q') if request.GET.get('q') != None else ''
+    topics = sidebar_topics(5)
+    cursor = request.GET.get('cursor')
+    if search.enabled(q):
+        rooms_page = sync_to_async(search.paginate)(feed_rooms(), q, cursor)
+        count = lambda: search.count_rooms(q)
+        topic_ids = await sync_to_async(search.search_topics)(q)
+        topic_filter = Q(room__topic__in=topic_ids)
+    elif q:
+        matching = feed_rooms().filter(
+            Q(topic__name__icontains=q) |
+            Q(name__icontains=q) |
+            Q(description__icontains=q)
+        )
+        count = matching.count
+        rooms_page = apaginate(matching, cursor)
+        topic_filter = Q(room__topic__name__icontains=q)
+    else:
+        count = Room.objects.count
+        rooms_page = apaginate(feed_rooms(), cursor)
+        topic_filter = Q()
+
+    # The page, the count and the recent activity don't depend on each other
+    (rooms, next_cursor), room_count, events = await asyncio.gather(
+        rooms_page,
+        sync_to_async(caching.cached)(
+            f'room_count:{caching.hashed(q)}', ['rooms', 'topics'], count),
+        alist(activity.events().filter(topic_filter)[:settings.RECENT_ACTIVITY_SIZE]),
+    )
+
+    context = {'rooms': rooms, 'topics': topics, 'q': q, 'next_cursor': next_cursor,
+               'room_count': room_count, 'events': events}
+    return await arender(request, 'base/home.html', context)
+
+
+@conditional.acondition(etag_func=conditional.room_etag,
+                        last_modified_func=conditional.room_last_modified)
+async def room(request, pk):
+    if request.method != 'GET':
+        # Posting a message is a write, views.room takes care of it
+        return await sync_to_async(views.room)(request, pk)
+    room = await aget_or_404(Room.objects.select_related('host', 'topic'), id=pk)
+    (room_messages, history_cursor), participants = await asyncio.gather(
+        sync_to_async(views.room_history)(room),
+        alist(room.participants.all()),
+    )
+    context = {
+        'room': room,
+        'room_messages': room_messages,
+        'history_cursor': history_cursor,
+        'participants': participants,
+    }
+    return await arender(request, 'base/room.html', context)
+
+
+@conditional.acondition(etag_func=conditional.profile_etag,
+                        last_modified_func=conditional.profile_last_modified)
+async def userProfile(request, pk):
+    user = await aget_or_404(User.objects.all(), id=pk)
+    (rooms, next_cursor), events = await asyncio.gather(
+        apaginate(feed_rooms().filter(host=user), request.GET.get('cursor')),
+        alist(activity.events().filter(user=user)[:settings.RECENT_ACTIVITY_SIZE]),
+    )
+    topics = sidebar_topics()
+    context = {'user': user, 'rooms': rooms, 'next_cursor': next_cursor,
+               'events': events, 'topics': topics}
+    return await arender(request, 'base/profile.html', context)
+
+
+async def topicsPage(request):
+    q = request.GET.get('q') if request.GET.get('q') != None else ''
+    # Can load the topics (topics.py), which is a query
+    registry = await sync_to_async(get_registry)()
+    context = {'topics': registry.containing(q)}
+    return await arender(request, 'base/topics.html', context)
+
+
+async def activityPage(request):
+    feed = request.GET.get('feed')
+    cursor = request.GET.get('cursor')
+    user = await request.auser()
+    if feed == 'joined' and user.is_authenticated:
+        events, next_cursor = await sync_to_async(activity.joined_rooms)(user, cursor)
+    else:
+        feed = None
+        events, next_cursor = await sync_to_async(activity.everyone)(cursor)
+    context = {'events': events, 'next_cursor': next_cursor, 'feed': feed}
+    return await arender(request, "base/activity.html", context)
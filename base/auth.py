@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+# Logged in requests without queries.
+#
+# AuthenticationMiddleware loads the session and then the user on every
+# request. With CACHED_AUTH (see settings.py) the sessions are the cached_db
+# backend, read from the cache and only written through to the database, and
+# CachedModelBackend keeps the users in the cache too. signals.py drops a user
+# from the cache when it's saved or deleted, so a new name, a new password
+# (which logs out the other sessions) or is_active=False are seen right away.
+# request.user is loaded once per request by the middleware, the templates
+# compare ids (request.user.id == message.user_id) so the ownership checks
+# don't load anything either.
+
+
+def user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        user = cache.get(user_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(user_key(user_id), user, settings.USER_CACHE_TIMEOUT)
+        return user
+
+    async def aget_user(self, user_id):
+        user = await cache.aget(user_key(user_id))
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await cache.aset(user_key(user_id), user, settings.USER_CACHE_TIMEOUT)
+        return user
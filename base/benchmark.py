@@ -0,0 +1,47 @@
+import json
+import socket
+import time
+
+from django.core.management.base import CommandError
+
+# Helpers shared by the bench_* management commands
+
+
+def percentile(samples, p):
+    '''The p-th percentile (0-100) of the samples, nearest rank'''
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summary(samples):
+    '''p50/p95/p99/max of a list of timings, in milliseconds'''
+    return {
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        'max': max(samples) if samples else None,
+    }
+
+
+def write_report(stdout, report, output=None):
+    '''Prints the report as JSON, and saves it in `output` if given'''
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    stdout.write(text)
+
+
+def wait_for_port(port, timeout=30):
+    '''Waits until a server started by a benchmark accepts connections'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f'The server did not start on port {port}')
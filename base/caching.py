@@ -0,0 +1,37 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+
+# Version stamps for cached fragments.
+# Some fragments (the topics sidebar) don't belong to one object with an
+# `updated` field, so their cache key has a version number instead. Bumping
+# the version makes every old fragment unreachable, they just expire.
+
+
+def version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    # If the version was evicted we start from the clock, never from 1, so we
+    # can't go back to a version that still has old fragments cached
+    return cache.get_or_set(version_key(name), time.time_ns, timeout=None)
+
+
+def bump_version(name):
+    try:
+        cache.incr(version_key(name))
+    except ValueError:
+        cache.set(version_key(name), time.time_ns(), timeout=None)
+
+
+def cached(key, versions, compute, timeout=None):
+    '''Returns compute(), cached until one of the `versions` is bumped'''
+    stamps = '-'.join(str(get_version(name)) for name in versions)
+    return cache.get_or_set(f'{key}:{stamps}', compute, timeout=timeout)
+
+
+def hashed(text):
+    '''Turns any text (a search query...) in something that is safe in a cache key'''
+    return hashlib.md5(text.encode()).hexdigest()
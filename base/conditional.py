@@ -0,0 +1,193 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.db.models import OuterRef, Subquery
+from django.middleware.csrf import get_token
+from django.views.decorators.http import condition
+
+from . import caching, counters
+from .models import Room, Message
+
+# ETag / Last-Modified functions for the `condition` decorator.
+# https://docs.djangoproject.com/en/4.1/topics/conditional-view-processing/
+# They run before the view, and when the client already has the current
+# version the view returns 304 without querying, rendering or serializing.
+# They have to be cheap: a few index reads, or only version stamps (caching.py).
+# The version stamps are only bumped in the cache of the process that did the
+# write, so they're only used with a cache that every process shares
+# (settings.SHARED_CACHE). Without one there are no ETags, and no 304s.
+
+
+def latest(queryset):
+    '''Subquery with the newest `updated` of the queryset'''
+    return Subquery(queryset.order_by('-updated').values('updated')[:1])
+
+
+def memoized(request, name, func, *args):
+    '''The ETag and the Last-Modified functions need the same data, this
+    makes sure it's only queried once per request'''
+    cache = request.__dict__.setdefault('_conditional', {})
+    if name not in cache:
+        cache[name] = func(*args)
+    return cache[name]
+
+
+def page_etag(request, *parts):
+    '''The pages look different for each user, so the user is part of the ETag.
+    There's no ETag if there are flash messages to show, a 304 would hide them'''
+    if len(messages.get_messages(request)):
+        return None
+    return tag(request.user.pk, csrf_tag(request), *parts)
+
+
+def csrf_tag(request):
+    '''The forms of the pages have a token made from the CSRF secret, and
+    logging in changes the secret. A page kept from before would post a token
+    that isn't valid any more, so the secret is part of the ETag too, hashed.
+    get_token() makes the secret on the first visit, the response sets the
+    cookie with it like a page with a form would'''
+    get_token(request)
+    return hashlib.sha256(request.META['CSRF_COOKIE'].encode()).hexdigest()[:16]
+
+
+def tag(*parts):
+    return '-'.join(str(part) for part in parts)
+
+
+def versions(*names):
+    '''The version stamps as ETag parts, or None if they can't be trusted'''
+    if not settings.SHARED_CACHE:
+        return None
+    return [caching.get_version(name) for name in names]
+
+
+def home_etag(request, *args, **kwargs):
+    # Any room, topic, message or user change bumps one of these versions, so
+    # home can answer a 304 without any query
+    stamps = versions('rooms', 'topics', 'messages', 'users')
+    if stamps is None:
+        return None
+    return page_etag(request, *stamps)
+
+
+def room_state(request, pk):
+    def query():
+        if not pk.isdigit():
+            return None
+        return Room.objects.filter(id=pk).annotate(
+            last_message=latest(Message.objects.filter(room=OuterRef('pk')))
+        ).values('updated', 'last_message', 'message_count', 'participant_count',
+                 'archived_count').first()
+    return memoized(request, 'room', query)
+
+
+def room_etag(request, pk):
+    state = room_state(request, pk)
+    # The page also shows the topic, and the names of the host, the
+    # participants and the authors, which change without touching the room
+    stamps = versions('topics', 'users')
+    if state is None or stamps is None:
+        return None
+    return page_etag(request, *state.values(), *stamps)
+
+
+def room_last_modified(request, pk):
+    # Only with the ETag: the dates miss all that isn't in them, and a client
+    # that only has the date would get a 304 when the ETag says no
+    state = room_state(request, pk)
+    if state is None or room_etag(request, pk) is None:
+        return None
+    return max(filter(None, [state['updated'], state['last_message']]))
+
+
+def profile_state(request, pk):
+    def query():
+        if not pk.isdigit():
+            return None
+        return User.objects.filter(id=pk).annotate(
+            last_room=latest(Room.objects.filter(host=OuterRef('pk'))),
+            last_message=latest(Message.objects.filter(user=OuterRef('pk'))),
+            # The counts catch deletions, the dates can't
+            room_total=counters.count_of(Room, 'host'),
+            message_total=counters.count_of(Message, 'user'),
+        ).values('username', 'last_room', 'last_message', 'room_total', 'message_total').first()
+    return memoized(request, 'profile', query)
+
+
+def profile_etag(request, pk):
+    state = profile_state(request, pk)
+    stamps = versions('topics')
+    if state is None or stamps is None:
+        return None
+    return page_etag(request, *stamps, *state.values())
+
+
+def profile_last_modified(request, pk):
+    # Only with the ETag, like room_last_modified()
+    state = profile_state(request, pk)
+    if state is None or profile_etag(request, pk) is None:
+        return None
+    return max(filter(None, [state['last_room'], state['last_message']]), default=None)
+
+
+# API. The responses don't depend on the user, so the user isn't in the ETag
+
+def api_version_etag(*names):
+    def etag(request, *args, **kwargs):
+        stamps = versions(*names)
+        return tag(*stamps) if stamps is not None else None
+    return etag
+
+
+def api_room_etag(request, pk):
+    state = room_state(request, pk)
+    stamps = versions('topics', 'users')
+    if state is None or stamps is None:
+        return None
+    # The counters are moved with plain UPDATEs (counters.py, archive.py,
+    # ingest.py), which don't touch `updated`. And the room nests the names of
+    # its topic, host and participants, which change without touching the room
+    return tag(state['updated'], state['participant_count'], state['message_count'],
+               state['archived_count'], *stamps)
+
+
+def api_room_last_modified(request, pk):
+    # Only with the ETag, like room_last_modified()
+    state = room_state(request, pk)
+    if state is None or api_room_etag(request, pk) is None:
+        return None
+    return state['updated']
+
+
+# Async views
+
+def acondition(etag_func=None, last_modified_func=None):
+    '''condition() for the async views (async_views.py). condition() calls
+    etag_func and last_modified_func right in the event loop, and ours touch the
+    database (the room state, the session, the user). So here they run in a
+    thread first, and condition() only gets their results'''
+    def decorator(view):
+        def result(name):
+            return lambda request, *args, **kwargs: request._conditional_results[name]
+
+        conditional_view = condition(
+            etag_func=result('etag') if etag_func else None,
+            last_modified_func=result('last_modified') if last_modified_func else None,
+        )(view)
+
+        def evaluate(request, *args, **kwargs):
+            return {
+                'etag': etag_func(request, *args, **kwargs) if etag_func else None,
+                'last_modified': last_modified_func(request, *args, **kwargs) if last_modified_func else None,
+            }
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            request._conditional_results = await sync_to_async(evaluate)(request, *args, **kwargs)
+            return await conditional_view(request, *args, **kwargs)
+        return inner
+    return decorator
@@ -0,0 +1,87 @@
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+
+from . import ratelimit
+from .models import Room, Message
+
+# Real time room chat.
+# Every room has a group in the channel layer. A socket joins the group of its
+# room, and every new message of the room (posted through the socket or through
+# the normal form) is sent to the group, see broadcast_message().
+
+
+def group_name(room_id):
+    return f'room_{room_id}'
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'user_id': message.user_id,
+        'username': message.user.username,
+        'body': message.body,
+        'created': message.created.isoformat(),
+    }
+
+
+def broadcast_message(message):
+    '''Sends a new message to every socket connected to its room'''
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    async_to_sync(layer.group_send)(group_name(message.room_id), {
+        'type': 'chat.message',
+        'message': serialize_message(message),
+    })
+
+
+class RoomConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        self.room_id = self.scope['url_route']['kwargs']['pk']
+        if not self.room_id.isdigit() or not await self.room_exists():
+            await self.close()
+            return
+        self.group = group_name(self.room_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group'):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.send_json({'error': 'You have to log in to post messages'})
+            return
+        if not isinstance(content, dict):
+            await self.send_json({'error': 'Send an object, {"body": "..."}'})
+            return
+        retry_after = await sync_to_async(ratelimit.check)('message', f'user:{user.id}')
+        if retry_after is not None:
+            await self.send_json({'error': 'You are posting too fast', 'retry_after': retry_after})
+            return
+        body = str(content.get('body', '')).strip()
+        # Saving the message sends it to the group, us included
+        if body and not await self.post_message(user, body):
+            await self.send_json({'error': 'This room was deleted'})
+            await self.close()
+
+    async def chat_message(self, event):
+        await self.send_json({'message': event['message']})
+
+    @database_sync_to_async
+    def room_exists(self):
+        return Room.objects.filter(id=self.room_id).exists()
+
+    @database_sync_to_async
+    def post_message(self, user, body):
+        '''False if the room was deleted since the socket connected'''
+        room = Room.objects.filter(id=self.room_id).first()
+        if room is None:
+            return False
+        Message.objects.create(user=user, room=room, body=body)
+        room.participants.add(user)
+        return True
@@ -0,0 +1,13 @@
+from django.conf import settings
+
+from . import caching
+
+
+def fragment_cache(request):
+    '''What the {% cache %} tags of the components need'''
+    return {
+        'fragment_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        # Templates call callables, so the version is only read from the cache
+        # by the pages that show the topics sidebar
+        'topics_version': lambda: caching.get_version('topics'),
+    }
@@ -0,0 +1,64 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Room, Topic, Message
+
+# Topic.room_count, Room.participant_count and Room.message_count are stored
+# counters. signals.py moves them with F() expressions, which the database
+# applies atomically, so two requests can't overwrite each other's count.
+# When signals.py doesn't know by how much a counter moved (a participant
+# removal, for example) it recounts it from the real rows instead, and
+# `python manage.py repair_counters` recounts everything to fix any drift.
+
+
+def increment(queryset, field, amount=1):
+    queryset.update(**{field: F(field) + amount})
+
+
+def decrement(queryset, field, amount=1):
+    # The counters are unsigned, so they never go below 0
+    queryset.filter(**{f'{field}__gte': amount}).update(**{field: F(field) - amount})
+
+
+def count_of(model, fk):
+    '''Subquery that counts the rows of `model` whose `fk` points to the outer row'''
+    rows = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk)
+    return Coalesce(Subquery(rows.annotate(count=Count('*')).values('count')), Value(0))
+
+
+def topic_rooms():
+    return count_of(Room, 'topic')
+
+
+def room_participants():
+    return count_of(Room.participants.through, 'room')
+
+
+def room_messages():
+    return count_of(Message, 'room')
+
+
+# (model, counter field, function that builds the real count)
+COUNTERS = [
+    (Topic, 'room_count', topic_rooms),
+    (Room, 'participant_count', room_participants),
+    (Room, 'message_count', room_messages),
+]
+
+
+def recount_participants(rooms):
+    rooms.update(participant_count=room_participants())
+
+
+def drift(model, field, real_count):
+    '''How many rows have a counter that doesn't match the real count'''
+    return model.objects.annotate(real=real_count()).exclude(**{field: F('real')}).count()
+
+
+def repair():
+    '''Recomputes every counter, returns {counter: how many rows were wrong}'''
+    drifted = {}
+    for model, field, real_count in COUNTERS:
+        drifted[f'{model.__name__}.{field}'] = drift(model, field, real_count)
+        model.objects.update(**{field: real_count()})
+    return drifted
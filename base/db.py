@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Tuning of new database connections, it's connected in apps.py.
+# ArchiveRouter is in DATABASE_ROUTERS (settings.py)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+class ArchiveRouter:
+    '''Sends ArchivedMessage to the "archive" database when there is one
+    (ARCHIVE_DB_NAME), and keeps everything else out of it'''
+
+    def archive(self, model):
+        if 'archive' in settings.DATABASES and model._meta.model_name == 'archivedmessage':
+            return 'archive'
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.archive(model)
+
+    def db_for_write(self, model, **hints):
+        return self.archive(model)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if 'archive' not in settings.DATABASES:
+            return None
+        if model_name == 'archivedmessage':
+            return db == 'archive'
+        return db != 'archive'
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import activity, archive, caching, consumers, counters
+from .models import Message, Room
+
+# Bulk ingestion of messages, for the API (POST /api/rooms/<pk>/messages/) and
+# `python manage.py import_messages`.
+#
+# Posting in a room one message at a time costs, for every message, the
+# INSERT, the participant lookup and INSERT, and what the signals do after
+# each of them (counters, activity event, versions). Here a whole batch is
+# one transaction with a fixed number of statements: one bulk INSERT of the
+# messages, one INSERT of the participants that ignores the ones already
+# there, and one UPDATE of the room. bulk_create doesn't send signals, so the
+# side effects of signals.py are done here, once per batch.
+# Imported messages older than MESSAGE_ARCHIVE_DAYS go to the archive right
+# away, like archive_messages would have done if they had been posted then.
+
+
+def ingest(room, entries):
+    '''Adds the messages to the room. `entries` are dicts with `user_id` and
+    `body`, and optionally `created` (a datetime, for imports of old history).
+    Returns the new messages'''
+    if not entries:
+        return []
+    messages = [Message(room_id=room.id, user_id=entry['user_id'], body=entry['body'])
+                for entry in entries]
+    user_ids = {entry['user_id'] for entry in entries}
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        dated = [message for message, entry in zip(messages, entries) if entry.get('created')]
+        if dated:
+            # created and updated are auto_now fields, bulk_create always sets
+            # them to now. bulk_update leaves them alone
+            for message, entry in zip(messages, entries):
+                if entry.get('created'):
+                    message.created = message.updated = entry['created']
+            Message.objects.bulk_update(dated, ['created', 'updated'])
+
+        through = Room.participants.through
+        through.objects.bulk_create(
+            [through(room_id=room.id, user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True)
+
+        rooms = Room.objects.filter(id=room.id)
+        rooms.update(updated=timezone.now(), message_count=F('message_count') + len(messages))
+        counters.recount_participants(rooms)
+        # New messages are activity and go to the open sockets, imported
+        # history isn't and doesn't
+        live = [message for message, entry in zip(messages, entries) if not entry.get('created')]
+        activity.record_messages(live)
+
+        caching.bump_version('rooms')
+        caching.bump_version('messages')
+        if live:
+            transaction.on_commit(lambda: broadcast(live))
+    if dated:
+        # After the transaction: the archive can be another database, and
+        # move() copies then deletes on its own
+        older_than = archive.cutoff(settings.MESSAGE_ARCHIVE_DAYS)
+        old = [message for message in dated if message.updated < older_than]
+        if old:
+            archive.move(old)
+    return messages
+
+
+def broadcast(messages):
+    users = User.objects.in_bulk({message.user_id for message in messages})
+    for message in messages:
+        message.user = users[message.user_id]
+        consumers.broadcast_message(message)
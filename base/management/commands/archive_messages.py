@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from base import archive
+
+
+class Command(BaseCommand):
+    help = ('Moves the messages not updated in MESSAGE_ARCHIVE_DAYS (or --days) to the '
+            'archive, so the Message table only keeps the recent history. Run it '
+            'periodically, from cron for example')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_ARCHIVE_DAYS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--compress', action='store_true',
+                            help='Store the archived bodies compressed with zlib')
+
+    def handle(self, *args, **options):
+        moved = archive.archive(archive.cutoff(options['days']), options['batch_size'],
+                                options['compress'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} messages older than {options["days"]} days archived'))
@@ -0,0 +1,123 @@
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import run
+from django.core.wsgi import get_wsgi_application
+
+from base.benchmark import summary, wait_for_port, write_report
+from base.models import Room
+
+# The two ways of serving the read only pages
+SERVERS = {
+    # The sync views under a threaded WSGI server, one thread per connection
+    'wsgi': {'ASYNC_VIEWS': '0'},
+    # The async views (async_views.py) under daphne
+    'asgi': {'ASYNC_VIEWS': '1'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Compares the throughput of the read only pages served by the sync views '
+            'under WSGI and by the async views under ASGI (daphne), with many clients '
+            'at the same time. Each server runs in its own process, against the '
+            'current database. Fill it first with `python manage.py seed_data`')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=64, help='Clients sending requests at the same time')
+        parser.add_argument('--requests', type=int, default=25, help='Requests per client')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+        # Used by the benchmark itself to start the WSGI server
+        parser.add_argument('--serve-wsgi', action='store_true', help='Internal')
+
+    def handle(self, *args, **options):
+        if options['serve_wsgi']:
+            run('127.0.0.1', options['port'], get_wsgi_application(), threading=True)
+            return
+
+        room = Room.objects.exclude(host=None).order_by('-message_count').first()
+        if room is None:
+            raise CommandError('There is no data, run `python manage.py seed_data` first')
+        paths = ['/', '/activity', '/topics', f'/room/{room.id}/', f'/profile/{room.host_id}/']
+
+        results = {}
+        for name, env in SERVERS.items():
+            server = self.start(name, env, options['port'])
+            try:
+                wait_for_port(options['port'])
+                results[name] = self.load(options['port'], paths, options['clients'], options['requests'])
+            finally:
+                server.terminate()
+                server.wait()
+            self.stderr.write(f"{name}: {results[name]['requests_per_s']:.1f} requests/s")
+
+        report = {
+            'database': settings.DATABASES['default']['ENGINE'],
+            'clients': options['clients'],
+            'requests_per_client': options['requests'],
+            'paths': paths,
+            'servers': results,
+            'asgi_vs_wsgi': results['asgi']['requests_per_s'] / results['wsgi']['requests_per_s'],
+        }
+        write_report(self.stdout, report, options['output'])
+
+    def start(self, name, env, port):
+        env = {**os.environ, **env}
+        if name == 'wsgi':
+            command = [sys.executable, 'manage.py', 'bench_async', '--serve-wsgi', '--port', str(port)]
+        else:
+            command = [sys.executable, '-m', 'daphne', '-v', '0', '-b', '127.0.0.1', '-p', str(port),
+                       'studybud.asgi:application']
+        # The servers log every request, that's not part of the benchmark
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def load(self, port, paths, clients, requests):
+        # Warm up every page once, so the first clients don't pay for imports and empty caches
+        self.client(port, paths, len(paths), [], [])
+        latencies, errors = [], []
+        threads = [threading.Thread(target=self.client, args=(
+            port, paths[i % len(paths):] + paths[:i % len(paths)], requests, latencies, errors))
+            for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'first_errors': errors[:5],
+            'elapsed_s': elapsed,
+            'requests_per_s': len(latencies) / elapsed,
+            'latency_ms': summary(latencies),
+        }
+
+    def client(self, port, paths, requests, latencies, errors):
+        # Each client keeps its connection open, like a browser would
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        try:
+            for i in range(requests):
+                path = paths[i % len(paths)]
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException) as error:
+                    errors.append(f'{path}: {error!r}')
+                    connection.close()
+                    continue
+                if response.status != 200:
+                    errors.append(f'{path}: HTTP {response.status}')
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.close()
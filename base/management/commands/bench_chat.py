@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from base.benchmark import summary, write_report
+from base.models import Room
+from base.routing import websocket_urlpatterns
+
+
+class Command(BaseCommand):
+    help = ('Load test of the room chat: opens many sockets per room, posts messages '
+            'and measures messages per second and fan-out latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1)
+        parser.add_argument('--sockets', type=int, default=100, help='Sockets per room')
+        parser.add_argument('--messages', type=int, default=50, help='Messages per room')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench-chat')
+        rooms = [Room.objects.create(host=user, name=f'Chat benchmark {i}')
+                 for i in range(options['rooms'])]
+        try:
+            report = asyncio.run(self.run(user, rooms, options))
+        finally:
+            Room.objects.filter(id__in=[room.id for room in rooms]).delete()
+        report['options'] = {key: options[key] for key in ('rooms', 'sockets', 'messages')}
+        write_report(self.stdout, report, options['output'])
+
+    async def connect(self, application, user, room):
+        communicator = WebsocketCommunicator(application, f'/ws/room/{room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise RuntimeError(f'Could not connect to room {room.id}')
+        return communicator
+
+    async def listen(self, communicator, count, sent_at, latencies, timeout):
+        for _ in range(count):
+            data = await communicator.receive_json_from(timeout=timeout)
+            latencies.append((time.perf_counter() - sent_at[data['message']['body']]) * 1000)
+
+    async def run(self, user, rooms, options):
+        application = URLRouter(websocket_urlpatterns)
+        sockets = {room.id: [await self.connect(application, user, room)
+                             for _ in range(options['sockets'])]
+                   for room in rooms}
+        sent_at, latencies = {}, []
+        listeners = [
+            asyncio.create_task(self.listen(
+                communicator, options['messages'], sent_at, latencies, options['timeout']))
+            for room_sockets in sockets.values() for communicator in room_sockets
+        ]
+
+        start = time.perf_counter()
+        for i in range(options['messages']):
+            for room in rooms:
+                body = f'{room.id}-{i}'
+                sent_at[body] = time.perf_counter()
+                # The first socket of each room is the one posting
+                await sockets[room.id][0].send_json_to({'body': body})
+        await asyncio.gather(*listeners)
+        elapsed = time.perf_counter() - start
+
+        for room_sockets in sockets.values():
+            for communicator in room_sockets:
+                await communicator.disconnect()
+
+        messages = options['messages'] * len(rooms)
+        return {
+            'elapsed_s': elapsed,
+            'messages_per_s': messages / elapsed,
+            'deliveries_per_s': len(latencies) / elapsed,
+            'fanout_latency_ms': summary(latencies),
+        }
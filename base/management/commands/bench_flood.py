@@ -0,0 +1,177 @@
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import run
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.utils.crypto import get_random_string
+
+from base.benchmark import summary, wait_for_port, write_report
+from base.models import Room
+
+# name: (threads of the flooding user, RATE_LIMIT of the server)
+SCENARIOS = {
+    'alone': (0, '0'),
+    'flood': (None, '0'),
+    'flood_limited': (None, '1'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Shows what a client flooding a room does to the writes of everyone else. '
+            'N users post messages at their own pace, three times: alone, while one more '
+            'user posts as fast as it can with the rate limits off, and the same with the '
+            'rate limits on (RATE_LIMITS). The server is a threaded WSGI server in its own '
+            'process, against the current database. The report has the latency of the '
+            'other users in each case. Keep --messages under the "message" limit, or the '
+            'polite users get limited too')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=4, help='Users posting at their own pace')
+        parser.add_argument('--messages', type=int, default=20, help='Messages per user')
+        parser.add_argument('--interval', type=float, default=0.1, help='Seconds between the messages of a user')
+        parser.add_argument('--flood-threads', type=int, default=4, help='Connections of the flooding user')
+        parser.add_argument('--port', type=int, default=8766)
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+        # Used by the benchmark itself to start the server
+        parser.add_argument('--serve', action='store_true', help='Internal')
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            run('127.0.0.1', options['port'], get_wsgi_application(), threading=True)
+            return
+
+        users = [User.objects.get_or_create(username=f'bench-user-{i}')[0]
+                 for i in range(options['users'])]
+        flooder = User.objects.get_or_create(username='bench-flooder')[0]
+        room = Room.objects.create(host=users[0], name='Flood benchmark')
+        path = f'/room/{room.id}/'
+        results = {}
+        try:
+            for name, (flood_threads, rate_limit) in SCENARIOS.items():
+                if flood_threads is None:
+                    flood_threads = options['flood_threads']
+                # New sessions every time, the server starts with an empty cache
+                sessions = [self.login(user) for user in users]
+                flooder_session = self.login(flooder)
+                server = self.start(options['port'], rate_limit)
+                try:
+                    wait_for_port(options['port'])
+                    results[name] = self.load(options['port'], path, sessions, flooder_session,
+                                              flood_threads, options)
+                finally:
+                    server.terminate()
+                    server.wait()
+                self.stderr.write(f"{name}: p99 {results[name]['latency_ms']['p99']:.1f} ms")
+        finally:
+            room.delete()
+
+        alone = results['alone']['latency_ms']['p99']
+        report = {
+            'database': connection.vendor,
+            'rate_limits': settings.RATE_LIMITS,
+            'users': options['users'],
+            'messages_per_user': options['messages'],
+            'flood_threads': options['flood_threads'],
+            'scenarios': results,
+            # How much slower the 1% slowest writes of the other users got
+            'p99_slowdown': {name: results[name]['latency_ms']['p99'] / alone
+                             for name in ('flood', 'flood_limited')},
+        }
+        write_report(self.stdout, report, options['output'])
+
+    def login(self, user):
+        # force_login saves the session in the database, where the server finds it
+        client = Client()
+        client.force_login(user)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def start(self, port, rate_limit):
+        env = {**os.environ, 'RATE_LIMIT': rate_limit}
+        command = [sys.executable, 'manage.py', 'bench_flood', '--serve', '--port', str(port)]
+        # The server logs every request (and every 429), that's not part of the benchmark
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def load(self, port, path, sessions, flooder_session, flood_threads, options):
+        # Warm up, so the first writes don't pay for imports and empty caches
+        warm_up = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        for session in sessions:
+            self.post(warm_up, path, session, 'warm up')
+        warm_up.close()
+
+        latencies, errors, flood = [], [], []
+        stop = threading.Event()
+        flooders = [threading.Thread(target=self.flood, args=(port, path, flooder_session, stop, flood))
+                    for _ in range(flood_threads)]
+        writers = [threading.Thread(target=self.write, args=(
+            port, path, session, options['messages'], options['interval'], latencies, errors))
+            for session in sessions]
+        for thread in flooders + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in flooders:
+            thread.join()
+        return {
+            'messages': len(latencies),
+            'errors': len(errors),
+            'first_errors': errors[:5],
+            'latency_ms': summary(latencies),
+            'flood_requests': len(flood),
+            'flood_status': dict(Counter(flood)),
+        }
+
+    def post(self, connection, path, session, body):
+        # Any 32 letters are a valid CSRF secret, as long as the cookie and the form agree
+        token = get_random_string(32)
+        connection.request('POST', path, urlencode({'body': body, 'csrfmiddlewaretoken': token}), {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={session}; {settings.CSRF_COOKIE_NAME}={token}',
+        })
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def write(self, port, path, session, count, interval, latencies, errors):
+        # Each client keeps its connection open, like a browser would
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        try:
+            for i in range(count):
+                time.sleep(interval)
+                start = time.perf_counter()
+                try:
+                    status = self.post(connection, path, session, f'benchmark message {i}')
+                except (OSError, http.client.HTTPException) as error:
+                    errors.append(repr(error))
+                    connection.close()
+                    continue
+                if status != 302:
+                    errors.append(f'HTTP {status}')
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.close()
+
+    def flood(self, port, path, session, stop, statuses):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        try:
+            while not stop.is_set():
+                try:
+                    statuses.append(self.post(connection, path, session, 'flood'))
+                except (OSError, http.client.HTTPException) as error:
+                    statuses.append(type(error).__name__)
+                    connection.close()
+        finally:
+            connection.close()
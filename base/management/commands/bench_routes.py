@@ -0,0 +1,109 @@
+import json
+import subprocess
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+import base.api.urls
+import base.urls
+from base.benchmark import summary, write_report
+from base.models import Room, Message
+
+# Routes that can't be benchmarked with a GET
+SKIPPED = {'logout', '/api/rooms/<str:pk>/messages/'}
+
+
+class Command(BaseCommand):
+    help = ('Measures latency (p50/p95/p99), query count and peak memory of every '
+            'route in base/urls.py and base/api/urls.py, and writes them as JSON. '
+            'Fill the database first with `python manage.py seed_data`')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+        parser.add_argument('--compare', help='A previous report, to print the p50 difference')
+
+    def handle(self, *args, **options):
+        room = Room.objects.exclude(host=None).order_by('-message_count').first()
+        message = Message.objects.filter(room=room).first()
+        if room is None or message is None:
+            raise CommandError('There is no data, run `python manage.py seed_data` first')
+        ids = {'room': room.id, 'user-profile': room.host_id,
+               'delete-message': message.id, 'update-message': message.id}
+
+        # Logged in as the host of the room, so the owner-only pages render too
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(User.objects.get(id=room.host_id))
+
+        results = {}
+        for prefix, urlconf in (('/', base.urls), ('/api/', base.api.urls)):
+            for pattern in urlconf.urlpatterns:
+                name = pattern.name or prefix + str(pattern.pattern)
+                if name in SKIPPED:
+                    continue
+                url = prefix + str(pattern.pattern).replace(
+                    '<str:pk>', str(ids.get(pattern.name, room.id)))
+                results[name] = self.measure(client, url, options['iterations'])
+                self.stderr.write(f"{name}: p50 {results[name]['latency_ms']['p50']:.1f} ms")
+
+        report = {
+            'commit': self.commit(),
+            'dataset': {model.__name__: model.objects.count() for model in (User, Room, Message)},
+            'iterations': options['iterations'],
+            'routes': results,
+        }
+        if options['compare']:
+            self.compare(report, options['compare'])
+        write_report(self.stdout, report, options['output'])
+
+    def measure(self, client, url, iterations):
+        # Warm up, so the first request doesn't pay for imports and empty caches
+        response = client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            client.get(url)
+        queries = len(ctx)
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            client.get(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        # tracemalloc slows everything down, so memory has a request of its own
+        tracemalloc.start()
+        client.get(url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {
+            'url': url,
+            'status': response.status_code,
+            'queries': queries,
+            'latency_ms': summary(latencies),
+            'peak_memory_kb': peak / 1024,
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, report, path):
+        with open(path) as f:
+            previous = json.load(f)
+        for name, result in report['routes'].items():
+            before = previous['routes'].get(name)
+            if before is None:
+                continue
+            change = result['latency_ms']['p50'] / before['latency_ms']['p50'] - 1
+            self.stderr.write(
+                f"{name}: p50 {before['latency_ms']['p50']:.1f} -> "
+                f"{result['latency_ms']['p50']:.1f} ms ({change:+.0%}), "
+                f"queries {before['queries']} -> {result['queries']}")
@@ -0,0 +1,111 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Prefetch
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ModelSerializer
+
+from base.api import renderers
+from base.api.renderers import FastJSONRenderer
+from base.api.serializers import RoomSerializer, RoomValuesSerializer
+from base.api.views import api_rooms
+from base.benchmark import write_report
+from base.models import Room
+
+
+class FlatRoomSerializer(ModelSerializer):
+    '''RoomSerializer before the nested relations: ids only'''
+    class Meta:
+        model = Room
+        fields = '__all__'
+
+
+def flat_page(ids):
+    rooms = Room.objects.filter(id__in=ids).order_by('-id').prefetch_related(
+        Prefetch('participants', queryset=User.objects.only('id')))
+    return FlatRoomSerializer(rooms, many=True).data
+
+
+def nested_page(ids):
+    return RoomSerializer(api_rooms().filter(id__in=ids).order_by('-id'), many=True).data
+
+
+def values_page(ids):
+    rows = list(RoomValuesSerializer.queryset(Room.objects.filter(id__in=ids).order_by('-id')))
+    return RoomValuesSerializer(rows).data
+
+
+# name: (how a page is serialized, the renderer)
+VARIANTS = {
+    'flat_serializer+json': (flat_page, JSONRenderer),
+    'nested_serializer+json': (nested_page, JSONRenderer),
+    'nested_serializer+fast_json': (nested_page, FastJSONRenderer),
+    'values+json': (values_page, JSONRenderer),
+    'values+fast_json': (values_page, FastJSONRenderer),
+}
+
+
+class Command(BaseCommand):
+    help = ('Measures how long the rooms API takes to serialize and render 10k rooms, '
+            'page by page: the old flat RoomSerializer (ids only), the nested one, and '
+            'the values() fast path of the list endpoint, each rendered with DRF\'s '
+            'JSONRenderer and with FastJSONRenderer (orjson). The flat one has less data '
+            'in it, it\'s the baseline. Fill the database first with `python manage.py seed_data`')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10000, help='Rooms to serialize')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of each variant, the best one counts')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        ids = list(Room.objects.order_by('-id').values_list('id', flat=True)[:options['rooms']])
+        if not ids:
+            raise CommandError('There is no data, run `python manage.py seed_data` first')
+        size = options['page_size']
+        pages = [ids[i:i + size] for i in range(0, len(ids), size)]
+        # Per 10k rooms, whatever --rooms is
+        scale = 10000 / len(ids)
+
+        results = {}
+        for name, (serialize, renderer_class) in VARIANTS.items():
+            runs = [self.run(pages, serialize, renderer_class()) for _ in range(options['repeat'])]
+            best = min(runs, key=lambda run: run['serialize_s'] + run['render_s'])
+            total = best['serialize_s'] + best['render_s']
+            results[name] = {
+                'serialize_ms_per_10k': round(best['serialize_s'] * 1000 * scale, 1),
+                'render_ms_per_10k': round(best['render_s'] * 1000 * scale, 1),
+                'total_ms_per_10k': round(total * 1000 * scale, 1),
+                'rooms_per_second': round(len(ids) / total),
+                'queries_per_page': best['queries'] / len(pages),
+                'bytes_per_room': round(best['bytes'] / len(ids)),
+            }
+            self.stderr.write(f"{name}: {results[name]['total_ms_per_10k']} ms per 10k rooms")
+
+        baseline = results['flat_serializer+json']['total_ms_per_10k']
+        report = {
+            'database': connection.vendor,
+            'orjson': renderers.orjson is not None,
+            'rooms': len(ids),
+            'page_size': size,
+            'variants': results,
+            'speedup': {name: round(baseline / result['total_ms_per_10k'], 2)
+                        for name, result in results.items()},
+        }
+        write_report(self.stdout, report, options['output'])
+
+    def run(self, pages, serialize, renderer):
+        serialize_s = render_s = 0
+        size = 0
+        with CaptureQueriesContext(connection) as ctx:
+            for page in pages:
+                start = time.perf_counter()
+                data = serialize(page)
+                rendered = time.perf_counter()
+                size += len(renderer.render(data))
+                serialize_s += rendered - start
+                render_s += time.perf_counter() - rendered
+        return {'serialize_s': serialize_s, 'render_s': render_s, 'queries': len(ctx), 'bytes': size}
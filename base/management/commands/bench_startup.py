@@ -0,0 +1,86 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base.benchmark import write_report
+
+# What a process of each ROLE (settings.py) loads before it can do its first
+# piece of work: the application with its middleware, and the urls with their views
+STARTUP = {
+    'all': 'import studybud.asgi; from django.urls import get_resolver; get_resolver().url_patterns',
+    'web': 'import studybud.asgi; from django.urls import get_resolver; get_resolver().url_patterns',
+    'api': 'import studybud.wsgi; from django.urls import get_resolver; get_resolver().url_patterns',
+    'worker': 'import django; django.setup(); import base.management.commands.run_tasks',
+}
+
+
+def parse_importtime(output):
+    '''[(self us, cumulative us, module)] from the stderr of python -X importtime'''
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            # The header
+            continue
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+    return modules
+
+
+class Command(BaseCommand):
+    help = ('Measures how long a process of each ROLE (see settings.py) takes to start: '
+            'the wall time until it is ready for its first request or task, and where the '
+            'import time goes, from `python -X importtime`. "all" is what every process '
+            'loaded before there were roles')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roles', nargs='+', choices=list(STARTUP), default=list(STARTUP))
+        parser.add_argument('--repeat', type=int, default=5, help='Starts of each role, the median counts')
+        parser.add_argument('--top', type=int, default=10, help='How many packages and modules to list')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        results = {}
+        for role in options['roles']:
+            walls = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                output = self.start(role)
+                walls.append((time.perf_counter() - start) * 1000)
+            # The import times of the last start, the first ones warm up the disk cache
+            modules = parse_importtime(output)
+            packages = Counter()
+            for self_us, _, name in modules:
+                packages[name.split('.')[0]] += self_us
+            slowest = sorted(modules, key=lambda module: -module[0])[:options['top']]
+            results[role] = {
+                'wall_ms': round(statistics.median(walls), 1),
+                'import_ms': round(sum(module[0] for module in modules) / 1000, 1),
+                'modules': len(modules),
+                'packages_ms': {name: round(us / 1000, 1) for name, us in packages.most_common(options['top'])},
+                # By their own time, without what they import
+                'slowest_modules_ms': {name: round(self_us / 1000, 1) for self_us, _, name in slowest},
+            }
+            self.stderr.write(f"{role}: {results[role]['wall_ms']} ms, {results[role]['modules']} modules")
+
+        report = {'python': sys.version.split()[0], 'repeat': options['repeat'], 'roles': results}
+        if 'all' in results:
+            report['speedup'] = {role: round(results['all']['wall_ms'] / result['wall_ms'], 2)
+                                 for role, result in results.items()}
+        write_report(self.stdout, report, options['output'])
+
+    def start(self, role):
+        env = {**os.environ, 'ROLE': role,
+               'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'studybud.settings')}
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP[role]],
+                                 cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(f'ROLE={role} failed to start:\n{process.stderr[-2000:]}')
+        return process.stderr
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from base.benchmark import summary, write_report
+from base.models import Room
+
+
+class Command(BaseCommand):
+    help = ('Measures the write throughput of posting messages in a room, with N '
+            'clients posting at the same time. Run it once per database configuration '
+            '(DB_ENGINE, SQLITE_JOURNAL_MODE...) to compare them. Run it with RATE_LIMIT=0, '
+            'the clients post faster than RATE_LIMITS allows')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--messages', type=int, default=50, help='Messages per client')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        users = [User.objects.get_or_create(username=f'bench-writer-{i}')[0]
+                 for i in range(options['clients'])]
+        room = Room.objects.create(host=users[0], name='Write benchmark')
+        latencies, errors = [], []
+        try:
+            threads = [threading.Thread(target=self.post, args=(
+                user, room, options['messages'], latencies, errors)) for user in users]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            room.delete()
+
+        report = {
+            'database': connection.vendor,
+            'settings': {key: value for key, value in connection.settings_dict.items()
+                         if key in ('NAME', 'CONN_MAX_AGE', 'OPTIONS')},
+            'clients': options['clients'],
+            'messages': len(latencies),
+            'errors': len(errors),
+            'first_errors': errors[:5],
+            'elapsed_s': elapsed,
+            'messages_per_s': len(latencies) / elapsed,
+            'latency_ms': summary(latencies),
+        }
+        write_report(self.stdout, report, options['output'])
+
+    def post(self, user, room, count, latencies, errors):
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        url = reverse('room', args=[room.id])
+        try:
+            for i in range(count):
+                start = time.perf_counter()
+                try:
+                    response = client.post(url, {'body': f'benchmark message {i}'})
+                except Exception as error:
+                    errors.append(repr(error))
+                    continue
+                if response.status_code != 302:
+                    errors.append(f'HTTP {response.status_code}')
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            # Every thread has its own connection
+            connections.close_all()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base import activity
+
+
+class Command(BaseCommand):
+    help = ('Copies every activity event to the inbox of the participants of its room. '
+            'Run it once after turning ACTIVITY_FAN_OUT on')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            activity.fill_inboxes()
+        self.stdout.write(self.style.SUCCESS('Activity inboxes filled'))
@@ -0,0 +1,70 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from base import ingest
+from base.models import Room
+
+
+class Command(BaseCommand):
+    help = ('Imports messages from a JSON Lines file (- for stdin), one message per line: '
+            '{"room": 1, "user": "username", "body": "...", "created": "2024-01-01T10:00:00Z"}. '
+            '"user" is a username or an id, "created" is optional. Consecutive messages of the '
+            'same room are inserted in batches, each batch in one transaction')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.rooms, self.users = {}, {}
+        self.imported = 0
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        room, batch = None, []
+        with stream:
+            for number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    line_room, entry = self.parse(line)
+                except (ValueError, KeyError, TypeError, ObjectDoesNotExist) as error:
+                    raise CommandError(f'Line {number}: {error!r}. '
+                                       f'{self.imported} messages were imported before it')
+                if batch and (line_room != room or len(batch) == options['batch_size']):
+                    self.flush(room, batch)
+                    batch = []
+                room = line_room
+                batch.append(entry)
+        self.flush(room, batch)
+        self.stdout.write(self.style.SUCCESS(f'{self.imported} messages imported'))
+
+    def parse(self, line):
+        data = json.loads(line)
+        entry = {'user_id': self.user_id(data['user']), 'body': str(data['body'])}
+        if data.get('created'):
+            created = parse_datetime(data['created'])
+            if created is None:
+                raise ValueError(f'Bad date {data["created"]}')
+            entry['created'] = created if timezone.is_aware(created) else timezone.make_aware(created)
+        return self.room(data['room']), entry
+
+    def room(self, pk):
+        if pk not in self.rooms:
+            self.rooms[pk] = Room.objects.get(id=pk)
+        return self.rooms[pk]
+
+    def user_id(self, user):
+        if user not in self.users:
+            lookup = {'id': user} if isinstance(user, int) else {'username': user}
+            self.users[user] = User.objects.values_list('id', flat=True).get(**lookup)
+        return self.users[user]
+
+    def flush(self, room, batch):
+        if batch:
+            ingest.ingest(room, batch)
+            self.imported += len(batch)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from base import search
+
+
+class Command(BaseCommand):
+    help = 'Drops the full text search index and indexes every room and topic again'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if search.backend() is None:
+            self.stdout.write(self.style.WARNING(
+                'This database has no search index, searches use icontains'))
+            return
+        search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from base import tasks
+
+
+class Command(BaseCommand):
+    help = ('Runs the deferred tasks saved in the database (TASK_BACKEND=database), '
+            'see base/tasks.py. Several workers can run at the same time')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Tasks claimed at a time')
+        parser.add_argument('--sleep', type=float, default=1, help='Seconds to wait when there is nothing to do')
+        parser.add_argument('--once', action='store_true', help='Run the due tasks and exit')
+
+    def handle(self, *args, **options):
+        ran = 0
+        while True:
+            count = tasks.work(options['batch_size'])
+            ran += count
+            if count:
+                continue
+            if options['once']:
+                break
+            # Like a request, so a broken or old connection is replaced
+            close_old_connections()
+            time.sleep(options['sleep'])
+        self.stderr.write(f'Ran {ran} tasks')
@@ -0,0 +1,101 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from base import activity, counters, search
+from base.models import Room, Topic, Message
+
+WORDS = (
+    'python django react vue design figma linux docker kubernetes rust golang '
+    'algorithms databases postgres sqlite machine learning statistics calculus '
+    'physics chemistry history spanish english music guitar drawing interviews '
+    'frontend backend devops security testing beginners advanced weekly study '
+    'group project help questions review exam homework lounge chat practice'
+).split()
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def batched(objects, size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic users, topics, rooms and messages, '
+            'for benchmarks. Everything is inserted in batches with bulk_create')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--topics', type=int, default=50)
+        parser.add_argument('--rooms', type=int, default=10000)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--participants', type=int, default=5,
+                            help='Participants per room')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+
+    def log(self, text):
+        self.stdout.write(text)
+        self.stdout.flush()
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        size = options['batch_size']
+        # Every run adds new rows, so the names get a prefix of their own
+        prefix = f'seed{rng.randrange(10 ** 6)}'
+
+        self.log(f"Creating {options['users']} users")
+        users = []
+        for batch in batched((User(username=f'{prefix}-user{i}', password='!')
+                              for i in range(options['users'])), size):
+            users.extend(User.objects.bulk_create(batch))
+        user_ids = [user.id for user in users]
+
+        self.log(f"Creating {options['topics']} topics")
+        topics = Topic.objects.bulk_create(
+            Topic(name=f'{rng.choice(WORDS)} {prefix}-{i}') for i in range(options['topics']))
+        topic_ids = [topic.id for topic in topics]
+
+        self.log(f"Creating {options['rooms']} rooms")
+        room_ids = []
+        Participant = Room.participants.through
+        for batch in batched((Room(host_id=rng.choice(user_ids), topic_id=rng.choice(topic_ids),
+                                   name=sentence(rng, 3), description=sentence(rng, 12))
+                              for _ in range(options['rooms'])), size):
+            rooms = Room.objects.bulk_create(batch)
+            room_ids.extend(room.id for room in rooms)
+            Participant.objects.bulk_create(
+                (Participant(room_id=room.id, user_id=user_id)
+                 for room in rooms
+                 for user_id in {room.host_id, *rng.sample(user_ids, min(options['participants'], len(user_ids)))}),
+                batch_size=size)
+
+        self.log(f"Creating {options['messages']} messages")
+        created = 0
+        for batch in batched((Message(user_id=rng.choice(user_ids), room_id=rng.choice(room_ids),
+                                      body=sentence(rng, rng.randint(3, 30)))
+                              for _ in range(options['messages'])), size):
+            Message.objects.bulk_create(batch)
+            created += len(batch)
+            if created % (size * 20) == 0:
+                self.log(f'  {created} messages')
+
+        # bulk_create doesn't send signals, so the counters, the search
+        # index and the activity feeds are filled at the end, in one go
+        self.log('Updating counters')
+        counters.repair()
+        self.log('Rebuilding the search index')
+        search.rebuild(batch_size=size)
+        self.log('Rebuilding the activity feeds')
+        activity.rebuild(batch_size=size)
+        self.stdout.write(self.style.SUCCESS('Done'))
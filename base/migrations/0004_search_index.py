@@ -0,0 +1,77 @@
+from django.db import migrations
+
+# The SQL is here and not imported from base/search.py, so this migration
+# keeps doing what it did when it was written whatever search.py becomes
+
+SCHEMA = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS base_room_fts USING fts5(topic, name, description)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS base_topic_fts USING fts5(name)",
+    ],
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS base_room_search "
+        "(room_id bigint PRIMARY KEY REFERENCES base_room (id) ON DELETE CASCADE, document tsvector NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS base_room_search_document ON base_room_search USING GIN (document)",
+        "CREATE TABLE IF NOT EXISTS base_topic_search "
+        "(topic_id bigint PRIMARY KEY REFERENCES base_topic (id) ON DELETE CASCADE, document tsvector NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS base_topic_search_document ON base_topic_search USING GIN (document)",
+    ],
+}
+DROP = {
+    'sqlite': [
+        "DROP TABLE IF EXISTS base_room_fts",
+        "DROP TABLE IF EXISTS base_topic_fts",
+    ],
+    'postgresql': [
+        "DROP TABLE IF EXISTS base_room_search",
+        "DROP TABLE IF EXISTS base_topic_search",
+    ],
+}
+FILL = {
+    'sqlite': [
+        "DELETE FROM base_room_fts",
+        "DELETE FROM base_topic_fts",
+        "INSERT INTO base_room_fts (rowid, topic, name, description) "
+        "SELECT base_room.id, coalesce(base_topic.name, ''), base_room.name, coalesce(base_room.description, '') "
+        "FROM base_room LEFT JOIN base_topic ON base_topic.id = base_room.topic_id",
+        "INSERT INTO base_topic_fts (rowid, name) SELECT id, name FROM base_topic",
+    ],
+    'postgresql': [
+        # The topic weights more than the name, and the name more than the description
+        "INSERT INTO base_room_search (room_id, document) "
+        "SELECT base_room.id, "
+        "setweight(to_tsvector('simple', coalesce(base_topic.name, '')), 'A') || "
+        "setweight(to_tsvector('simple', base_room.name), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(base_room.description, '')), 'C') "
+        "FROM base_room LEFT JOIN base_topic ON base_topic.id = base_room.topic_id "
+        "ON CONFLICT (room_id) DO UPDATE SET document = EXCLUDED.document",
+        "INSERT INTO base_topic_search (topic_id, document) "
+        "SELECT id, to_tsvector('simple', name) FROM base_topic "
+        "ON CONFLICT (topic_id) DO UPDATE SET document = EXCLUDED.document",
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in SCHEMA.get(vendor, []):
+        schema_editor.execute(sql)
+    # The index starts with the rooms and topics that already exist
+    for sql in FILL.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    for sql in DROP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_alter_room_options_room_participants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:35
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, fk):
+    rows = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk)
+    return Coalesce(Subquery(rows.annotate(count=Count('*')).values('count')), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    Topic = apps.get_model('base', 'Topic')
+    Room = apps.get_model('base', 'Room')
+    Message = apps.get_model('base', 'Message')
+    Topic.objects.update(room_count=count_of(Room, 'topic'))
+    Room.objects.update(
+        participant_count=count_of(Room.participants.through, 'room'),
+        message_count=count_of(Message, 'room'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['-updated', '-created']},
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='room_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='description',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+# The search index tables of 0004_search_index. The SQL is here and not
+# imported from base/search.py, so this keeps doing what it did when it was written
+REMOVE_TOPICS = {
+    'sqlite': "DELETE FROM base_topic_fts WHERE rowid = %s",
+    'postgresql': "DELETE FROM base_topic_search WHERE topic_id = %s",
+}
+
+
+def merge_duplicate_topics(apps, schema_editor):
+    # Topic.name becomes unique, so topics with the same name are merged in the
+    # oldest one before adding the constraint
+    remove_topics = REMOVE_TOPICS.get(schema_editor.connection.vendor)
+    Topic = apps.get_model('base', 'Topic')
+    Room = apps.get_model('base', 'Room')
+    duplicates = Topic.objects.values('name').annotate(
+        keep=Min('id'), copies=Count('id')).filter(copies__gt=1)
+    for duplicate in duplicates:
+        extra = Topic.objects.filter(name=duplicate['name']).exclude(id=duplicate['keep'])
+        extra_ids = list(extra.values_list('id', flat=True))
+        Room.objects.filter(topic__in=extra_ids).update(topic=duplicate['keep'])
+        extra.delete()
+        if remove_topics:
+            with schema_editor.connection.cursor() as cursor:
+                cursor.executemany(remove_topics, [(pk,) for pk in extra_ids])
+        Topic.objects.filter(id=duplicate['keep']).update(
+            room_count=Room.objects.filter(topic=duplicate['keep']).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_topics, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='topic',
+            name='name',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-updated', '-created', '-id'], name='message_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', '-updated', '-created', '-id'], name='message_room_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', '-updated', '-created', '-id'], name='message_user_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['-updated', '-created', '-id'], name='room_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['host', '-updated', '-created', '-id'], name='room_host_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['topic', '-updated', '-created', '-id'], name='room_topic_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='archived_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('room_id', models.BigIntegerField()),
+                ('user_id', models.BigIntegerField()),
+                ('data', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField()),
+                ('created', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['-updated', '-created'],
+                'indexes': [models.Index(fields=['room_id', '-updated', '-created', '-id'], name='archive_room_feed_idx'), models.Index(fields=['user_id', '-updated', '-created', '-id'], name='archive_user_feed_idx'), models.Index(fields=['-updated', '-created', '-id'], name='archive_feed_idx')],
+            },
+        ),
+    ]
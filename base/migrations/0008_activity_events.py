@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:54
+
+import heapq
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_events(apps, schema_editor):
+    # One event per existing room and message, oldest first so the ids
+    # follow the time order like the events appended later
+    Room = apps.get_model('base', 'Room')
+    Message = apps.get_model('base', 'Message')
+    ActivityEvent = apps.get_model('base', 'ActivityEvent')
+    rooms = (
+        ActivityEvent(verb='room_created', user_id=room.host_id, room_id=room.id, created=room.created)
+        for room in Room.objects.exclude(host=None).order_by('created', 'id').iterator()
+    )
+    messages = (
+        ActivityEvent(verb='message_created', user_id=message.user_id, room_id=message.room_id,
+                      message_id=message.id, body=message.body, created=message.created)
+        for message in Message.objects.order_by('created', 'id').iterator()
+    )
+    batch = []
+    for event in heapq.merge(rooms, messages, key=lambda event: event.created):
+        batch.append(event)
+        if len(batch) == 1000:
+            ActivityEvent.objects.bulk_create(batch)
+            batch = []
+    ActivityEvent.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('message_created', 'replied to post'), ('message_updated', 'edited a reply to'), ('message_deleted', 'deleted a reply to'), ('room_created', 'created'), ('room_updated', 'updated')], max_length=20)),
+                ('message_id', models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ('body', models.TextField(blank=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ActivityInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.activityevent')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='activityevent',
+            index=models.Index(fields=['user', '-id'], name='event_user_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityevent',
+            index=models.Index(fields=['room', '-id'], name='event_room_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityinbox',
+            index=models.Index(fields=['user', '-event'], name='inbox_user_feed_idx'),
+        ),
+        migrations.RunPython(fill_events, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,18 @@
+import zlib
+
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 # Create your models here.
 
 
 class Topic(models.Model):
-    name = models.CharField(max_length=200)
+    # unique, because createRoom and updateRoom use get_or_create(name=...)
+    name = models.CharField(max_length=200, unique=True)
+    # How many rooms use this topic. It's kept up to date by signals.py, so
+    # the "top topics" sidebar is an index read instead of a GROUP BY
+    room_count = models.PositiveIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return self.name
@@ -20,6 +27,12 @@ class Room(models.Model):
     # Normally, we wouldnt need to use related_name, but because we already use the model User in the host declaration, we have to do it
     participants = models.ManyToManyField(
         User, related_name='participants', blank=True)
+    # Stored counters, kept up to date by signals.py
+    participant_count = models.PositiveIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    # How many of its messages were moved to the archive (archive.py). It's
+    # what tells the room page if there's any history past the hot messages
+    archived_count = models.PositiveIntegerField(default=0)
     # auto_now takes a snapshot every time we save this
     updated = models.DateTimeField(auto_now=True)
     # auto_now_add only saves the value the first time we create this
@@ -28,6 +41,14 @@ class Room(models.Model):
     class Meta:
         # updated meanns ascending, -updated means descending
         ordering = ['-updated', '-created']
+        # The feeds are ordered by (-updated, -created, -id), the whole feed or
+        # only the rooms of one host or one topic. These indexes have that order,
+        # so the database reads a page of the feed straight from the index
+        indexes = [
+            models.Index(fields=['-updated', '-created', '-id'], name='room_feed_idx'),
+            models.Index(fields=['host', '-updated', '-created', '-id'], name='room_host_feed_idx'),
+            models.Index(fields=['topic', '-updated', '-created', '-id'], name='room_topic_feed_idx'),
+        ]
 
     def __str__(self):
         return str(self.name)
@@ -43,6 +64,134 @@ class Message(models.Model):
     class Meta:
         # updated meanns ascending, -updated means descending
         ordering = ['-updated', '-created']
+        # Same as Room: the activity feed, the messages of a room and the
+        # messages of a user, all ordered by (-updated, -created, -id)
+        indexes = [
+            models.Index(fields=['-updated', '-created', '-id'], name='message_feed_idx'),
+            models.Index(fields=['room', '-updated', '-created', '-id'], name='message_room_feed_idx'),
+            models.Index(fields=['user', '-updated', '-created', '-id'], name='message_user_feed_idx'),
+        ]
+
+    # See ArchivedMessage
+    archived = False
+
+    def __str__(self):
+        return self.body[0:50]
+
+
+class ArchivedMessage(models.Model):
+    '''A message moved out of Message by `python manage.py archive_messages`.
+    The archive can be a database of its own (ARCHIVE_DB_NAME, see db.py), and
+    relations can't cross databases, so the room and the user are plain ids'''
+    # The id it had as a Message, so the feeds keep the same order and cursors
+    id = models.BigIntegerField(primary_key=True)
+    room_id = models.BigIntegerField()
+    user_id = models.BigIntegerField()
+    # The body in UTF-8, compressed with zlib if `compressed`
+    data = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+    updated = models.DateTimeField()
+    created = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-updated', '-created']
+        indexes = [
+            models.Index(fields=['room_id', '-updated', '-created', '-id'], name='archive_room_feed_idx'),
+            models.Index(fields=['user_id', '-updated', '-created', '-id'], name='archive_user_feed_idx'),
+            models.Index(fields=['-updated', '-created', '-id'], name='archive_feed_idx'),
+        ]
+
+    # The room page shows them with the hot messages, but they can't be edited
+    # or deleted, so it leaves out the links to do it
+    archived = True
+
+    @property
+    def body(self):
+        data = bytes(self.data)
+        return (zlib.decompress(data) if self.compressed else data).decode()
 
     def __str__(self):
         return self.body[0:50]
+
+
+class ActivityEvent(models.Model):
+    '''Something that happened in a room. signals.py appends one for every
+    message created, edited or deleted and every room created or updated, so
+    the activity feeds read this table instead of scanning Message (activity.py)'''
+    MESSAGE_CREATED = 'message_created'
+    MESSAGE_UPDATED = 'message_updated'
+    MESSAGE_DELETED = 'message_deleted'
+    ROOM_CREATED = 'room_created'
+    ROOM_UPDATED = 'room_updated'
+    VERBS = [
+        (MESSAGE_CREATED, 'replied to post'),
+        (MESSAGE_UPDATED, 'edited a reply to'),
+        (MESSAGE_DELETED, 'deleted a reply to'),
+        (ROOM_CREATED, 'created'),
+        (ROOM_UPDATED, 'updated'),
+    ]
+
+    verb = models.CharField(max_length=20, choices=VERBS)
+    # Who did it
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE)
+    # Not a foreign key: the message can be deleted or archived. A deleted
+    # message takes its events with it, an archived one leaves them without
+    # the id (activity.unlink_messages)
+    message_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+    # The text at the time of the event, so the feeds don't need the message
+    body = models.TextField(blank=True)
+    # Not auto_now_add, so the migration can copy the dates of the old messages
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Events are only appended, so the id is also the time order, and the
+        # whole feed is the primary key read backwards
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['user', '-id'], name='event_user_feed_idx'),
+            models.Index(fields=['room', '-id'], name='event_room_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.get_verb_display()} {self.room}'
+
+
+class ActivityInbox(models.Model):
+    '''Fan-out on write (ACTIVITY_FAN_OUT): a row per event for every
+    participant of its room, so the feed of a user is one index range read'''
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    event = models.ForeignKey(ActivityEvent, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-event'], name='inbox_user_feed_idx'),
+        ]
+
+
+class Task(models.Model):
+    '''A deferred side effect waiting for `python manage.py run_tasks`, when
+    TASK_BACKEND is "database" (tasks.py). Done tasks are deleted'''
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    # The dotted path of the function, like base.search.sync_rooms
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Not before this, failed attempts push it back
+    run_at = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)} ({self.status})'
@@ -0,0 +1,205 @@
+import cProfile
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import Template
+
+# Request profiling, opt-in with PROFILING=1 (see settings.py).
+#
+# ProfilingMiddleware measures every request: wall time, how many SQL queries
+# ran and how long they took, how many of them were duplicates, and how long
+# the templates took to render. Each response gets a Server-Timing header with
+# those numbers (the browser dev tools show it in the network tab), and the
+# per-view histograms can be scraped by Prometheus from /metrics.
+# A request is also run under cProfile when it has the X-Profile header (DEBUG
+# or staff users only) or when it's picked by PROFILING_SAMPLE_RATE.
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100]
+
+# The numbers of the request being handled, None outside of ProfilingMiddleware
+current = ContextVar('profiling_current', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[(sql, str(params))] += 1
+
+
+# Template rendering
+
+original_render = Template.render
+
+
+def timed_render(self, context=None, request=None):
+    stats = current.get()
+    if stats is None:
+        return original_render(self, context, request)
+    start, sql_before = time.perf_counter(), stats.sql_time
+    try:
+        return original_render(self, context, request)
+    finally:
+        # Lazy querysets run while rendering, that time is already in sql_time
+        stats.template_time += time.perf_counter() - start - (stats.sql_time - sql_before)
+
+
+def instrument_templates():
+    # Template here is the backend template, the one render() uses. The
+    # {% include %}s happen inside it, so they are not counted twice
+    Template.render = timed_render
+
+
+# Histograms
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+    def lines(self, name, view):
+        for bound, count in zip(self.buckets, self.counts):
+            yield f'{name}_bucket{{view="{view}",le="{bound}"}} {count}'
+        yield f'{name}_bucket{{view="{view}",le="+Inf"}} {self.total}'
+        yield f'{name}_sum{{view="{view}"}} {self.sum}'
+        yield f'{name}_count{{view="{view}"}} {self.total}'
+
+
+class Registry:
+    '''Metrics of this process, by view'''
+
+    metrics = {
+        'studybud_request_duration_seconds': ('Wall time of the request', DURATION_BUCKETS),
+        'studybud_request_sql_seconds': ('Time spent in SQL queries', DURATION_BUCKETS),
+        'studybud_request_template_seconds': ('Time spent rendering templates', DURATION_BUCKETS),
+        'studybud_request_queries': ('SQL queries per request', QUERY_BUCKETS),
+        'studybud_request_duplicate_queries': ('Repeated SQL queries per request', QUERY_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view, values):
+        with self.lock:
+            for name, value in values.items():
+                key = (name, view)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.metrics[name][1])
+                self.histograms[key].observe(value)
+
+    def export(self):
+        '''The metrics in the Prometheus text format'''
+        lines = []
+        with self.lock:
+            for name, (help_text, _) in self.metrics.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, view), histogram in sorted(self.histograms.items()):
+                    if metric == name:
+                        lines.extend(histogram.lines(name, view))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def metrics(request):
+    '''Prometheus endpoint. Only for INTERNAL_IPS and staff users'''
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4')
+
+
+# Middleware
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def should_profile(self, request):
+        if request.headers.get('X-Profile'):
+            user = getattr(request, 'user', None)
+            return settings.DEBUG or (user is not None and user.is_staff)
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        profiler = cProfile.Profile() if self.should_profile(request) else None
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats.record_query))
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            current.reset(token)
+        total = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        registry.observe(view, {
+            'studybud_request_duration_seconds': total,
+            'studybud_request_sql_seconds': stats.sql_time,
+            'studybud_request_template_seconds': stats.template_time,
+            'studybud_request_queries': stats.queries,
+            'studybud_request_duplicate_queries': stats.duplicates,
+        })
+        response['Server-Timing'] = ', '.join([
+            f'sql;dur={stats.sql_time * 1000:.1f};desc="{stats.queries} queries, {stats.duplicates} duplicates"',
+            f'tpl;dur={stats.template_time * 1000:.1f};desc="Templates"',
+            f'app;dur={(total - stats.sql_time - stats.template_time) * 1000:.1f};desc="Python"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        if profiler:
+            response['X-Profile-File'] = self.save(profiler, view)
+        return response
+
+    def save(self, profiler, view):
+        '''Saves the profile, open it with `python -m pstats` or snakeviz'''
+        folder = Path(settings.PROFILING_DIR)
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f'{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10 ** 6}-{view}.prof'
+        profiler.dump_stats(path)
+        return path.name
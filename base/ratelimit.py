@@ -0,0 +1,102 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+# Rate limits for the writes.
+#
+# SQLite has one writer at a time, so a single client posting in a loop makes
+# everyone else's writes wait for the lock. Every write view names a scope of
+# settings.RATE_LIMITS ('message': '30/m'), and each client gets that many
+# requests per period: a logged in user is counted by id, anyone else by IP.
+# Over the limit the request is answered with a 429 and a Retry-After header
+# before it touches the database. The same limits apply to the API
+# (api/throttles.py) and to the chat WebSocket. A batch of the API costs one
+# hit per message in the 'ingest' scope, so a 1000 message batch counts as
+# 1000 messages and not as one request.
+# The counters are in the cache, so with more than one process they need a
+# shared cache (CACHE_BACKEND=redis), like the sessions.
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    '''"30/m" -> (30, 60)'''
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period[:1]]
+
+
+class SlidingWindow:
+    '''The sliding window counter: one counter per fixed window, and the count
+    of the last `period` seconds is the current window plus the part of the
+    previous one that is still inside it. Two cache keys per client, and
+    cache.incr keeps it right with concurrent requests'''
+
+    def hit(self, key, limit, period, cost=1):
+        '''Counts a request, as `cost` hits. Returns None if it's allowed, or
+        how many seconds the client has to wait'''
+        now = time.time()
+        window = int(now // period)
+        current_key = f'ratelimit:{key}:{window}'
+        # Two periods, the next window still reads this one as the previous
+        cache.add(current_key, 0, timeout=period * 2)
+        try:
+            current = cache.incr(current_key, cost)
+        except ValueError:
+            # Evicted between the add and the incr
+            cache.set(current_key, cost, timeout=period * 2)
+            current = cost
+        previous = cache.get(f'ratelimit:{key}:{window - 1}', 0)
+        elapsed = now - window * period
+        if previous * (1 - elapsed / period) + current <= limit:
+            return None
+        if current > limit:
+            # Even without the previous window, it has to wait for the next one
+            return math.ceil(period - elapsed)
+        # The previous window weighs less as time goes by, until it fits
+        fits_at = period * (1 - (limit - current) / previous)
+        return max(1, math.ceil(fits_at - elapsed))
+
+
+def limiter():
+    return import_string(settings.RATE_LIMITER)()
+
+
+def client_key(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.id}'
+    return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+def check(scope, key, cost=1):
+    '''Counts a request of `key` in `scope` (`cost` hits), returns None or the
+    seconds to wait'''
+    rate = settings.RATE_LIMITS.get(scope)
+    if not settings.RATE_LIMIT_ENABLED or rate is None:
+        return None
+    limit, period = parse_rate(rate)
+    return limiter().hit(f'{scope}:{key}', limit, period, cost)
+
+
+def too_many_requests(retry_after):
+    return HttpResponse(f'Too many requests, try again in {retry_after} seconds',
+                        status=429, content_type='text/plain',
+                        headers={'Retry-After': str(retry_after)})
+
+
+def ratelimit(scope, methods=('POST',)):
+    '''Limits the `methods` requests of the view with the `scope` rate'''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                retry_after = check(scope, client_key(request))
+                if retry_after is not None:
+                    return too_many_requests(retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
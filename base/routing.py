@@ -0,0 +1,7 @@
+from django.urls import path
+from . import consumers
+
+# Same as urls.py, but for WebSockets. It's loaded by studybud/asgi.py
+websocket_urlpatterns = [
+    path('ws/room/<str:pk>/', consumers.RoomConsumer.as_asgi()),
+]
@@ -0,0 +1,228 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+
+from .tasks import task
+
+# Full text search for the `q` filter of home and topicsPage.
+#
+# icontains becomes LIKE '%q%', and the database has to read every row to
+# answer it. Instead, we keep a search index next to the tables:
+#   - SQLite: FTS5 virtual tables, base_room_fts and base_topic_fts.
+#     The rowid of each row is the id of the room/topic it belongs to.
+#   - PostgreSQL: base_room_search and base_topic_search tables, with a
+#     tsvector column and a GIN index on it.
+# The tables are created by migrations/0004_search_index.py.
+# The index is kept in sync by the signals in signals.py, through deferred
+# tasks (tasks.py), and it can be rebuilt
+# from scratch with `python manage.py rebuild_search_index`.
+# Any other database just falls back to icontains.
+
+def backend():
+    '''Returns the kind of index the current database supports, or None'''
+    if connection.vendor in ('sqlite', 'postgresql'):
+        return connection.vendor
+    return None
+
+
+def terms(q):
+    '''Splits the query in words, dropping anything that isn't a word character,
+    so the user can't inject FTS syntax'''
+    return re.findall(r'\w+', q or '')
+
+
+def match_query(q):
+    '''Builds the MATCH / tsquery expression for q. Every word is a prefix match,
+    so searching "pyth" finds "python"'''
+    words = terms(q)
+    if backend() == 'postgresql':
+        return ' & '.join(f'{word}:*' for word in words)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# Keeping the index in sync
+
+def index_rooms(rooms):
+    '''(Re)indexes the given rooms. The topic has to be loaded, use select_related'''
+    rows = [(room.id, room.topic.name if room.topic else '', room.name, room.description or '')
+            for room in rooms]
+    if not rows or backend() is None:
+        return
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.executemany("DELETE FROM base_room_fts WHERE rowid = %s",
+                               [(row[0],) for row in rows])
+            cursor.executemany(
+                "INSERT INTO base_room_fts (rowid, topic, name, description) "
+                "VALUES (%s, %s, %s, %s)", rows)
+        else:
+            # The topic weights more than the name, and the name more than the description
+            cursor.executemany(
+                "INSERT INTO base_room_search (room_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'C')) "
+                "ON CONFLICT (room_id) DO UPDATE SET document = EXCLUDED.document", rows)
+
+
+def remove_rooms(room_ids):
+    if not room_ids or backend() is None:
+        return
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.executemany("DELETE FROM base_room_fts WHERE rowid = %s",
+                               [(pk,) for pk in room_ids])
+        else:
+            cursor.executemany("DELETE FROM base_room_search WHERE room_id = %s",
+                               [(pk,) for pk in room_ids])
+
+
+def index_topics(topics):
+    rows = [(topic.id, topic.name) for topic in topics]
+    if not rows or backend() is None:
+        return
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.executemany("DELETE FROM base_topic_fts WHERE rowid = %s",
+                               [(row[0],) for row in rows])
+            cursor.executemany(
+                "INSERT INTO base_topic_fts (rowid, name) VALUES (%s, %s)", rows)
+        else:
+            cursor.executemany(
+                "INSERT INTO base_topic_search (topic_id, document) "
+                "VALUES (%s, to_tsvector('simple', %s)) "
+                "ON CONFLICT (topic_id) DO UPDATE SET document = EXCLUDED.document", rows)
+
+
+def remove_topics(topic_ids):
+    if not topic_ids or backend() is None:
+        return
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.executemany("DELETE FROM base_topic_fts WHERE rowid = %s",
+                               [(pk,) for pk in topic_ids])
+        else:
+            cursor.executemany("DELETE FROM base_topic_search WHERE topic_id = %s",
+                               [(pk,) for pk in topic_ids])
+
+
+# The tasks deferred by signals.py. They index whatever is in the database
+# when they run, so the order they run in and running twice don't matter
+
+@task
+def sync_rooms(room_ids):
+    '''Indexes the rooms that exist and removes the ones that don't'''
+    from .models import Room
+
+    rooms = list(Room.objects.select_related('topic').filter(id__in=room_ids))
+    index_rooms(rooms)
+    remove_rooms(set(room_ids) - {room.id for room in rooms})
+
+
+@task
+def sync_topics(topic_ids):
+    from .models import Topic
+
+    topics = list(Topic.objects.filter(id__in=topic_ids))
+    index_topics(topics)
+    remove_topics(set(topic_ids) - {topic.id for topic in topics})
+
+
+@task
+def sync_topic_rooms(topic_id):
+    '''The topic name is part of the room documents, so the rooms of a renamed
+    topic are indexed again'''
+    from .models import Room
+
+    index_rooms(Room.objects.select_related('topic').filter(topic_id=topic_id))
+
+
+def rebuild(batch_size=1000):
+    '''Drops everything in the index and indexes every room and topic again'''
+    from .models import Room, Topic
+
+    if backend() is None:
+        return
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute("DELETE FROM base_room_fts")
+            cursor.execute("DELETE FROM base_topic_fts")
+        else:
+            cursor.execute("DELETE FROM base_room_search")
+            cursor.execute("DELETE FROM base_topic_search")
+    rooms = Room.objects.select_related('topic').order_by('id')
+    batch = []
+    for room in rooms.iterator(chunk_size=batch_size):
+        batch.append(room)
+        if len(batch) == batch_size:
+            index_rooms(batch)
+            batch = []
+    index_rooms(batch)
+    index_topics(Topic.objects.order_by('id').iterator(chunk_size=batch_size))
+
+
+# Searching
+
+def search_rooms(q, offset=0, limit=20):
+    '''Returns the ids of the rooms matching q, best match first'''
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            # bm25() arguments are the weights of topic, name and description
+            cursor.execute(
+                "SELECT rowid FROM base_room_fts WHERE base_room_fts MATCH %s "
+                "ORDER BY bm25(base_room_fts, 10.0, 5.0, 1.0) LIMIT %s OFFSET %s",
+                [match_query(q), limit, offset])
+        else:
+            cursor.execute(
+                "SELECT room_id FROM base_room_search, to_tsquery('simple', %s) query "
+                "WHERE document @@ query ORDER BY ts_rank(document, query) DESC, room_id DESC "
+                "LIMIT %s OFFSET %s",
+                [match_query(q), limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def count_rooms(q):
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM base_room_fts WHERE base_room_fts MATCH %s",
+                [match_query(q)])
+        else:
+            cursor.execute(
+                "SELECT count(*) FROM base_room_search "
+                "WHERE document @@ to_tsquery('simple', %s)", [match_query(q)])
+        return cursor.fetchone()[0]
+
+
+def search_topics(q):
+    '''Returns the ids of the topics matching q, best match first'''
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute(
+                "SELECT rowid FROM base_topic_fts WHERE base_topic_fts MATCH %s ORDER BY rank",
+                [match_query(q)])
+        else:
+            cursor.execute(
+                "SELECT topic_id FROM base_topic_search, to_tsquery('simple', %s) query "
+                "WHERE document @@ query ORDER BY ts_rank(document, query) DESC",
+                [match_query(q)])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def enabled(q):
+    '''True if q should go through the search index instead of icontains'''
+    return backend() is not None and bool(terms(q))
+
+
+def paginate(queryset, q, cursor=None, page_size=None):
+    '''Like pagination.paginate, but the rooms matching q come best match first.
+    Ranked results have no stable (updated, created, id) order, so here the
+    cursor is just the offset of the next page'''
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    offset = int(cursor) if cursor and cursor.isdigit() else 0
+    ids = search_rooms(q, offset, page_size + 1)
+    rooms = queryset.in_bulk(ids[:page_size])
+    rows = [rooms[pk] for pk in ids[:page_size] if pk in rooms]
+    next_cursor = str(offset + page_size) if len(ids) > page_size else None
+    return rows, next_cursor
@@ -0,0 +1,206 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import activity, archive, auth, caching, consumers, counters, search
+from .models import Room, Topic, Message, ActivityEvent
+
+# Side effects of saving or deleting the models, they are connected in apps.py
+
+
+# The search index is updated by deferred tasks (tasks.py), nobody is waiting for it
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def index_room(sender, instance, **kwargs):
+    search.sync_rooms.defer([instance.id])
+
+
+@receiver(post_save, sender=Topic)
+def index_topic(sender, instance, created, **kwargs):
+    search.sync_topics.defer([instance.id])
+    if not created:
+        search.sync_topic_rooms.defer(instance.id)
+
+
+@receiver(pre_delete, sender=Topic)
+def remember_topic_rooms(sender, instance, **kwargs):
+    # Deleting a topic sets room.topic to NULL with a plain UPDATE, so no
+    # post_save is sent for those rooms. We keep their ids to index them again
+    instance._room_ids = list(instance.room_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Topic)
+def unindex_topic(sender, instance, **kwargs):
+    search.sync_topics.defer([instance.id])
+    room_ids = getattr(instance, '_room_ids', [])
+    if room_ids:
+        search.sync_rooms.defer(room_ids)
+
+
+# Counters
+
+@receiver(post_init, sender=Room)
+def remember_room_topic(sender, instance, **kwargs):
+    # So we know which topic loses a room when the topic changes
+    instance._loaded_topic_id = instance.topic_id
+
+
+@receiver(post_save, sender=Room)
+def count_room(sender, instance, created, **kwargs):
+    old_topic_id = None if created else instance._loaded_topic_id
+    if old_topic_id != instance.topic_id:
+        counters.decrement(Topic.objects.filter(id=old_topic_id), 'room_count')
+        counters.increment(Topic.objects.filter(id=instance.topic_id), 'room_count')
+    instance._loaded_topic_id = instance.topic_id
+
+
+@receiver(post_delete, sender=Room)
+def uncount_room(sender, instance, **kwargs):
+    counters.decrement(Topic.objects.filter(id=instance.topic_id), 'room_count')
+
+
+# The counters of the rooms are part of what the API returns, and a plain
+# UPDATE sends no post_save, so these bump the 'rooms' version themselves
+
+@receiver(post_save, sender=Message)
+def count_message(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(Room.objects.filter(id=instance.room_id), 'message_count')
+        caching.bump_version('rooms')
+
+
+@receiver(post_delete, sender=Message)
+def uncount_message(sender, instance, **kwargs):
+    counters.decrement(Room.objects.filter(id=instance.room_id), 'message_count')
+    caching.bump_version('rooms')
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def count_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse means the change was made from the user side, user.participants.add(room)
+    if action == 'pre_clear' and reverse:
+        # After the clear we can't know which rooms the user was in anymore
+        instance._cleared_room_ids = list(instance.participants.values_list('id', flat=True))
+    elif action == 'post_add' and not reverse:
+        # For post_add, pk_set only has the users that weren't participants already
+        counters.increment(Room.objects.filter(id=instance.id), 'participant_count', len(pk_set))
+    elif action == 'post_add':
+        counters.increment(Room.objects.filter(id__in=pk_set), 'participant_count')
+    elif action in ('post_remove', 'post_clear'):
+        # pk_set may have users that weren't participants, so we just count again
+        if not reverse:
+            room_ids = [instance.id]
+        elif action == 'post_remove':
+            room_ids = pk_set
+        else:
+            room_ids = instance._cleared_room_ids
+        counters.recount_participants(Room.objects.filter(id__in=room_ids))
+
+
+@receiver(pre_delete, sender=User)
+def remember_user_rooms(sender, instance, **kwargs):
+    # Deleting a user deletes its rows of the participants table without any
+    # m2m_changed, so we keep the rooms it was in to count them again
+    instance._participant_room_ids = list(instance.participants.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=User)
+def uncount_participant(sender, instance, **kwargs):
+    room_ids = getattr(instance, '_participant_room_ids', [])
+    if room_ids:
+        counters.recount_participants(Room.objects.filter(id__in=room_ids))
+        caching.bump_version('rooms')
+
+
+# Chat
+
+@receiver(post_save, sender=Message)
+def broadcast_message(sender, instance, created, **kwargs):
+    if created:
+        # After the commit, so the sockets never see a message that was rolled back
+        transaction.on_commit(lambda: consumers.broadcast_message(instance))
+
+
+# Cached fragments
+
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_topics(sender, **kwargs):
+    # Any room can change the room_count of the topics in the sidebar and in
+    # the topics every process keeps in memory (topics.py)
+    caching.bump_version('topics')
+    # And after the commit, in case another process loaded them in between,
+    # while it could only see the old rows
+    transaction.on_commit(lambda: caching.bump_version('topics'))
+
+
+# Version stamps, used by the cached fragments and the ETags (conditional.py)
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(m2m_changed, sender=Room.participants.through)
+def bump_rooms_version(sender, **kwargs):
+    caching.bump_version('rooms')
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def bump_messages_version(sender, **kwargs):
+    caching.bump_version('messages')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_users_version(sender, update_fields=None, **kwargs):
+    # Every login saves last_login (update_last_login), which nothing shows
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    caching.bump_version('users')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    auth.forget_user(instance.id)
+
+
+# Archive. It can be in another database, so it has no foreign keys that
+# would cascade
+
+@receiver(post_delete, sender=Room)
+def forget_archived_room(sender, instance, **kwargs):
+    if instance.archived_count:
+        archive.forget(room_ids=[instance.id])
+
+
+@receiver(post_delete, sender=User)
+def forget_archived_user(sender, instance, **kwargs):
+    archive.forget(user_ids=[instance.id])
+
+
+# Activity feeds (activity.py)
+
+@receiver(post_save, sender=Room)
+def room_event(sender, instance, created, **kwargs):
+    verb = ActivityEvent.ROOM_CREATED if created else ActivityEvent.ROOM_UPDATED
+    activity.record(verb, instance.host_id, instance.id)
+
+
+@receiver(post_save, sender=Message)
+def message_event(sender, instance, created, **kwargs):
+    verb = ActivityEvent.MESSAGE_CREATED if created else ActivityEvent.MESSAGE_UPDATED
+    activity.record(verb, instance.user_id, instance.room_id, instance)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted_event(sender, instance, origin=None, **kwargs):
+    # When the message goes away because its room or its user is deleted, the
+    # events are deleted with them, there's nothing to record
+    if getattr(origin, 'model', type(origin)) is not Message:
+        return
+    activity.forget_message(instance)
+    activity.record(ActivityEvent.MESSAGE_DELETED, instance.user_id, instance.room_id, instance)
@@ -0,0 +1,252 @@
+import gzip
+import mimetypes
+import os
+import re
+import struct
+import zlib
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The production static pipeline, in the style of WhiteNoise.
+#
+# `python manage.py collectstatic` copies the files to STATIC_ROOT through
+# CompressedManifestStorage, which:
+#   - optimizes the images on the way in (lossless, see optimize_png and
+#     optimize_svg)
+#   - saves a copy of every file with the hash of its content in the name
+#     (style.3f2a9c.css), and {% static %} links to those
+#   - writes a .gz (and a .br, if the brotli package is installed) next to
+#     every file that gets smaller compressed
+# StaticFilesMiddleware then serves STATIC_ROOT from the app itself. A hashed
+# name never changes content, so it's sent with a one year "immutable"
+# Cache-Control: after the first visit the browser doesn't even ask for the
+# CSS, JS and images again. Clients that accept br or gzip get the compressed
+# copy, which costs nothing at request time because it's already on disk.
+
+# Formats that are compressed already, gzip doesn't make them smaller
+ALREADY_COMPRESSED = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.woff', '.woff2',
+    '.gz', '.br', '.zip', '.mp3', '.mp4', '.webm',
+}
+# Encoding: extension of the copy, in order of preference
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+# A year, the most browsers and proxies honour
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Files without the hash in the name can change on the next deploy
+SHORT_LIVED = 'public, max-age=60'
+
+
+def compressed_variants(data):
+    '''{encoding: compressed data}, only the ones that save more than 5%'''
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: compressed for encoding, compressed in variants.items()
+            if len(compressed) < len(data) * 0.95}
+
+
+# Image optimization
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# The ancillary chunks that change how the image looks. The rest is metadata
+# (comments, timestamps, the background color of the editor...)
+PNG_KEEP = {b'PLTE', b'tRNS', b'gAMA', b'cHRM', b'sRGB', b'iCCP', b'pHYs'}
+
+
+def optimize_png(data):
+    '''Lossless: drops the metadata chunks and recompresses the pixels with
+    zlib level 9 in a single IDAT. Returns `data` when that isn't smaller'''
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+    chunks, pixels = [], b''
+    position = len(PNG_SIGNATURE)
+    try:
+        while position < len(data):
+            length, kind = struct.unpack('>I4s', data[position:position + 8])
+            body = data[position + 8:position + 8 + length]
+            position += length + 12
+            if kind == b'acTL':
+                # An animated PNG, its frames are chunks of their own
+                return data
+            if kind == b'IDAT':
+                if not pixels:
+                    chunks.append((kind, None))
+                pixels += body
+            elif kind[:1].isupper() or kind in PNG_KEEP:
+                chunks.append((kind, body))
+        pixels = zlib.compress(zlib.decompress(pixels), 9)
+    except (struct.error, zlib.error):
+        return data
+    optimized = PNG_SIGNATURE + b''.join(
+        png_chunk(kind, pixels if body is None else body) for kind, body in chunks)
+    return optimized if len(optimized) < len(data) else data
+
+
+def png_chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+
+def optimize_svg(data):
+    '''Removes the comments, the editor metadata and the whitespace between tags'''
+    try:
+        text = data.decode()
+    except UnicodeDecodeError:
+        return data
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.S)
+    text = re.sub(r'<metadata\b.*?</metadata>', '', text, flags=re.S)
+    if '<text' not in text:
+        # Inside <text> the spaces between tags are part of the text
+        text = re.sub(r'>\s+<', '><', text)
+    optimized = text.strip().encode()
+    return optimized if len(optimized) < len(data) else data
+
+
+OPTIMIZERS = {'.png': optimize_png, '.svg': optimize_svg}
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    def _save(self, name, content):
+        optimize = OPTIMIZERS.get(Path(name).suffix.lower())
+        if optimize:
+            content = ContentFile(optimize(content.read()))
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in {*paths, *self.hashed_files.values()}:
+            if Path(name).suffix.lower() not in ALREADY_COMPRESSED:
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            data = original.read()
+        for encoding, compressed in compressed_variants(data).items():
+            variant = name + ENCODINGS[encoding]
+            if self.exists(variant):
+                self.delete(variant)
+            self._save(variant, ContentFile(compressed))
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            # collectstatic never ran (development, the tests), there's no
+            # manifest so the files keep their names
+            return name
+        return super().stored_name(name)
+
+
+# Serving
+
+class StaticFile:
+    def __init__(self, path, cache_control):
+        stat = os.stat(path)
+        content_type, _ = mimetypes.guess_type(path)
+        self.path = path
+        self.etag = f'W/"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+        self.headers = {
+            'Content-Type': content_type or 'application/octet-stream',
+            'Cache-Control': cache_control,
+            'Last-Modified': http_date(stat.st_mtime),
+            'ETag': self.etag,
+        }
+        self.variants = {encoding: path + extension for encoding, extension in ENCODINGS.items()
+                         if os.path.exists(path + extension)}
+        if self.variants:
+            self.headers['Vary'] = 'Accept-Encoding'
+
+
+def index(root, prefix, hashed):
+    '''{url: StaticFile} of every file in `root`. `hashed` are the names (relative
+    to `root`) that have the hash of their content in them'''
+    files = {}
+    for directory, _, names in os.walk(root):
+        for filename in names:
+            path = os.path.join(directory, filename)
+            if filename.endswith(tuple(ENCODINGS.values())) and os.path.exists(path[:-3]):
+                continue
+            name = Path(path).relative_to(root).as_posix()
+            files[prefix + name] = StaticFile(path, IMMUTABLE if name in hashed else SHORT_LIVED)
+    return files
+
+
+def accepted_encoding(header, variants):
+    '''The encoding of the best variant the client accepts, or None'''
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        if re.fullmatch(r'\s*q=0(\.0*)?\s*', params):
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding in variants and (encoding in accepted or '*' in accepted):
+            return encoding
+    return None
+
+
+class StaticFilesMiddleware:
+    '''Serves the files collected in STATIC_ROOT, before the request goes
+    through the rest of the middleware. Goes right after SecurityMiddleware.
+    Off with DEBUG, runserver serves the static folders directly'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        root = settings.STATIC_ROOT
+        if settings.DEBUG or not root or not os.path.isdir(root) or '://' in settings.STATIC_URL:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        hashed = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        # The files are indexed once, when the process starts. collectstatic
+        # goes with a deploy, which restarts it
+        self.files = index(str(root), settings.STATIC_URL, hashed)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        file = self.files.get(request.path)
+        if file is None:
+            return None
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        if file.etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+            for header in ('Cache-Control', 'ETag', 'Vary'):
+                if header in file.headers:
+                    response[header] = file.headers[header]
+            return response
+
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding', ''), file.variants)
+        path = file.variants[encoding] if encoding else file.path
+        # The files are small (the biggest is an image of a few hundred KB),
+        # reading them at once works the same under WSGI and ASGI
+        content = Path(path).read_bytes()
+        response = HttpResponse(b'' if request.method == 'HEAD' else content)
+        for header, value in file.headers.items():
+            response[header] = value
+        response['Content-Length'] = len(content)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+# Deferred work for the side effects of the writes.
+#
+# The signals used to do everything inside the request that saved the model.
+# The work that nobody is waiting for (the search index, the activity inboxes)
+# is a task instead: a function decorated with @task, deferred with
+# function.defer(*args). The arguments have to be JSON (ids, not models), and
+# a task has to be safe to run twice, a retry can repeat one that half ran.
+# Where it runs depends on TASK_BACKEND:
+#   - immediate: right away, inside the transaction of the write. The default,
+#     and what the tests use
+#   - thread: in a thread pool of the same process, after the commit. For
+#     local development, nothing else to start
+#   - database: a Task row saved in the same transaction as the write, so it
+#     can't get lost, and `python manage.py run_tasks` runs it
+# Failed tasks are retried TASK_MAX_ATTEMPTS times, waiting TASK_RETRY_DELAY
+# seconds and twice that after every failure.
+
+logger = logging.getLogger(__name__)
+
+# name: function, filled by @task when the modules are imported (apps.py
+# imports signals.py, which imports every module with tasks)
+REGISTRY = {}
+
+
+def task(function):
+    name = f'{function.__module__}.{function.__name__}'
+    REGISTRY[name] = function
+    function.defer = lambda *args: defer(name, *args)
+    return function
+
+
+def defer(name, *args):
+    BACKENDS[settings.TASK_BACKEND](name, list(args))
+
+
+def run(name, args):
+    REGISTRY[name](*args)
+
+
+def retry_delay(attempts):
+    return settings.TASK_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+# Backends
+
+def run_now(name, args):
+    run(name, args)
+
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(settings.TASK_THREADS, thread_name_prefix='task')
+        return executor
+
+
+def run_in_thread(name, args):
+    # After the commit, the thread has its own connection and wouldn't see the write before
+    transaction.on_commit(lambda: get_executor().submit(run_with_retries, name, args))
+
+
+def run_with_retries(name, args):
+    for attempt in range(1, settings.TASK_MAX_ATTEMPTS + 1):
+        try:
+            run(name, args)
+            return
+        except Exception:
+            logger.exception('Task %s%s failed, attempt %s', name, tuple(args), attempt)
+            if attempt < settings.TASK_MAX_ATTEMPTS:
+                time.sleep(retry_delay(attempt))
+        finally:
+            close_old_connections()
+
+
+def save_task(name, args):
+    Task.objects.create(name=name, args=args)
+
+
+BACKENDS = {
+    'immediate': run_now,
+    'thread': run_in_thread,
+    'database': save_task,
+}
+
+
+# The worker of the database backend
+
+def claim(batch_size):
+    '''Marks up to `batch_size` due tasks as running and returns them. The
+    UPDATE only matches if nobody claimed the task first, so several workers
+    can run at the same time'''
+    now = timezone.now()
+    # A task left running by a worker that died is picked up again
+    lost = now - timedelta(seconds=settings.TASK_TIMEOUT)
+    due = Task.objects.filter(
+        Q(status=Task.PENDING, run_at__lte=now) | Q(status=Task.RUNNING, started__lt=lost)
+    ).order_by('run_at', 'id')[:batch_size]
+    claimed = []
+    for task in due:
+        won = Task.objects.filter(id=task.id, status=task.status, started=task.started).update(
+            status=Task.RUNNING, started=now, attempts=F('attempts') + 1)
+        if won:
+            task.status, task.started, task.attempts = Task.RUNNING, now, task.attempts + 1
+            claimed.append(task)
+    return claimed
+
+
+def work(batch_size=100):
+    '''Runs the due tasks once, returns how many ran'''
+    tasks = claim(batch_size)
+    for task in tasks:
+        try:
+            # The tasks it defers are saved only if it succeeds
+            with transaction.atomic():
+                run(task.name, task.args)
+        except Exception:
+            logger.exception('Task %s failed, attempt %s', task, task.attempts)
+            if task.attempts >= settings.TASK_MAX_ATTEMPTS:
+                changes = {'status': Task.FAILED}
+            else:
+                changes = {'status': Task.PENDING,
+                           'run_at': timezone.now() + timedelta(seconds=retry_delay(task.attempts))}
+            Task.objects.filter(id=task.id).update(error=traceback.format_exc(), **changes)
+        else:
+            Task.objects.filter(id=task.id).delete()
+    return len(tasks)
@@ -1,3 +1,1540 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.urls import include, path, reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .models import Room, Topic, Message, ArchivedMessage, ActivityEvent, ActivityInbox, Task
+from .pagination import paginate, encode_cursor, decode_cursor
+from . import activity, archive, async_views, auth, counters, ingest, ratelimit, search, staticfiles, tasks, topics, views
+from . import urls as base_urls
+from .api.renderers import FastJSONRenderer
+from .api.serializers import MessageSerializer, MessageValuesSerializer, RoomSerializer, RoomValuesSerializer
+from .api.views import api_rooms
+from studybud.asgi import application
 
 # Create your tests here.
+
+
+def bulk_seed(users=50, topics=20, rooms=2000, messages=5000):
+    '''A bigger dataset, inserted with bulk_create so it's fast. The signals
+    don't run, so the counters and the search index are not filled. The
+    activity feeds are rebuilt at the end'''
+    users = User.objects.bulk_create(User(username=f'bulk{i}') for i in range(users))
+    topics = Topic.objects.bulk_create(Topic(name=f'bulk{i}') for i in range(topics))
+    rooms = Room.objects.bulk_create(
+        Room(host=users[i % len(users)], topic=topics[i % len(topics)], name=f'bulk{i}')
+        for i in range(rooms))
+    Message.objects.bulk_create(
+        Message(user=users[i % len(users)], room=rooms[i % len(rooms)], body=f'bulk{i}')
+        for i in range(messages))
+    activity.rebuild()
+    return users, rooms
+
+
+def seed(size):
+    '''Creates `size` users, topics and rooms, each room with a couple of
+    participants and messages, so the views have plenty of rows to render'''
+    users = [User.objects.create(username=f'user{i}') for i in range(size)]
+    topics = [Topic.objects.create(name=f'topic{i}') for i in range(size)]
+    for i in range(size):
+        room = Room.objects.create(
+            host=users[i], topic=topics[i], name=f'room{i}', description='desc')
+        room.participants.add(users[i], users[(i + 1) % size])
+        for user in (users[i], users[(i + 1) % size]):
+            Message.objects.create(user=user, room=room, body=f'hello from {user}')
+    return users
+
+
+class QueryCountTests(TestCase):
+    '''Every view has to render with a fixed number of queries, no matter how many
+    rooms, topics or messages there are. If one of these tests starts failing,
+    a template is probably reaching for a relation the view didn't load'''
+
+    # The number of queries each view is allowed to run, logged in or not. The
+    # session and the user come from the cache (auth.py)
+    # room and user-profile include the query of their ETag (conditional.py)
+    budgets = {
+        'home': views.HOME_QUERY_BUDGET,
+        'room': 4,
+        'user-profile': 4,
+        'topics': 1,
+        'activity': 1,
+    }
+    sizes = [1, 5, 20]
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+
+    def urls(self, users):
+        room = Room.objects.filter(host=users[0]).first()
+        return {
+            'home': reverse('home'),
+            'room': reverse('room', args=[room.id]),
+            'user-profile': reverse('user-profile', args=[users[0].id]),
+            'topics': reverse('topics'),
+            'activity': reverse('activity'),
+        }
+
+    def measure(self, size, login=False):
+        cache.clear()
+        Room.objects.all().delete()
+        Topic.objects.all().delete()
+        User.objects.all().delete()
+        users = seed(size)
+        if login:
+            self.client.force_login(users[0])
+            # Logging in saves last_login, which drops the user from the cache
+            self.client.get(reverse('topics'))
+        return {name: self.count_queries(url) for name, url in self.urls(users).items()}
+
+    def test_query_count_does_not_grow_with_data(self):
+        results = [self.measure(size) for size in self.sizes]
+        for name, budget in self.budgets.items():
+            counts = [result[name] for result in results]
+            with self.subTest(view=name, counts=counts):
+                self.assertLessEqual(max(counts), budget)
+                self.assertEqual(len(set(counts)), 1)
+
+    # With CACHED_AUTH, the session and the user don't add queries
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+                       AUTHENTICATION_BACKENDS=['base.auth.CachedModelBackend'])
+    def test_logged_in_query_count_does_not_grow_with_data(self):
+        results = [self.measure(size, login=True) for size in self.sizes]
+        for name, budget in self.budgets.items():
+            counts = [result[name] for result in results]
+            with self.subTest(view=name, counts=counts):
+                self.assertLessEqual(max(counts), budget)
+                self.assertEqual(len(set(counts)), 1)
+
+
+@override_settings(FEED_PAGE_SIZE=3)
+class PaginationTests(TestCase):
+    def setUp(self):
+        seed(10)
+
+    def walk(self, queryset):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = paginate(queryset, cursor)
+            self.assertLessEqual(len(rows), 3)
+            seen.extend(rows)
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_row_once(self):
+        self.assertEqual(
+            [room.id for room in self.walk(Room.objects.all())],
+            list(Room.objects.order_by('-updated', '-created', '-id').values_list('id', flat=True)))
+
+    def test_rows_with_the_same_timestamp_are_not_skipped(self):
+        Message.objects.update(updated=Message.objects.first().updated)
+        self.assertEqual(len(self.walk(Message.objects.all())), Message.objects.count())
+
+    def test_cursor_round_trip(self):
+        room = Room.objects.first()
+        self.assertEqual(decode_cursor(encode_cursor(room)), (room.updated, room.created, room.id))
+        # The page after the cursor starts right after its row
+        ordered = list(Room.objects.order_by('-updated', '-created', '-id'))
+        rows, _ = paginate(Room.objects.all(), encode_cursor(ordered[2]))
+        self.assertEqual(rows[0], ordered[3])
+
+    def test_broken_cursor_starts_from_the_first_page(self):
+        first_page, _ = paginate(Room.objects.all())
+        rows, _ = paginate(Room.objects.all(), 'not-a-cursor')
+        self.assertEqual(rows, first_page)
+
+    def test_views_link_to_the_next_page(self):
+        response = self.client.get(reverse('activity'))
+        self.assertEqual(len(response.context['events']), 3)
+        cursor = response.context['next_cursor']
+        self.assertEqual(cursor, str(response.context['events'][-1].id))
+        self.assertContains(response, f'?cursor={cursor}')
+
+        response = self.client.get(reverse('home'), {'q': 'room'})
+        cursor = response.context['next_cursor']
+        self.assertContains(response, f'?q=room&amp;cursor={cursor}')
+        response = self.client.get(reverse('home'), {'q': 'room', 'cursor': cursor})
+        self.assertEqual(len(response.context['rooms']), 3)
+
+
+@override_settings(ROOM_HISTORY_SIZE=5)
+class RoomHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='host')
+        self.room = Room.objects.create(host=self.user, name='busy')
+        Message.objects.bulk_create(
+            Message(user=self.user, room=self.room, body=f'message {i}') for i in range(23))
+
+    def test_room_page_only_renders_the_latest_messages(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('room', args=[self.room.id]))
+        self.assertEqual(len(response.context['room_messages']), 5)
+        self.assertContains(response, 'data-cursor="%s"' % response.context['history_cursor'])
+        queries = len(ctx)
+
+        Message.objects.bulk_create(
+            Message(user=self.user, room=self.room, body='more') for _ in range(100))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('room', args=[self.room.id]))
+        self.assertEqual(len(ctx), queries)
+
+    def test_history_walks_back_to_the_first_message(self):
+        first_page = self.client.get(reverse('room', args=[self.room.id])).context['room_messages']
+        seen = [message.id for message in first_page]
+        cursor = self.client.get(reverse('room', args=[self.room.id])).context['history_cursor']
+        while cursor:
+            data = self.client.get(reverse('room-messages', args=[self.room.id]), {'cursor': cursor}).json()
+            self.assertLessEqual(len(data['messages']), 5)
+            seen.extend(message['id'] for message in data['messages'])
+            cursor = data['next_cursor']
+        self.assertEqual(seen, list(self.room.message_set.order_by(
+            '-updated', '-created', '-id').values_list('id', flat=True)))
+
+    def test_history_of_a_missing_room_is_404(self):
+        self.assertEqual(self.client.get(reverse('room-messages', args=[999])).status_code, 404)
+
+@override_settings(ROOM_HISTORY_SIZE=5, FEED_PAGE_SIZE=5)
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='writer')
+        self.room = Room.objects.create(host=self.user, name='old room')
+        for i in range(12):
+            Message.objects.create(user=self.user, room=self.room, body=f'message {i}')
+        # The first 8 are old
+        old = timezone.now() - timedelta(days=365)
+        for message in Message.objects.order_by('id')[:8]:
+            Message.objects.filter(id=message.id).update(updated=old + timedelta(minutes=message.id))
+        self.order = list(Message.objects.order_by(
+            '-updated', '-created', '-id').values_list('id', flat=True))
+
+    def archive(self, **options):
+        call_command('archive_messages', days=30, stdout=StringIO(), **options)
+        self.room.refresh_from_db()
+
+    def test_old_messages_move_to_the_archive(self):
+        self.archive(compress=True)
+        self.assertEqual(Message.objects.count(), 4)
+        self.assertEqual(ArchivedMessage.objects.count(), 8)
+        self.assertEqual((self.room.message_count, self.room.archived_count), (4, 8))
+        archived = ArchivedMessage.objects.get(id=self.order[-1])
+        self.assertTrue(archived.compressed)
+        self.assertEqual(archived.body, 'message 0')
+        # Running it again moves nothing
+        self.archive()
+        self.assertEqual(ArchivedMessage.objects.count(), 8)
+
+    def test_room_history_goes_on_into_the_archive(self):
+        self.archive()
+        self.assertEqual(self.walk_history(), self.order)
+
+    def test_archived_messages_cant_be_deleted_or_edited(self):
+        self.archive()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('room', args=[self.room.id]))
+        # The 4 hot messages and the newest archived one
+        archived = [message.id for message in response.context['room_messages'] if message.archived]
+        self.assertEqual(len(archived), 1)
+        self.assertNotContains(response, reverse('delete-message', args=[archived[0]]))
+        self.assertContains(response, reverse('delete-message', args=[self.order[0]]))
+        for name in ('delete-message', 'update-message'):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(reverse(name, args=[archived[0]])).status_code, 404)
+
+    def test_activity_keeps_the_archived_messages(self):
+        # The events aren't archived, only the messages
+        self.archive()
+        self.client.force_login(self.user)
+        seen, pages, cursor = [], '', ''
+        while cursor is not None:
+            response = self.client.get(reverse('activity'), {'cursor': cursor})
+            seen.extend(event.body for event in response.context['events'] if event.body)
+            pages += response.content.decode()
+            cursor = response.context['next_cursor']
+        self.assertEqual(sorted(seen), sorted(f'message {i}' for i in range(12)))
+        # But only the hot messages can still be deleted
+        for message_id in self.order:
+            with self.subTest(message_id=message_id):
+                self.assertEqual(reverse('delete-message', args=[message_id]) in pages,
+                                 message_id in self.order[:4])
+
+    def walk_history(self):
+        response = self.client.get(reverse('room', args=[self.room.id]))
+        seen = [message.id for message in response.context['room_messages']]
+        cursor = response.context['history_cursor']
+        while cursor:
+            data = self.client.get(reverse('room-messages', args=[self.room.id]), {'cursor': cursor}).json()
+            seen.extend(message['id'] for message in data['messages'])
+            cursor = data['next_cursor']
+        return seen
+
+    def test_newer_archived_messages_are_merged_in_order(self):
+        self.archive()
+        # Archived while older messages are still hot, like an import with dates
+        newest = Message.objects.create(user=self.user, room=self.room, body='newest')
+        archive.move([newest])
+        self.assertEqual(self.walk_history(), [newest.id] + self.order)
+
+    def test_rooms_without_archive_do_not_touch_it(self):
+        self.archive()
+        other = Room.objects.create(host=self.user, name='new room')
+        Message.objects.create(user=self.user, room=other, body='hi')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('room', args=[other.id]))
+        self.assertFalse(any('base_archivedmessage' in query['sql'] for query in ctx))
+
+    def test_deleting_the_room_deletes_its_archive(self):
+        self.archive()
+        self.room.delete()
+        self.assertFalse(ArchivedMessage.objects.exists())
+
+
+class ActivityTests(TestCase):
+    def setUp(self):
+        self.users = seed(3)
+        self.room = Room.objects.filter(host=self.users[0]).first()
+
+    def verbs(self):
+        return list(ActivityEvent.objects.filter(room=self.room).values_list('verb', 'body'))
+
+    def test_events_are_appended(self):
+        message = Message.objects.create(user=self.users[1], room=self.room, body='hi')
+        message.body = 'hi!'
+        message.save()
+        self.room.name = 'renamed'
+        self.room.save()
+        self.assertEqual(self.verbs()[:3], [
+            (ActivityEvent.ROOM_UPDATED, ''),
+            (ActivityEvent.MESSAGE_UPDATED, 'hi!'),
+            (ActivityEvent.MESSAGE_CREATED, 'hi'),
+        ])
+
+    def test_deleted_messages_leave_the_feeds(self):
+        message = Message.objects.create(user=self.users[1], room=self.room, body='oops')
+        message.delete()
+        self.assertFalse(ActivityEvent.objects.filter(body='oops').exists())
+        self.assertEqual(self.verbs()[0], (ActivityEvent.MESSAGE_DELETED, ''))
+        # Deleting the room takes its events, and records nothing
+        self.room.delete()
+        self.assertFalse(ActivityEvent.objects.filter(room_id=self.room.id).exists())
+
+    def joined(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('activity'), {'feed': 'joined'})
+        return [event.id for event in response.context['events']]
+
+    def test_joined_rooms_feed_with_and_without_fan_out(self):
+        user = self.users[1]
+        expected = list(ActivityEvent.objects.filter(
+            room__participants=user).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(self.joined(user), expected)
+        with self.settings(ACTIVITY_FAN_OUT=True):
+            call_command('fill_activity_inboxes', stdout=StringIO())
+            self.assertEqual(self.joined(user), expected)
+            # New events go straight to the inboxes
+            message = Message.objects.create(user=self.users[0], room=self.room, body='fan out')
+            self.assertEqual(ActivityInbox.objects.filter(event__message_id=message.id).count(), 2)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.joined(user)[0], ActivityEvent.objects.get(message_id=message.id).id)
+            self.assertFalse(any('base_room_participants' in query['sql'] for query in ctx))
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.users = seed(3)
+        self.room = Room.objects.filter(host=self.users[0]).first()
+        self.url = f'/api/rooms/{self.room.id}/messages/'
+
+    def post(self, messages, user=None):
+        if user:
+            self.client.force_login(user)
+        return self.client.post(self.url, messages, content_type='application/json')
+
+    def test_posting_a_batch(self):
+        self.assertEqual(self.post([{'body': 'hi'}]).status_code, 403)
+        updated = self.room.updated
+        response = self.post([{'body': f'bot {i}'} for i in range(5)], self.users[2])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['ids']), 5)
+        self.room.refresh_from_db()
+        self.assertGreater(self.room.updated, updated)
+        self.assertEqual((self.room.message_count, self.room.participant_count), (7, 3))
+        self.assertTrue(self.room.participants.filter(id=self.users[2].id).exists())
+        self.assertEqual(ActivityEvent.objects.filter(body__startswith='bot ').count(), 5)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        self.client.force_login(self.users[2])
+        # Logging in drops the user from the cache, the first request loads it
+        self.client.get(reverse('topics'))
+        counts = []
+        for size in (1, 50):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.post([{'body': 'x'}] * size).status_code, 201)
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1])
+
+    @override_settings(INGEST_MAX_BATCH=3)
+    def test_bad_batches_are_rejected(self):
+        for messages in ([], [{'body': ''}], [{'text': 'hi'}], [{'body': 'hi'}] * 4, {'body': 'hi'}):
+            with self.subTest(messages=messages):
+                self.assertEqual(self.post(messages, self.users[1]).status_code, 400)
+        self.assertEqual(self.room.message_set.count(), 2)
+
+    def test_import_command(self):
+        other = Room.objects.exclude(id=self.room.id).first()
+        lines = [
+            {'room': self.room.id, 'user': 'user2', 'body': 'old', 'created': '2020-01-01T10:00:00Z'},
+            {'room': self.room.id, 'user': self.users[1].id, 'body': 'new'},
+            {'room': other.id, 'user': 'user0', 'body': 'elsewhere'},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write('\n'.join(json.dumps(line) for line in lines) + '\n')
+        out = StringIO()
+        call_command('import_messages', f.name, stdout=out)
+        Path(f.name).unlink()
+        self.assertIn('3 messages imported', out.getvalue())
+        # Older than MESSAGE_ARCHIVE_DAYS, so it went to the archive
+        old = ArchivedMessage.objects.get(room_id=self.room.id)
+        self.assertEqual(old.body, 'old')
+        self.assertEqual((old.created.year, old.updated.year), (2020, 2020))
+        self.assertTrue(self.room.participants.filter(username='user2').exists())
+        # Imported history isn't new activity
+        self.assertFalse(ActivityEvent.objects.filter(message_id=old.id).exists())
+        self.assertEqual(Room.objects.get(id=other.id).message_count, 3)
+
+    @override_settings(MESSAGE_ARCHIVE_DAYS=30)
+    def test_old_imported_messages_are_archived(self):
+        now = timezone.now()
+        ingest.ingest(self.room, [
+            {'user_id': self.users[1].id, 'body': 'last year', 'created': now - timedelta(days=365)},
+            {'user_id': self.users[1].id, 'body': 'last week', 'created': now - timedelta(days=7)},
+            {'user_id': self.users[2].id, 'body': 'two years ago', 'created': now - timedelta(days=730)},
+            {'user_id': self.users[2].id, 'body': 'now'},
+        ])
+        self.assertEqual(sorted(m.body for m in ArchivedMessage.objects.filter(room_id=self.room.id)),
+                         ['last year', 'two years ago'])
+        self.assertFalse(Message.objects.filter(body__in=['last year', 'two years ago']).exists())
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.message_count, self.room.archived_count), (4, 2))
+        # The room history still goes from the newest to the oldest
+        response = self.client.get(reverse('room', args=[self.room.id]))
+        bodies = [message.body for message in response.context['room_messages']]
+        cursor = response.context['history_cursor']
+        while cursor:
+            data = self.client.get(reverse('room-messages', args=[self.room.id]), {'cursor': cursor}).json()
+            bodies.extend(message['body'] for message in data['messages'])
+            cursor = data['next_cursor']
+        self.assertEqual(bodies[-3:], ['last week', 'last year', 'two years ago'])
+        self.assertEqual(len(bodies), 6)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='host')
+        python = Topic.objects.create(name='Python')
+        design = Topic.objects.create(name='Design')
+        self.django = Room.objects.create(
+            host=self.user, topic=python, name='Django girls', description='Learning views')
+        self.figma = Room.objects.create(
+            host=self.user, topic=design, name='Figma', description='Python plugins for figma')
+
+    def test_rooms_are_ranked_by_where_the_match_is(self):
+        # A topic match ranks higher than a description match
+        self.assertEqual(search.search_rooms('python'), [self.django.id, self.figma.id])
+        self.assertEqual(search.search_rooms('pyth'), [self.django.id, self.figma.id])
+        self.assertEqual(search.search_rooms('figma'), [self.figma.id])
+        self.assertEqual(search.count_rooms('views'), 1)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.figma.name = 'Sketch'
+        self.figma.save()
+        self.assertEqual(search.search_rooms('sketch'), [self.figma.id])
+        self.assertEqual(search.search_rooms('figma'), [self.figma.id])  # still in the description
+        self.django.topic.name = 'Golang'
+        self.django.topic.save()
+        self.assertEqual(search.search_rooms('golang'), [self.django.id])
+        self.assertEqual(search.search_topics('golang'), [self.django.topic.id])
+        self.django.topic.delete()
+        self.assertEqual(search.search_rooms('golang'), [])
+        self.assertEqual(search.search_topics('golang'), [])
+        self.django.delete()
+        self.assertEqual(search.search_rooms('django'), [])
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM base_room_fts')
+        self.assertEqual(search.search_rooms('figma'), [])
+        search.rebuild()
+        self.assertEqual(search.search_rooms('figma'), [self.figma.id])
+
+    def test_fts_syntax_is_not_injected(self):
+        self.assertEqual(search.search_rooms('"figma" * ('), [self.figma.id])
+
+    def test_home_and_topics_use_the_index(self):
+        response = self.client.get(reverse('home'), {'q': 'design'})
+        self.assertEqual(response.context['rooms'], [self.figma])
+        self.assertEqual(response.context['room_count'], 1)
+        response = self.client.get(reverse('topics'), {'q': 'des'})
+        self.assertEqual([topic.name for topic in response.context['topics']], ['Design'])
+
+
+class TopicRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='alice')
+        for name, rooms in [('Python', 2), ('PyTorch', 1), ('pygame', 0), ('Design', 3)]:
+            topic = Topic.objects.create(name=name)
+            for i in range(rooms):
+                Room.objects.create(host=self.user, topic=topic, name=f'{name}{i}')
+
+    def test_prefix_search(self):
+        registry = topics.get_registry()
+        self.assertEqual([topic.name for topic in registry.starting_with('py')],
+                         ['pygame', 'Python', 'PyTorch'])
+        self.assertEqual([topic.name for topic in registry.starting_with('PYT')], ['Python', 'PyTorch'])
+        self.assertEqual([topic.name for topic in registry.starting_with('py', limit=1)], ['pygame'])
+        self.assertEqual(registry.starting_with('rust'), [])
+        # Nothing typed yet, the most popular ones
+        self.assertEqual(registry.starting_with('')[0].name, 'Design')
+        self.assertEqual(registry.get('Python').room_count, 2)
+
+    def test_loaded_once_until_topics_or_rooms_change(self):
+        topics.get_registry()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(topics.get_registry()), 4)
+        Topic.objects.create(name='Rust')
+        self.assertEqual(topics.get_registry().get('Rust').room_count, 0)
+        Room.objects.create(host=self.user, topic=Topic.objects.get(name='Rust'), name='ferris')
+        self.assertEqual(topics.get_registry().get('Rust').room_count, 1)
+
+    def test_loaded_again_after_the_timeout(self):
+        # Another process added a topic, the version bump stayed in its cache
+        topics.get_registry()
+        Topic.objects.bulk_create([Topic(name='Rust')])
+        self.assertIsNone(topics.get_registry().get('Rust'))
+        later = time.monotonic() + settings.TOPIC_REGISTRY_TIMEOUT
+        with mock.patch('base.topics.time.monotonic', return_value=later):
+            self.assertIsNotNone(topics.get_registry().get('Rust'))
+
+    def test_pages_read_topics_from_memory(self):
+        self.client.get(reverse('home'))
+        self.client.force_login(self.user)
+        for url in [reverse('topics') + '?q=py', reverse('create-room'), reverse('user-profile', args=[self.user.id])]:
+            with self.subTest(url=url), CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('FROM "base_topic"' in query['sql'] for query in ctx))
+        response = self.client.get(reverse('topics'), {'q': 'py'})
+        self.assertEqual([topic.name for topic in response.context['topics']], ['Python', 'PyTorch', 'pygame'])
+        response = self.client.get(reverse('topic-autocomplete'), {'q': 'pyt'})
+        self.assertEqual(response.json(), {'topics': [
+            {'id': Topic.objects.get(name='Python').id, 'name': 'Python', 'room_count': 2},
+            {'id': Topic.objects.get(name='PyTorch').id, 'name': 'PyTorch', 'room_count': 1},
+        ]})
+
+
+# Tasks for TaskTests
+flaky_calls = []
+
+
+@tasks.task
+def flaky(failures):
+    '''Fails the first `failures` times'''
+    flaky_calls.append(failures)
+    if len(flaky_calls) <= failures:
+        raise RuntimeError('flaky')
+
+
+@override_settings(TASK_BACKEND='database')
+class TaskTests(TestCase):
+    def setUp(self):
+        flaky_calls.clear()
+        self.user = User.objects.create(username='host')
+
+    def test_database_backend_defers_the_search_index(self):
+        room = Room.objects.create(host=self.user, name='Django girls')
+        self.assertEqual(Task.objects.filter(name='base.search.sync_rooms').count(), 1)
+        self.assertEqual(search.search_rooms('django'), [])
+        call_command('run_tasks', once=True, stderr=StringIO())
+        self.assertEqual(search.search_rooms('django'), [room.id])
+        self.assertFalse(Task.objects.exists())
+
+        room.delete()
+        call_command('run_tasks', once=True, stderr=StringIO())
+        self.assertEqual(search.search_rooms('django'), [])
+
+    @override_settings(TASK_MAX_ATTEMPTS=2, TASK_RETRY_DELAY=60)
+    def test_failed_tasks_are_retried_and_then_given_up(self):
+        flaky.defer(5)
+        with self.assertLogs('base.tasks', 'ERROR'):
+            self.assertEqual(tasks.work(), 1)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.PENDING, 1))
+        self.assertIn('RuntimeError', task.error)
+        self.assertGreater(task.run_at, timezone.now() + timedelta(seconds=50))
+        # Not due yet
+        self.assertEqual(tasks.work(), 0)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('base.tasks', 'ERROR'):
+            tasks.work()
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+        self.assertEqual(tasks.work(), 0)
+
+    def test_lost_tasks_are_run_again(self):
+        flaky.defer(0)
+        Task.objects.update(status=Task.RUNNING, started=timezone.now() - timedelta(hours=1))
+        self.assertEqual(tasks.work(), 1)
+        self.assertEqual(flaky_calls, [0])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASK_BACKEND='thread', TASK_RETRY_DELAY=0)
+    def test_thread_backend_runs_after_the_commit_and_retries(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            flaky.defer(1)
+        self.assertEqual(flaky_calls, [])
+        with self.assertLogs('base.tasks', 'ERROR'):
+            callbacks[0]()
+            deadline = time.monotonic() + 5
+            while len(flaky_calls) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(flaky_calls, [1, 1])
+
+    @override_settings(ACTIVITY_FAN_OUT=True)
+    def test_fan_out_is_deferred_and_can_run_twice(self):
+        room = Room.objects.create(host=self.user, name='Django')
+        room.participants.add(self.user)
+        Message.objects.create(user=self.user, room=room, body='hello')
+        self.assertFalse(ActivityInbox.objects.exists())
+        tasks.work()
+        event = ActivityEvent.objects.get(verb=ActivityEvent.MESSAGE_CREATED)
+        activity.fan_out([[event.id, room.id]])
+        self.assertEqual(ActivityInbox.objects.filter(event=event).count(), 1)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.python = Topic.objects.create(name='Python')
+        self.design = Topic.objects.create(name='Design')
+        self.room = Room.objects.create(host=self.alice, topic=self.python, name='Django')
+
+    def assertCounts(self, room_count=None, participants=None, messages=None):
+        if room_count is not None:
+            self.assertEqual(
+                list(Topic.objects.order_by('name').values_list('room_count', flat=True)),
+                room_count)
+        self.room.refresh_from_db()
+        if participants is not None:
+            self.assertEqual(self.room.participant_count, participants)
+        if messages is not None:
+            self.assertEqual(self.room.message_count, messages)
+
+    def test_topic_room_count(self):
+        self.assertCounts(room_count=[0, 1])
+        Room.objects.create(host=self.bob, topic=self.design, name='Figma')
+        self.assertCounts(room_count=[1, 1])
+        self.room.topic = self.design
+        self.room.save()
+        self.assertCounts(room_count=[2, 0])
+        self.room.save()
+        self.assertCounts(room_count=[2, 0])
+        self.room.delete()
+        self.assertEqual(Topic.objects.get(name='Design').room_count, 1)
+
+    def test_participant_count(self):
+        self.room.participants.add(self.alice, self.bob)
+        self.room.participants.add(self.alice)
+        self.assertCounts(participants=2)
+        self.room.participants.remove(self.bob, self.bob)
+        self.assertCounts(participants=1)
+        self.bob.participants.add(self.room)
+        self.assertCounts(participants=2)
+        self.bob.participants.clear()
+        self.assertCounts(participants=1)
+        self.room.participants.clear()
+        self.assertCounts(participants=0)
+
+    def test_deleting_a_participant(self):
+        self.room.participants.add(self.alice, self.bob)
+        self.bob.delete()
+        self.assertCounts(participants=1)
+        self.assertEqual(counters.drift(Room, 'participant_count', counters.room_participants), 0)
+
+    def test_message_count(self):
+        message = Message.objects.create(user=self.alice, room=self.room, body='hi')
+        Message.objects.create(user=self.bob, room=self.room, body='hello')
+        message.body = 'edited'
+        message.save()
+        self.assertCounts(messages=2)
+        message.delete()
+        self.assertCounts(messages=1)
+
+    def test_repair_counters(self):
+        Message.objects.create(user=self.alice, room=self.room, body='hi')
+        self.room.participants.add(self.bob)
+        Topic.objects.update(room_count=7)
+        Room.objects.update(participant_count=0, message_count=0)
+        out = StringIO()
+        call_command('repair_counters', stdout=out)
+        self.assertIn('Topic.room_count: 2 rows repaired', out.getvalue())
+        self.assertIn('Room.message_count: 1 rows repaired', out.getvalue())
+        self.assertCounts(room_count=[0, 1], participants=1, messages=1)
+
+
+class ChatTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.room = Room.objects.create(host=self.user, name='Django')
+
+    async def connect(self, user=None):
+        communicator = WebsocketCommunicator(application, f'/ws/room/{self.room.id}/',
+                                             headers=[(b'origin', b'http://testserver')])
+        if user is not None:
+            communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_messages_are_sent_to_every_socket_of_the_room(self):
+        sender = await self.connect(self.user)
+        listener = await self.connect()
+        await sender.send_json_to({'body': 'hello'})
+        for communicator in (sender, listener):
+            data = await communicator.receive_json_from()
+            self.assertEqual(data['message']['body'], 'hello')
+            self.assertEqual(data['message']['username'], 'alice')
+        self.assertTrue(await sync_to_async(
+            self.room.participants.filter(id=self.user.id).exists)())
+        await sender.disconnect()
+        await listener.disconnect()
+
+    async def test_messages_posted_with_the_form_are_sent_too(self):
+        listener = await self.connect()
+        await sync_to_async(self.client.force_login)(self.user)
+        await sync_to_async(self.client.post)(reverse('room', args=[self.room.id]), {'body': 'hi'})
+        data = await listener.receive_json_from()
+        self.assertEqual(data['message']['body'], 'hi')
+        await listener.disconnect()
+
+    @override_settings(RATE_LIMITS={'message': '1/m'})
+    async def test_posting_too_fast_over_the_socket(self):
+        await sync_to_async(cache.clear)()
+        sender = await self.connect(self.user)
+        await sender.send_json_to({'body': 'one'})
+        self.assertIn('message', await sender.receive_json_from())
+        await sender.send_json_to({'body': 'two'})
+        self.assertGreater((await sender.receive_json_from())['retry_after'], 0)
+        self.assertEqual(await Message.objects.acount(), 1)
+        await sender.disconnect()
+
+    async def test_anonymous_users_cant_post(self):
+        listener = await self.connect()
+        await listener.send_json_to({'body': 'hello'})
+        self.assertIn('error', await listener.receive_json_from())
+        self.assertEqual(await Message.objects.acount(), 0)
+        await listener.disconnect()
+
+    async def test_bad_input_does_not_crash_the_socket(self):
+        for url in ('/ws/room/abc/', '/ws/room/999/'):
+            with self.subTest(url=url):
+                communicator = WebsocketCommunicator(application, url,
+                                                     headers=[(b'origin', b'http://testserver')])
+                connected, _ = await communicator.connect()
+                self.assertFalse(connected)
+
+        sender = await self.connect(self.user)
+        for content in (['hello'], 'hello', 1):
+            with self.subTest(content=content):
+                await sender.send_json_to(content)
+                self.assertIn('error', await sender.receive_json_from())
+        # The room was deleted after the socket connected
+        await self.room.adelete()
+        await sender.send_json_to({'body': 'hello'})
+        self.assertIn('error', await sender.receive_json_from())
+        self.assertEqual((await sender.receive_output())['type'], 'websocket.close')
+        self.assertEqual(await Message.objects.acount(), 0)
+
+
+class QueryPlanTests(TestCase):
+    '''Runs EXPLAIN QUERY PLAN on every query of the views, with enough rows for
+    SQLite to prefer an index when there is one. A plain "SCAN base_room" means
+    the whole table is read, and a temp B-tree means rows are sorted in memory'''
+
+    big_tables = ('base_room', 'base_message', 'base_activityevent')
+    # The events are read in primary key order, which SQLite also calls a SCAN
+    # of the table (backwards, until the LIMIT). Sorting them is still wrong
+    scanned_tables = ('base_room', 'base_message')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.rooms = bulk_seed()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def plans(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                yield query['sql'], [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScans(self, url):
+        for sql, plan in self.plans(url):
+            # The quotes leave out the FTS tables, ranking the matches has to sort them
+            touches_big_table = any(f'"{table}"' in sql for table in self.big_tables)
+            for step in plan:
+                with self.subTest(url=url, sql=sql, step=step):
+                    self.assertFalse(step.startswith(tuple(f'SCAN {table}' for table in self.scanned_tables))
+                                     and 'INDEX' not in step)
+                    self.assertFalse(touches_big_table and 'TEMP B-TREE' in step)
+
+    def test_views_use_indexes(self):
+        user, room = self.users[0], self.rooms[0]
+        first_page = self.client.get(reverse('activity')).context['next_cursor']
+        for url in [
+            reverse('home'),
+            reverse('home') + '?q=bulk1',
+            reverse('room', args=[room.id]),
+            reverse('user-profile', args=[user.id]),
+            reverse('activity'),
+            reverse('activity') + f'?cursor={first_page}',
+            reverse('topics') + '?q=bulk',
+        ]:
+            self.assertNoFullScans(url)
+        self.client.force_login(user)
+        self.assertNoFullScans(reverse('home'))
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='alice')
+        self.topic = Topic.objects.create(name='Python')
+        self.room = Room.objects.create(host=self.user, topic=self.topic, name='Django')
+        Message.objects.create(user=self.user, room=self.room, body='hello')
+
+    def test_warm_cache_skips_the_topics_query(self):
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as warm:
+            response = self.client.get(reverse('home'))
+        # The room count is cached too
+        self.assertEqual(len(warm), len(cold) - 2)
+        self.assertFalse(any(query['sql'].startswith('SELECT "base_topic"') for query in warm))
+        self.assertContains(response, 'Python <span>1</span>')
+
+    def test_profile_sidebar_shows_every_topic(self):
+        for i in range(6):
+            Topic.objects.create(name=f'extra{i}')
+        home = self.client.get(reverse('home'))
+        self.assertEqual(len(home.context['topics']), 5)
+        # Its own fragment, not the one home just cached
+        profile = self.client.get(reverse('user-profile', args=[self.user.id]))
+        self.assertEqual(len(profile.context['topics']), 7)
+        for i in range(6):
+            self.assertContains(profile, f'extra{i} <span>0</span>')
+
+    def test_fragments_follow_the_objects(self):
+        self.client.get(reverse('home'))
+        self.room.name = 'Flask'
+        self.room.save()
+        Topic.objects.create(name='Golang')
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Flask')
+        self.assertContains(response, 'Golang')
+
+    def test_delete_button_is_not_cached(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('activity')), 'delete-message')
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse('activity')), 'delete-message')
+
+
+# What CACHED_AUTH turns on, it's off by default with the locmem cache
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+                   AUTHENTICATION_BACKENDS=['base.auth.CachedModelBackend'])
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='secret-pass-1')
+        self.room = Room.objects.create(host=self.user, name='Django')
+        Message.objects.create(user=self.user, room=self.room, body='hello')
+        self.client.force_login(self.user)
+        self.client.get(reverse('topics'))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.wsgi_request.user.is_authenticated)
+        return len(ctx)
+
+    def test_logged_in_pages_skip_the_session_and_user_queries(self):
+        urls = [reverse('home'), reverse('room', args=[self.room.id]), reverse('activity')]
+        # The fragments and counts are cached by the first round
+        for url in urls:
+            self.client.get(url)
+        cached = [self.count_queries(url) for url in urls]
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.db',
+                           AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend']):
+            # A new client, the middleware reads SESSION_ENGINE when it's created
+            self.client = self.client_class()
+            self.client.force_login(self.user)
+            uncached = [self.count_queries(url) for url in urls]
+        for before, after in zip(uncached, cached):
+            self.assertLessEqual(after, before - 2)
+
+    def test_changes_to_the_user_are_seen_right_away(self):
+        self.user.username = 'alice2'
+        self.user.save()
+        request = self.client.get(reverse('topics')).wsgi_request
+        self.assertEqual(request.user.username, 'alice2')
+
+        self.user.set_password('another-pass-2')
+        self.user.save()
+        # The session hash doesn't match the new password, so it's logged out
+        request = self.client.get(reverse('topics')).wsgi_request
+        self.assertFalse(request.user.is_authenticated)
+
+    def test_async_lookup_uses_the_cache(self):
+        backend = auth.CachedModelBackend()
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(backend.aget_user)(self.user.id), self.user)
+        auth.forget_user(self.user.id)
+        with self.assertNumQueries(1):
+            async_to_sync(backend.aget_user)(self.user.id)
+        with self.assertNumQueries(0):
+            backend.get_user(self.user.id)
+
+
+@override_settings(RATE_LIMITS={'message': '2/m', 'room': '1/h', 'login': '2/m', 'register': '1/h'})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.room = Room.objects.create(host=self.alice, name='Django')
+        self.url = reverse('room', args=[self.room.id])
+
+    def test_posting_too_fast_gets_a_429(self):
+        self.client.force_login(self.alice)
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.url, {'body': 'hi'}).status_code, 302)
+        response = self.client.post(self.url, {'body': 'hi'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.room.message_set.count(), 2)
+        # Reading isn't limited, and the limit is per user
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.post(self.url, {'body': 'hi'}).status_code, 302)
+
+    def test_room_creation_is_limited(self):
+        self.client.force_login(self.alice)
+        data = {'topic': 'Python', 'name': 'One', 'description': ''}
+        self.assertEqual(self.client.post(reverse('create-room'), data).status_code, 302)
+        self.assertEqual(self.client.post(reverse('create-room'), data).status_code, 429)
+
+    def test_logged_out_clients_are_limited_by_ip(self):
+        data = {'username': 'alice', 'password': 'wrong'}
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('login'), data).status_code, 200)
+        self.assertEqual(self.client.post(reverse('login'), data).status_code, 429)
+        other = self.client_class(REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other.post(reverse('login'), data).status_code, 200)
+
+    def test_the_api_shares_the_limit(self):
+        self.client.force_login(self.alice)
+        self.client.post(self.url, {'body': 'hi'})
+        api = f'/api/rooms/{self.room.id}/messages/'
+        post = lambda: self.client.post(api, [{'body': 'hi'}], content_type='application/json')
+        self.assertEqual(post().status_code, 201)
+        response = post()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(RATE_LIMITS={'message': '30/m', 'ingest': '1500/h'})
+    def test_a_batch_counts_every_message(self):
+        self.client.force_login(self.alice)
+        api = f'/api/rooms/{self.room.id}/messages/'
+        post = lambda size: self.client.post(api, [{'body': 'hi'}] * size, content_type='application/json')
+        self.assertEqual(post(settings.INGEST_MAX_BATCH).status_code, 201)
+        # One request, but 1000 of the 1500 messages
+        response = post(settings.INGEST_MAX_BATCH)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.room.message_set.count(), settings.INGEST_MAX_BATCH)
+
+    @override_settings(RATE_LIMITS={'message': '30/m', 'ingest': '1500/h'}, INGEST_MAX_BATCH=100)
+    def test_an_oversized_batch_is_charged_as_the_biggest_one(self):
+        self.client.force_login(self.alice)
+        api = f'/api/rooms/{self.room.id}/messages/'
+        post = lambda size: self.client.post(api, [{'body': 'hi'}] * size, content_type='application/json')
+        # A 400, not an hour of 429s
+        self.assertEqual(post(5000).status_code, 400)
+        self.assertEqual(post(100).status_code, 201)
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_limits_can_be_turned_off(self):
+        self.client.force_login(self.alice)
+        for _ in range(5):
+            self.assertEqual(self.client.post(self.url, {'body': 'hi'}).status_code, 302)
+
+    def test_sliding_window(self):
+        window = ratelimit.SlidingWindow()
+        with mock.patch('base.ratelimit.time.time', return_value=600.0):
+            self.assertEqual([window.hit('k', 10, 60) for _ in range(10)], [None] * 10)
+            # The next window starts in 60 seconds
+            self.assertEqual(window.hit('k', 10, 60), 60)
+        with mock.patch('base.ratelimit.time.time', return_value=660.0 + 30):
+            # Half of the previous window (11 hits) still counts
+            self.assertEqual([window.hit('k', 10, 60) for _ in range(4)], [None] * 4)
+            # 5.5 + 5 > 10, it fits when the previous window weighs 5 hits or
+            # less, at 60 * (1 - 5 / 11) = 32.7 seconds into this one
+            self.assertEqual(window.hit('k', 10, 60), 3)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.users = seed(5)
+
+    def test_lists_are_paginated(self):
+        for url in ['/api/rooms/', '/api/topics/', '/api/messages/', '/api/users/']:
+            with self.subTest(url=url):
+                response = self.client.get(url, {'page_size': 2})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), 2)
+                next_page = self.client.get(response.json()['next'])
+                self.assertEqual(len(next_page.json()['results']), 2)
+
+    def test_filters(self):
+        user = self.users[0]
+        rooms = self.client.get('/api/rooms/', {'host': user.id}).json()['results']
+        self.assertEqual([room['host'] for room in rooms], [{'id': user.id, 'username': user.username}])
+        room = rooms[0]
+        messages = self.client.get('/api/messages/', {'room': room['id']}).json()['results']
+        self.assertEqual({message['room']['id'] for message in messages}, {room['id']})
+        self.assertEqual(self.client.get('/api/rooms/', {'topic': 'python'}).status_code, 400)
+
+    def test_topic_pages_survive_room_count_changes(self):
+        first = self.client.get('/api/topics/', {'page_size': 2}).json()
+        # The last topic becomes the most popular one between the two pages
+        last = Topic.objects.order_by('-id').first()
+        Room.objects.bulk_create(Room(host=self.users[0], topic=last, name=f'extra{i}') for i in range(3))
+        Topic.objects.filter(id=last.id).update(room_count=10)
+        ids = [topic['id'] for topic in first['results']]
+        url = first['next']
+        while url:
+            page = self.client.get(url).json()
+            ids += [topic['id'] for topic in page['results']]
+            url = page['next']
+        self.assertEqual(ids, list(Topic.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_sparse_fields(self):
+        rooms = self.client.get('/api/rooms/', {'fields': 'id,name'}).json()['results']
+        self.assertEqual(set(rooms[0]), {'id', 'name'})
+        room = self.client.get(f'/api/rooms/{rooms[0]["id"]}/', {'fields': 'name'}).json()
+        self.assertEqual(room, {'name': rooms[0]['name']})
+        users = self.client.get('/api/users/').json()['results']
+        self.assertNotIn('password', users[0])
+
+    def test_query_count_does_not_grow_with_data(self):
+        with self.assertNumQueries(2):
+            self.client.get('/api/rooms/')
+        more_rooms = Room.objects.bulk_create(
+            Room(host=self.users[0], name=f'more{i}') for i in range(30))
+        self.users[1].participants.add(*more_rooms)
+        with self.assertNumQueries(2):
+            self.client.get('/api/rooms/')
+
+    def test_values_serializers_match_the_serializers(self):
+        # With the relations that can be missing, too
+        Room.objects.create(name='no host, no topic')
+        rooms = api_rooms().order_by('id')
+        fast = RoomValuesSerializer(list(RoomValuesSerializer.queryset(Room.objects.order_by('id'))))
+        self.assertEqual(json.loads(json.dumps(fast.data)),
+                         json.loads(json.dumps(RoomSerializer(rooms, many=True).data)))
+        messages = Message.objects.select_related('user', 'room').order_by('id')
+        fast = MessageValuesSerializer(list(MessageValuesSerializer.queryset(Message.objects.order_by('id'))))
+        self.assertEqual(json.loads(json.dumps(fast.data)),
+                         json.loads(json.dumps(MessageSerializer(messages, many=True).data)))
+
+    def test_room_nests_its_relations(self):
+        room = Room.objects.filter(host=self.users[0]).first()
+        with self.assertNumQueries(3):
+            # The ETag, the room with its host and topic, and the participants
+            data = self.client.get(f'/api/rooms/{room.id}/').json()
+        self.assertEqual(data['host'], {'id': self.users[0].id, 'username': 'user0'})
+        self.assertEqual(data['topic'], {'id': room.topic_id, 'name': room.topic.name})
+        self.assertEqual(data['participants'], [{'id': user.id, 'username': user.username}
+                                                for user in room.participants.order_by('id')])
+        listed = self.client.get('/api/rooms/', {'host': self.users[0].id}).json()['results'][0]
+        self.assertEqual(listed, data)
+
+    def test_fast_renderer_matches_json_renderer(self):
+        data = {'id': 1, 'body': 'héllo \u2028 <b>', 'created': timezone.now(),
+                'amount': Decimal('1.5'), 'nested': [{'a': None, 'b': True}], 3: 'int key'}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+
+@override_settings(SHARED_CACHE=True)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = seed(3)
+        self.room = Room.objects.filter(host=self.users[0]).first()
+
+    def assertNotModified(self, url, **headers):
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        with CaptureQueriesContext(connection) as ctx:
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        return response['ETag'], len(ctx)
+
+    def test_unchanged_pages_and_api_return_304(self):
+        for url in [reverse('home'), reverse('room', args=[self.room.id]),
+                    reverse('user-profile', args=[self.users[0].id]),
+                    '/api/rooms/', f'/api/rooms/{self.room.id}/', '/api/topics/',
+                    '/api/messages/', '/api/users/']:
+            with self.subTest(url=url):
+                _, queries = self.assertNotModified(url)
+                self.assertLessEqual(queries, 1)
+
+    def test_changes_change_the_etag(self):
+        url = reverse('room', args=[self.room.id])
+        etag, _ = self.assertNotModified(url)
+        message = Message.objects.create(user=self.users[1], room=self.room, body='new')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag, _ = self.assertNotModified(url)
+        message.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag, _ = self.assertNotModified(reverse('home'))
+        Topic.objects.create(name='Golang')
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # The host shows on both pages by name
+        etags = [self.assertNotModified(page)[0] for page in (url, reverse('home'))]
+        self.users[0].username = 'renamed'
+        self.users[0].save()
+        for page, etag in zip((url, reverse('home')), etags):
+            with self.subTest(page=page):
+                self.assertEqual(self.client.get(page, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_api_etags_follow_the_counters(self):
+        urls = ['/api/rooms/', f'/api/rooms/{self.room.id}/']
+        etags = [self.assertNotModified(url)[0] for url in urls]
+        message = Message.objects.create(user=self.users[1], room=self.room, body='new')
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url, change='new message'):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etags = [self.assertNotModified(url)[0] for url in urls]
+        archive.move([message])
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url, change='archived'):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_api_etags_follow_the_nested_names(self):
+        rooms, room, messages = '/api/rooms/', f'/api/rooms/{self.room.id}/', '/api/messages/'
+        # What each rename shows up in, without any other change to it
+        for change, urls in (('topic', [rooms, room]), ('room', [messages]),
+                             ('user', [rooms, room, messages])):
+            etags = [self.assertNotModified(url)[0] for url in urls]
+            if change == 'topic':
+                self.room.topic.name = 'Renamed topic'
+                self.room.topic.save()
+            elif change == 'room':
+                self.room.name = 'Renamed room'
+                self.room.save()
+            else:
+                self.users[0].username = 'renamed'
+                self.users[0].save()
+            for url, etag in zip(urls, etags):
+                with self.subTest(url=url, change=change):
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_logging_in_again_changes_the_page_etag(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        user = self.users[1]
+        user.set_password('secret')
+        user.save()
+
+        def log_in():
+            token = client.get(reverse('login')).context['csrf_token']
+            data = {'username': user.username, 'password': 'secret', 'csrfmiddlewaretoken': token}
+            self.assertEqual(client.post(reverse('login'), data).status_code, 302)
+
+        url = reverse('room', args=[self.room.id])
+        log_in()
+        etag = client.get(url)['ETag']
+        client.get(reverse('logout'))
+        log_in()
+        # The page kept from before has a token for the old CSRF secret
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        data = {'body': 'hi', 'csrfmiddlewaretoken': response.context['csrf_token']}
+        self.assertEqual(client.post(url, data).status_code, 302)
+
+    def test_logins_keep_the_etags(self):
+        self.users[2].set_password('secret')
+        self.users[2].save()
+        urls = ['/api/rooms/', f'/api/rooms/{self.room.id}/', '/api/messages/', '/api/users/']
+        etags = [self.assertNotModified(url)[0] for url in urls]
+        self.client_class().login(username=self.users[2].username, password='secret')
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_no_304_without_a_shared_cache(self):
+        # Another process could have bumped the versions in its own cache
+        for url in [reverse('home'), reverse('room', args=[self.room.id]),
+                    reverse('user-profile', args=[self.users[0].id]),
+                    '/api/rooms/', f'/api/rooms/{self.room.id}/', '/api/messages/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertFalse(response.has_header('ETag'))
+                self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_each_user_gets_their_own_etag(self):
+        url = reverse('home')
+        etag, _ = self.assertNotModified(url)
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class DatabaseTuningTests(TestCase):
+    def test_sqlite_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # normal
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # memory
+
+
+class RoleTests(TestCase):
+    # A new process for each ROLE, the settings are read once per process
+    script = '''
+import json, sys, django
+django.setup()
+from django.conf import settings
+from django.urls import get_resolver
+print(json.dumps({
+    'urls': [str(pattern.pattern) for pattern in get_resolver().url_patterns],
+    'loaded': [name for name in ('daphne', 'rest_framework', 'django.contrib.admin') if name in sys.modules],
+    'middleware': len(settings.MIDDLEWARE),
+}))
+'''
+
+    def start(self, role):
+        env = {**os.environ, 'ROLE': role, 'DJANGO_SETTINGS_MODULE': 'studybud.settings'}
+        output = subprocess.run([sys.executable, '-c', self.script], cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output)
+
+    def test_each_role_only_loads_what_it_needs(self):
+        api = self.start('api')
+        self.assertEqual(api['urls'], ['api/'])
+        # DRF imports a part of the admin itself, but not daphne (twisted)
+        self.assertIn('rest_framework', api['loaded'])
+        self.assertNotIn('daphne', api['loaded'])
+        worker = self.start('worker')
+        self.assertEqual(worker, {'urls': [], 'loaded': [], 'middleware': 0})
+        web = self.start('web')
+        self.assertEqual(web['urls'], ['admin/', ''])
+        self.assertEqual(web['loaded'], ['django.contrib.admin'])
+
+    def test_templates_are_cached(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIsInstance(loader, CachedLoader)
+        loader.get_template('base/home.html')
+        self.assertIn('base/home.html', str(list(loader.get_template_cache)))
+
+
+class StaticFilesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        folder = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(folder.cleanup)
+        # Only our static folder, the admin and DRF files would just make it slower
+        collected = override_settings(
+            STATIC_ROOT=folder.name,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'])
+        collected.enable()
+        cls.addClassCleanup(collected.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.root = Path(folder.name)
+        cls.manifest = json.loads((cls.root / 'staticfiles.json').read_text())['paths']
+
+    def test_collectstatic_hashes_and_compresses(self):
+        css = self.manifest['styles/style.css']
+        self.assertRegex(css, r'^styles/style\.[0-9a-f]{12}\.css$')
+        original = (self.root / css).read_bytes()
+        self.assertEqual(gzip.decompress((self.root / f'{css}.gz').read_bytes()), original)
+        # PNGs are compressed already
+        self.assertFalse((self.root / (self.manifest['images/tux.png'] + '.gz')).exists())
+        # The comments are stripped from the SVGs
+        svg = (self.root / self.manifest['images/avatar.svg']).read_bytes()
+        self.assertNotIn(b'<!--', svg)
+        self.assertLess(len(svg), (settings.BASE_DIR / 'static/images/avatar.svg').stat().st_size)
+
+    def test_pages_link_the_hashed_files(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, '/static/' + self.manifest['styles/style.css'])
+        self.assertContains(response, '/static/' + self.manifest['js/script.js'])
+
+    def test_hashed_files_are_compressed_and_immutable(self):
+        url = '/static/' + self.manifest['styles/style.css']
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content),
+                         (self.root / self.manifest['styles/style.css']).read_bytes())
+
+        plain = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(int(plain['Content-Length']), len(plain.content))
+
+    def test_revalidation_and_plain_names(self):
+        response = self.client.get('/static/styles/style.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        again = self.client.get('/static/styles/style.css', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(self.client.post('/static/styles/style.css').status_code, 405)
+
+    def test_optimize_png(self):
+        pixels = zlib.compress(b'\x00' + b'\x00\x00\x00' * 64, 1)
+        image = (staticfiles.PNG_SIGNATURE
+                 + staticfiles.png_chunk(b'IHDR', struct.pack('>IIBBBBB', 64, 1, 8, 2, 0, 0, 0))
+                 + staticfiles.png_chunk(b'tEXt', b'Comment\x00made with an editor' * 10)
+                 + staticfiles.png_chunk(b'IDAT', pixels[:5])
+                 + staticfiles.png_chunk(b'IDAT', pixels[5:])
+                 + staticfiles.png_chunk(b'IEND', b''))
+        optimized = staticfiles.optimize_png(image)
+        self.assertLess(len(optimized), len(image))
+        self.assertNotIn(b'tEXt', optimized)
+        self.assertEqual(optimized.count(b'IDAT'), 1)
+        start = optimized.index(b'IDAT') + 4
+        length = struct.unpack('>I', optimized[start - 8:start - 4])[0]
+        self.assertEqual(zlib.decompress(optimized[start:start + length]), zlib.decompress(pixels))
+        self.assertEqual(staticfiles.optimize_png(b'not a png'), b'not a png')
+
+
+class BenchmarkCommandTests(TestCase):
+    # The commands send their requests to localhost
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_seed_data_and_bench_routes(self):
+        call_command('seed_data', users=5, topics=3, rooms=10, messages=40, stdout=StringIO())
+        self.assertEqual(Room.objects.count(), 10)
+        self.assertEqual(sum(Topic.objects.values_list('room_count', flat=True)), 10)
+        self.assertEqual(sum(Room.objects.values_list('message_count', flat=True)), 40)
+        self.assertGreater(search.count_rooms(Room.objects.first().name.split()[0]), 0)
+
+        out = StringIO()
+        call_command('bench_routes', iterations=2, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['dataset']['Room'], 10)
+        self.assertEqual(report['routes']['home']['status'], 200)
+        self.assertIn('/api/rooms/', report['routes'])
+        self.assertIn('p99', report['routes']['room']['latency_ms'])
+
+    def test_bench_startup(self):
+        out = StringIO()
+        call_command('bench_startup', roles=['worker'], repeat=1, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertGreater(report['roles']['worker']['modules'], 0)
+        self.assertIn('django', report['roles']['worker']['packages_ms'])
+
+    def test_bench_serializers(self):
+        seed(3)
+        out = StringIO()
+        call_command('bench_serializers', rooms=3, page_size=2, repeat=1, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['rooms'], 3)
+        self.assertEqual(report['variants']['values+fast_json']['queries_per_page'], 2)
+        # Same data, however it's made
+        self.assertEqual(report['variants']['values+json']['bytes_per_room'],
+                         report['variants']['nested_serializer+json']['bytes_per_room'])
+
+
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ['base.profiling.ProfilingMiddleware'])
+class ProfilingTests(TestCase):
+    def setUp(self):
+        seed(3)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('activity'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'sql;dur=[0-9.]+;desc="\d+ queries, 0 duplicates"')
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_duplicate_queries_are_counted(self):
+        from . import profiling
+
+        stats = profiling.RequestStats()
+        with connection.execute_wrapper(stats.record_query):
+            list(Topic.objects.all())
+            list(Topic.objects.all())
+            list(Room.objects.all())
+        self.assertEqual((stats.queries, stats.duplicates), (3, 1))
+
+    def test_metrics(self):
+        from . import profiling
+
+        self.client.get(reverse('activity'))
+        text = profiling.registry.export()
+        self.assertIn('studybud_request_duration_seconds_count{view="activity"}', text)
+        self.assertIn('studybud_request_queries_bucket{view="activity",le="+Inf"}', text)
+        response = profiling.metrics(self.client.get(reverse('activity')).wsgi_request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_on_demand(self):
+        with tempfile.TemporaryDirectory() as folder, self.settings(PROFILING_DIR=folder):
+            response = self.client.get(reverse('activity'), HTTP_X_PROFILE='1')
+            self.assertNotIn('X-Profile-File', response)
+            with self.settings(DEBUG=True):
+                response = self.client.get(reverse('activity'), HTTP_X_PROFILE='1')
+            self.assertTrue((Path(folder) / response['X-Profile-File']).exists())
+
+
+class HomeBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        bulk_seed(users=20, topics=10, rooms=200, messages=500)
+
+    def home_queries(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(reverse('home'), params).status_code, 200)
+        return [query['sql'] for query in ctx]
+
+    def test_home_stays_in_its_budget(self):
+        cold = self.home_queries()
+        self.assertLessEqual(len(cold), views.HOME_QUERY_BUDGET)
+        # The count and the sidebar come from the cache
+        warm = self.home_queries(cursor='')
+        self.assertLessEqual(len(warm), views.HOME_QUERY_BUDGET - 2)
+
+    def test_home_never_reads_whole_tables(self):
+        # Except the topics (topics.py), read whole on purpose, once until they change
+        topics.get_registry()
+        for sql in self.home_queries() + self.home_queries(q='bulk1'):
+            with self.subTest(sql=sql):
+                self.assertNotIn('"auth_user" ORDER BY', sql)
+                # The FTS tables are an index themselves
+                if sql.startswith('SELECT') and 'COUNT(' not in sql and '_fts' not in sql:
+                    self.assertTrue('LIMIT' in sql or ' IN (' in sql)
+
+    def test_room_count_is_cached_until_rooms_change(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(self.client.get(reverse('home')).context['room_count'], 200)
+        Room.objects.create(host=User.objects.first(), name='one more')
+        self.assertEqual(self.client.get(reverse('home')).context['room_count'], 201)
+
+
+# The same site, but with the read only pages served by async_views.
+# AsyncViewTests use it as ROOT_URLCONF
+urlpatterns = [
+    path('', include(base_urls.patterns(async_views))),
+    path('api/', include('base.api.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF='base.tests')
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = seed(3)
+        self.room = Room.objects.filter(host=self.users[0]).first()
+
+    async def test_pages_render_the_same_rows(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['room_count'], 3)
+        self.assertEqual(len(response.context['rooms']), 3)
+        self.assertContains(response, 'room0')
+
+        response = await self.async_client.get(reverse('home'), {'q': 'topic1'})
+        self.assertEqual([room.name for room in response.context['rooms']], ['room1'])
+
+        response = await self.async_client.get(reverse('room', args=[self.room.id]))
+        self.assertEqual(len(response.context['room_messages']), 2)
+        self.assertEqual(len(response.context['participants']), 2)
+
+        response = await self.async_client.get(reverse('user-profile', args=[self.users[0].id]))
+        self.assertEqual([room.id for room in response.context['rooms']], [self.room.id])
+
+        response = await self.async_client.get(reverse('topics'))
+        self.assertEqual(len(response.context['topics']), 3)
+
+        response = await self.async_client.get(reverse('activity'))
+        # 3 rooms and 6 messages
+        self.assertEqual(len(response.context['events']), 9)
+
+    @override_settings(SHARED_CACHE=True)
+    async def test_unchanged_pages_return_304(self):
+        for url in [reverse('home'), reverse('room', args=[self.room.id]),
+                    reverse('user-profile', args=[self.users[0].id])]:
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertTrue(response.has_header('ETag'))
+                cached = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+                self.assertEqual(cached.status_code, 304)
+
+    async def test_missing_room_is_404(self):
+        response = await self.async_client.get(reverse('room', args=[12345]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_posting_a_message_goes_to_the_sync_view(self):
+        await self.async_client.aforce_login(self.users[2])
+        url = reverse('room', args=[self.room.id])
+        response = await self.async_client.post(url, {'body': 'from async'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await self.room.message_set.filter(body='from async').aexists())
+        self.assertTrue(await self.room.participants.filter(id=self.users[2].id).aexists())
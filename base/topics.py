@@ -0,0 +1,88 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.conf import settings
+
+from . import caching
+from .models import Topic
+
+# The topics, in memory.
+#
+# The sidebar, the topics page, the topic list of the room form and the
+# autocomplete all read the topics, and there are few of them compared to the
+# rooms. So each process loads them once (one query: id, name and room_count)
+# and serves them from memory. When a topic or a room changes, signals.py
+# bumps the 'topics' version stamp (caching.py). With a shared cache
+# (settings.SHARED_CACHE) the next request of every process sees the new
+# version and loads them again. Checking the version is one cache get per
+# page that uses them. With a cache of its own, a process only sees its own
+# bumps, so the topics are also loaded again after TOPIC_REGISTRY_TIMEOUT
+# seconds whatever the version says.
+
+# What the templates use of a topic, the same attribute names as the model
+TopicEntry = namedtuple('TopicEntry', ['id', 'name', 'room_count'])
+
+
+class TopicRegistry:
+    def __init__(self, topics):
+        self.by_name = {topic.name: topic for topic in topics}
+        # Most rooms first, like the sidebar always showed them
+        self.popular = sorted(topics, key=lambda topic: (-topic.room_count, topic.id))
+        # By lowercase name, for the prefix search. `keys` is the same order
+        self.alphabetical = sorted(topics, key=lambda topic: (topic.name.casefold(), topic.id))
+        self.keys = [topic.name.casefold() for topic in self.alphabetical]
+
+    def __len__(self):
+        return len(self.popular)
+
+    def get(self, name):
+        '''The topic with exactly this name, or None'''
+        return self.by_name.get(name)
+
+    def starting_with(self, prefix, limit=10):
+        '''The topics whose name starts with `prefix`, ignoring case, in
+        alphabetical order. A binary search finds the first one, so it doesn't
+        get slower with more topics'''
+        if not prefix:
+            return self.popular[:limit]
+        prefix = prefix.casefold()
+        matches = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(matches) < limit and self.keys[i].startswith(prefix):
+            matches.append(self.alphabetical[i])
+            i += 1
+        return matches
+
+    def containing(self, q):
+        '''Like name__icontains, most rooms first'''
+        q = q.casefold()
+        return [topic for topic in self.popular if q in topic.name.casefold()]
+
+
+def load():
+    return TopicRegistry([TopicEntry(*row) for row in Topic.objects.values_list('id', 'name', 'room_count')])
+
+
+# (version, when it was loaded, registry) of this process
+loaded = (None, None, None)
+loaded_lock = threading.Lock()
+
+
+def is_current(version):
+    return loaded[0] == version and time.monotonic() - loaded[1] < settings.TOPIC_REGISTRY_TIMEOUT
+
+
+def get_registry():
+    '''The registry of the current topics, loaded again if they changed'''
+    global loaded
+    # The version is read before the topics. If they change while they load,
+    # the version is bumped again and the next call loads them one more time
+    version = caching.get_version('topics')
+    if not is_current(version):
+        with loaded_lock:
+            # Another thread may have loaded it while we waited
+            if not is_current(version):
+                loaded = (version, time.monotonic(), load())
+    return loaded[2]
@@ -1,22 +1,31 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 
 
-# name = "" is used in {%url 'name-here' %} in html
-urlpatterns = [
-    path('', views.home, name="home"),
-    path('login/', views.loginPage, name="login"),
-    path('logout/', views.logoutUser, name="logout"),
-    path('register/', views.registerPage, name="register"),
-    path('room/<str:pk>/', views.room, name="room"),  # pk means primary key
-    path('profile/<str:pk>/', views.userProfile, name="user-profile"),
+# read_views are the views of the read only pages, views or async_views
+def patterns(read_views):
+    # name = "" is used in {%url 'name-here' %} in html
+    return [
+        path('', read_views.home, name="home"),
+        path('login/', views.loginPage, name="login"),
+        path('logout/', views.logoutUser, name="logout"),
+        path('register/', views.registerPage, name="register"),
+        path('room/<str:pk>/', read_views.room, name="room"),  # pk means primary key
+        path('room/<str:pk>/messages/', views.roomMessages, name="room-messages"),
+        path('profile/<str:pk>/', read_views.userProfile, name="user-profile"),
 
-    path('create-room/', views.createRoom, name="create-room"),
-    path('update-room/<str:pk>/', views.updateRoom, name="update-room"),
-    path('delete-room/<str:pk>/', views.deleteRoom, name="delete-room"),
-    path('delete-message/<str:pk>/', views.deleteMessage, name="delete-message"),
-    path('update-message/<str:pk>/', views.updateMessage, name="update-message"),
-    path('update-user/', views.updateUser, name="update-user"),
-    path('topics', views.topicsPage, name="topics"),
-    path('activity', views.activityPage, name="activity"),
-]
+        path('create-room/', views.createRoom, name="create-room"),
+        path('update-room/<str:pk>/', views.updateRoom, name="update-room"),
+        path('delete-room/<str:pk>/', views.deleteRoom, name="delete-room"),
+        path('delete-message/<str:pk>/', views.deleteMessage, name="delete-message"),
+        path('update-message/<str:pk>/', views.updateMessage, name="update-message"),
+        path('update-user/', views.updateUser, name="update-user"),
+        path('topics', read_views.topicsPage, name="topics"),
+        path('topics/autocomplete', views.topicAutocomplete, name="topic-autocomplete"),
+        path('activity', read_views.activityPage, name="activity"),
+    ]
+
+
+# With ASYNC_VIEWS=1 the read only pages are served by async_views.py
+urlpatterns = patterns(async_views if settings.ASYNC_VIEWS else views)
@@ -1,17 +1,50 @@
-from .models import Room, Topic, Message
-from .forms import RoomForm, MessageForm, UserForm
-from django.http import HttpResponse
+from .models import Room, Topic, Message, ArchivedMessage
+from .pagination import paginate
+from . import activity, archive, caching, conditional, consumers, search
+from .ratelimit import ratelimit
+from .topics import get_registry
+from django.views.decorators.http import condition
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.db.models import Q
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
+from django.utils.functional import SimpleLazyObject
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.contrib.auth.forms import UserCreationForm
-from django.db.models import Count
 
 # Create your views here.
 
+# The forms are imported inside the views that use them: only a few rarely
+# used pages need them, and the rest of the process doesn't have to pay for
+# importing them at startup
+
+
+# The feed, activity and topics components are rendered once per row, so every
+# related object they use (room.host, room.topic, event.user, event.room...)
+# has to be loaded up front. Otherwise each row costs one extra query.
+# The participant and room counts are stored in the rows (see counters.py).
+def feed_rooms():
+    return Room.objects.select_related('host', 'topic')
+
+
+def sidebar_topics(limit=None):
+    # The most popular topics, from memory (topics.py). Lazy, so when the
+    # sidebar fragment is cached they're not even looked up
+    return SimpleLazyObject(lambda: get_registry().popular[:limit])
+
+
+# The old messages are in the archive (archive.py). These pages go on with
+# them once the hot messages run out
+def room_history(room, cursor=None):
+    # archived_count is already loaded, so a room with nothing archived never
+    # looks at the archive
+    return archive.paginate(
+        room.message_set.select_related('user'), ArchivedMessage.objects.filter(room_id=room.id),
+        cursor, settings.ROOM_HISTORY_SIZE, check=lambda: room.archived_count > 0)
+
+
 # rooms = [
 #     {'id': 1, 'name': 'Lets learn python!'},
 #     {'id': 2, 'name': 'Design with me'},
@@ -19,6 +52,7 @@ from django.db.models import Count
 # ]
 
 
+@ratelimit('login')
 def loginPage(request):
     page = 'login'
 
@@ -49,7 +83,9 @@ def logoutUser(request):
     return redirect('home')
 
 
+@ratelimit('register')
 def registerPage(request):
+    from django.contrib.auth.forms import UserCreationForm
     form = UserCreationForm()
 
     if request.method == 'POST':
@@ -72,43 +108,73 @@ def registerPage(request):
     return render(request, 'base/login_register.html', context)
 
 
+# home is the busiest page, so it has a query budget, and the tests fail if it
+# goes over it. With a cold cache (anonymous user):
+#   1. the number of rooms (cached until a room changes)
+#   2. the page of rooms, with their host and topic
+#   3. the recent activity, a bounded slice of the messages
+#   4. the topics sidebar (a cached fragment). It loads the topics in memory
+#      (topics.py) when they changed, and then it's no query at all
+# A logged in user costs nothing more, the session and the user are cached (auth.py).
+HOME_QUERY_BUDGET = 4
+
+
+@condition(etag_func=conditional.home_etag)
 def home(request):
     # q means query
     # Gets the query (?q="my_topic_name_here") from the url.
     # If there is no "q" in the url, the variable q gets the value ''
     q = request.GET.get('q') if request.GET.get('q') != None else ''
-    # Look for all the rooms that contains the characters in the topic name
-    # This uses the Q db model from Django
-    rooms = Room.objects.filter(
-        Q(topic__name__icontains=q) |
-        Q(name__icontains=q) |
-        Q(description__icontains=q)
-    )
     #topics = Topic.objects.all()
     # https://stackoverflow.com/questions/23033769/django-order-by-count
-    topics = Topic.objects.annotate(
-        count=Count('room')).order_by('-count')[0:5]  # [0:5] to get the first five
-    room_count = rooms.count()
-    room_messages = Message.objects.filter(
-        Q(room__topic__name__icontains=q)
-    )
-    print(User.objects.all())
-
-    context = {'rooms': rooms, 'topics': topics,
-               'room_count': room_count, 'room_messages': room_messages}
+    # It's lazy, so it only runs if the sidebar fragment isn't cached
+    topics = sidebar_topics(5)  # only the first five
+    cursor = request.GET.get('cursor')
+    if search.enabled(q):
+        # The search index gives us the matching rooms already ranked, and
+        # which topics match, so we don't have to LIKE '%q%' every row
+        rooms, next_cursor = search.paginate(feed_rooms(), q, cursor)
+        count = lambda: search.count_rooms(q)
+        topic_filter = Q(room__topic__in=search.search_topics(q))
+    elif q:
+        # Look for all the rooms that contains the characters in the topic name
+        # This uses the Q db model from Django
+        # feed_rooms() joins the host and the topic,
+        # so the template doesn't have to run one query per room
+        matching = feed_rooms().filter(
+            Q(topic__name__icontains=q) |
+            Q(name__icontains=q) |
+            Q(description__icontains=q)
+        )
+        count = matching.count
+        rooms, next_cursor = paginate(matching, cursor)
+        topic_filter = Q(room__topic__name__icontains=q)
+    else:
+        # No filter at all, so the feed is read straight from room_feed_idx
+        count = Room.objects.count
+        # Only one page of rooms is loaded, the cursor tells us where the page starts
+        rooms, next_cursor = paginate(feed_rooms(), cursor)
+        topic_filter = Q()
+    # Counting every matching room is the expensive part, so it's cached until
+    # a room or a topic changes
+    room_count = caching.cached(
+        f'room_count:{caching.hashed(q)}', ['rooms', 'topics'], count)
+    # The sidebar only shows the latest few events, the rest live in activityPage
+    events = activity.events().filter(topic_filter)[:settings.RECENT_ACTIVITY_SIZE]
+
+    context = {'rooms': rooms, 'topics': topics, 'q': q, 'next_cursor': next_cursor,
+               'room_count': room_count, 'events': events}
     return render(request, 'base/home.html', context)
 
 
+@condition(etag_func=conditional.room_etag, last_modified_func=conditional.room_last_modified)
+@ratelimit('message')
 def room(request, pk):  # pk comes from urls.py
-    room = Room.objects.get(id=pk)
-    # With message_set.all() we can query child objects of a specific room, and get a set of all the messages. The messages are the children
-    # _set.all() works for ONE TO MANY RELATIONSHIPS
-    room_messages = room.message_set.all()
-    # For many to many, we just use .all()
-    participants = room.participants.all()
+    room = Room.objects.select_related('host', 'topic').get(id=pk)
 
     if request.method == 'POST':
-        # Create the message if the user commented
+        # Create the message if the user commented. It goes before loading the
+        # messages, a POST only redirects so it doesn't need them
         message = Message.objects.create(
             user=request.user,
             room=room,
@@ -118,28 +184,53 @@ def room(request, pk):  # pk comes from urls.py
         room.participants.add(request.user)
         return redirect('room', pk=room.id)
 
+    # With message_set.all() we can query child objects of a specific room, and get a set of all the messages. The messages are the children
+    # _set.all() works for ONE TO MANY RELATIONSHIPS
+    # Only the latest messages are rendered, the older ones are loaded by
+    # script.js from roomMessages as the user scrolls
+    room_messages, history_cursor = room_history(room)
+    # For many to many, we just use .all()
+    participants = room.participants.all()
+
     context = {
         'room': room,
         'room_messages': room_messages,
+        'history_cursor': history_cursor,
         'participants': participants,
     }
     return render(request, 'base/room.html', context)
 
 
+def roomMessages(request, pk):
+    '''The history of a room, older than `cursor`, as JSON. Same format as the
+    messages sent through the WebSocket'''
+    room = get_object_or_404(Room, id=pk)
+    room_messages, next_cursor = room_history(room, request.GET.get('cursor'))
+    return JsonResponse({
+        'messages': [consumers.serialize_message(message) for message in room_messages],
+        'next_cursor': next_cursor,
+    })
+
+
+@condition(etag_func=conditional.profile_etag, last_modified_func=conditional.profile_last_modified)
 def userProfile(request, pk):
     user = User.objects.get(id=pk)
-    rooms = user.room_set.all()
-    room_messages = user.message_set.all()
-    topics = Topic.objects.all()
-    context = {'user': user, 'rooms': rooms,
-               'room_messages': room_messages, 'topics': topics}
+    rooms, next_cursor = paginate(
+        feed_rooms().filter(host=user), request.GET.get('cursor'))
+    events = activity.events().filter(user=user)[:settings.RECENT_ACTIVITY_SIZE]
+    topics = sidebar_topics()
+    context = {'user': user, 'rooms': rooms, 'next_cursor': next_cursor,
+               'events': events, 'topics': topics}
     return render(request, 'base/profile.html', context)
 
 
 @login_required(login_url="login")
+@ratelimit('room')
 def createRoom(request):
+    from .forms import RoomForm
     form = RoomForm()
-    topics = Topic.objects.all()
+    # The datalist of the topic input, script.js fills it as you type
+    topics = get_registry().popular[:settings.TOPIC_AUTOCOMPLETE_SIZE]
     if request.method == 'POST':
         # Fills the form with the data from the POST request
         # i think its .get("topic") because <input name="topic"/>
@@ -168,8 +259,9 @@ def createRoom(request):
 
 @login_required(login_url="login")
 def updateRoom(request, pk):
+    from .forms import RoomForm
     room = Room.objects.get(id=pk)  # Get the room to edit
-    topics = Topic.objects.all()  # Get the list of topics
+    topics = get_registry().popular[:settings.TOPIC_AUTOCOMPLETE_SIZE]  # Get the list of topics
     # We want to get some data prefilled, to know what Room we are editing.
     # Because of that, we use instance = room
     form = RoomForm(instance=room)  # Get the form with the prefilled values
@@ -209,7 +301,8 @@ def deleteRoom(request, pk):
 
 @login_required(login_url="login")
 def deleteMessage(request, pk):
-    message = Message.objects.get(id=pk)
+    # An archived message isn't in Message any more, it can't be deleted
+    message = get_object_or_404(Message, id=pk)
 
     # Check if the user editing the message is the owner of the message
     if request.user != message.user:
@@ -224,7 +317,8 @@ def deleteMessage(request, pk):
 
 @login_required(login_url="login")
 def updateMessage(request, pk):
-    message = Message.objects.get(id=pk)
+    from .forms import MessageForm
+    message = get_object_or_404(Message, id=pk)
     # We want to get some data prefilled, to know what message we are editing.
     # Because of that, we use instance = message
     form = MessageForm(instance=message)
@@ -247,6 +341,7 @@ def updateMessage(request, pk):
 
 @login_required(login_url="login")
 def updateUser(request):
+    from .forms import UserForm
     user = request.user
     form = UserForm(instance=user)
 
@@ -264,14 +359,26 @@ def updateUser(request):
 def topicsPage(request):
     q = request.GET.get('q') if request.GET.get('q') != None else ''
     # topics = Topic.objects.filter(name__icontains=q)
-    # https://stackoverflow.com/questions/23033769/django-order-by-count
-    topics = Topic.objects.annotate(
-        count=Count('room')).order_by('-count').filter(name__icontains=q)
-    context = {'topics': topics}
+    # Filtered in memory (topics.py), most rooms first
+    context = {'topics': get_registry().containing(q)}
     return render(request, 'base/topics.html', context)
 
 
+def topicAutocomplete(request):
+    '''The topics that start with ?q=, for the topic input of the room form'''
+    q = request.GET.get('q', '').strip()
+    topics = get_registry().starting_with(q, settings.TOPIC_AUTOCOMPLETE_SIZE)
+    return JsonResponse({'topics': [topic._asdict() for topic in topics]})
+
+
 def activityPage(request):
-    room_messages = Message.objects.all()
-    context = {'room_messages': room_messages}
+    # ?feed=joined is the activity in the rooms the user participates in
+    feed = request.GET.get('feed')
+    cursor = request.GET.get('cursor')
+    if feed == 'joined' and request.user.is_authenticated:
+        events, next_cursor = activity.joined_rooms(request.user, cursor)
+    else:
+        feed = None
+        events, next_cursor = activity.everyone(cursor)
+    context = {'events': events, 'next_cursor': next_cursor, 'feed': feed}
     return render(request, "base/activity.html", context)
@@ -67,3 +67,116 @@ if (photoInput)
 // Scroll to Bottom
 const conversationThread = document.querySelector(".room__box");
 if (conversationThread) conversationThread.scrollTop = conversationThread.scrollHeight;
+
+// Room chat
+// New messages of the room come through a WebSocket (base/consumers.py), so
+// the page doesn't have to be reloaded. If the socket isn't open, the form is
+// posted the normal way.
+const chatForm = document.querySelector(".room__message form");
+const threads = document.querySelector(".threads");
+
+// position is "prepend" for new messages (the newest are on top) and "append"
+// for the older ones loaded from the history
+const addThread = (message, position = "prepend") => {
+  const thread = document.createElement("div");
+  thread.classList.add("thread");
+  thread.innerHTML = `<div class="thread__top">
+      <div class="thread__author">
+        <a class="thread__authorInfo">
+          <div class="avatar avatar--small">
+            <img src="https://randomuser.me/api/portraits/men/37.jpg" />
+          </div>
+          <span></span>
+        </a>
+        <span class="thread__date"></span>
+      </div>
+    </div>
+    <div class="thread__details"></div>`;
+  // textContent, so the message can't inject HTML
+  thread.querySelector(".thread__authorInfo").href = `/profile/${message.user_id}/`;
+  thread.querySelector(".thread__authorInfo span").textContent = `@${message.username}`;
+  thread.querySelector(".thread__details").textContent = message.body;
+  thread.querySelector(".thread__date").textContent =
+    position === "prepend" ? "just now" : new Date(message.created).toLocaleString();
+  threads[position](thread);
+};
+
+if (chatForm && threads && window.WebSocket) {
+  const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+  const socket = new WebSocket(
+    `${scheme}://${window.location.host}/ws/room/${chatForm.dataset.roomId}/`
+  );
+  socket.addEventListener("message", (event) => {
+    const data = JSON.parse(event.data);
+    if (data.message) addThread(data.message);
+  });
+  chatForm.addEventListener("submit", (event) => {
+    if (socket.readyState !== WebSocket.OPEN) return;
+    event.preventDefault();
+    const input = chatForm.querySelector("input[name=body]");
+    if (input.value.trim()) socket.send(JSON.stringify({ body: input.value }));
+    input.value = "";
+  });
+}
+
+// Room history
+// The room page only renders the latest messages. The older ones are fetched
+// from /room/<id>/messages/ a page at a time, when the "Load older messages"
+// button at the end of the thread scrolls into view (or is clicked).
+const olderButton = document.querySelector(".threads__older");
+let loadingHistory = false;
+
+const loadOlder = async () => {
+  if (loadingHistory || !olderButton.dataset.cursor) return;
+  loadingHistory = true;
+  try {
+    const url = `${threads.dataset.historyUrl}?cursor=${encodeURIComponent(olderButton.dataset.cursor)}`;
+    const response = await fetch(url, { headers: { Accept: "application/json" } });
+    if (!response.ok) return;
+    const data = await response.json();
+    data.messages.forEach((message) => addThread(message, "append"));
+    if (data.next_cursor) olderButton.dataset.cursor = data.next_cursor;
+    else olderButton.remove();
+  } finally {
+    loadingHistory = false;
+  }
+};
+
+if (olderButton && threads) {
+  olderButton.addEventListener("click", loadOlder);
+  if (window.IntersectionObserver) {
+    new IntersectionObserver((entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) loadOlder();
+    }).observe(olderButton);
+  }
+}
+
+// Topic autocomplete
+// The topic input of the room form only starts with the most popular topics.
+// As you type, the ones that start with what you typed come from
+// /topics/autocomplete, which answers from memory on the server.
+const topicInput = document.querySelector("input[data-autocomplete-url]");
+const topicList = document.querySelector("#topic-list select");
+let topicTimer = null;
+
+const suggestTopics = async () => {
+  const url = `${topicInput.dataset.autocompleteUrl}?q=${encodeURIComponent(topicInput.value)}`;
+  const response = await fetch(url, { headers: { Accept: "application/json" } });
+  if (!response.ok) return;
+  const data = await response.json();
+  topicList.replaceChildren(
+    ...data.topics.map((topic) => {
+      const option = document.createElement("option");
+      option.value = topic.name;
+      option.textContent = topic.name;
+      return option;
+    })
+  );
+};
+
+if (topicInput && topicList) {
+  topicInput.addEventListener("input", () => {
+    clearTimeout(topicTimer);
+    topicTimer = setTimeout(suggestTopics, 150);
+  });
+}
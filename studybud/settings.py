@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,29 +33,74 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
-INSTALLED_APPS = [
-    'django.contrib.admin',
+# What this process does, so each one only loads what it needs (ROLE=...):
+#   - all: everything, the default. For development, the tests, and the
+#     commands that need every app (migrate, collectstatic, the benchmarks)
+#   - web: the HTML pages, the admin and the chat WebSockets
+#   - api: the REST API in base/api, nothing else
+#   - worker: run_tasks and the other commands that only use the models. No
+#     urls, no middleware
+# `python manage.py bench_startup` measures what each role costs to start.
+ROLE = os.environ.get('ROLE', 'all')
+if ROLE not in ('all', 'web', 'api', 'worker'):
+    raise ImproperlyConfigured(f'Unknown ROLE {ROLE!r}')
+SERVES_PAGES = ROLE in ('all', 'web')
+SERVES_API = ROLE in ('all', 'api')
+
+INSTALLED_APPS = []
+if ROLE == 'all':
+    # daphne makes runserver serve ASGI, so the chat WebSockets work in
+    # development. Importing it imports twisted, which is most of the startup
+    # time, and a server that already runs under daphne doesn't need it
+    INSTALLED_APPS += ['daphne']
+if SERVES_PAGES:
+    INSTALLED_APPS += ['django.contrib.admin']
+INSTALLED_APPS += [
     'django.contrib.auth',
     'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
-
-    'base.apps.BaseConfig',
-    'rest_framework',
-    'corsheaders'
-]
-
-MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'corsheaders.middleware.CorsMiddleware',
 ]
+if SERVES_PAGES or SERVES_API:
+    INSTALLED_APPS += ['django.contrib.sessions']
+if SERVES_PAGES:
+    INSTALLED_APPS += ['django.contrib.messages', 'django.contrib.staticfiles']
+INSTALLED_APPS += ['base.apps.BaseConfig']
+if SERVES_API:
+    INSTALLED_APPS += ['rest_framework', 'corsheaders']
+
+MIDDLEWARE = []
+if SERVES_PAGES or SERVES_API:
+    MIDDLEWARE += ['django.middleware.security.SecurityMiddleware']
+if SERVES_PAGES:
+    # Serves STATIC_ROOT with far-future cache headers, see base/staticfiles.py
+    MIDDLEWARE += ['base.staticfiles.StaticFilesMiddleware']
+if SERVES_PAGES or SERVES_API:
+    MIDDLEWARE += [
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.common.CommonMiddleware',
+    ]
+if SERVES_PAGES:
+    # DRF checks the CSRF token of the API itself
+    MIDDLEWARE += ['django.middleware.csrf.CsrfViewMiddleware']
+if SERVES_PAGES or SERVES_API:
+    MIDDLEWARE += ['django.contrib.auth.middleware.AuthenticationMiddleware']
+if SERVES_PAGES:
+    MIDDLEWARE += [
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ]
+if SERVES_API:
+    MIDDLEWARE += ['corsheaders.middleware.CorsMiddleware']
+
+# Request profiling (base/profiling.py). Off unless PROFILING=1.
+# It goes last, after AuthenticationMiddleware, so it can check who is asking
+# for a cProfile. /metrics is only served to INTERNAL_IPS and staff users
+PROFILING_ENABLED = os.environ.get('PROFILING') == '1'
+# Fraction of the requests that are run under cProfile, 0.01 is 1%
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_DIR = BASE_DIR / 'profiles'
+INTERNAL_IPS = ['127.0.0.1']
+if PROFILING_ENABLED and MIDDLEWARE:
+    MIDDLEWARE.append('base.profiling.ProfilingMiddleware')
 
 ROOT_URLCONF = 'studybud.urls'
 
@@ -62,30 +110,198 @@ TEMPLATES = [
         'DIRS': [
             BASE_DIR / 'templates'
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Every template is compiled once per process and kept in memory.
+            # Django does this by default when DEBUG is off, this makes it
+            # explicit and the same in development (a template that changes
+            # on disk is still reloaded by runserver)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'base.context_processors.fragment_cache',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'studybud.wsgi.application'
+ASGI_APPLICATION = 'studybud.asgi.application'
+
+# Channel layer used by the room chat WebSockets (base/consumers.py)
+# The in-memory layer only works inside one process. To run several ASGI
+# processes, set CHANNEL_REDIS_URL (needs channels_redis installed)
+if os.environ.get('CHANNEL_REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.environ['CHANNEL_REDIS_URL']]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+    }
 
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# DB_ENGINE=sqlite (the default) or DB_ENGINE=postgresql, the rest of the
+# DB_* variables configure the connection
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'studybud'),
+            'USER': os.environ.get('DB_USER', 'studybud'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Persistent connections: every request reuses the connection of its
+            # worker instead of opening a new one, and a broken connection is
+            # detected before the request uses it
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DB_POOL_MAX_SIZE'):
+        # psycopg connection pool (Django 5.1+), shared by the threads of a
+        # process. It replaces persistent connections, so CONN_MAX_AGE is 0
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds a connection waits for the write lock before failing
+                # with "database is locked"
+                'timeout': 20,
+                # Transactions take the write lock when they start (Django 5.1+).
+                # A transaction that reads and then writes can't wait for the
+                # lock, SQLite fails it right away if someone wrote in between
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Old messages are moved to ArchivedMessage by `manage.py archive_messages`
+# (base/archive.py). With ARCHIVE_DB_NAME the archive is a SQLite database of
+# its own, create it with `manage.py migrate --database archive`
+if os.environ.get('ARCHIVE_DB_NAME'):
+    DATABASES['archive'] = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ['ARCHIVE_DB_NAME'],
+        'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
+    }
+DATABASE_ROUTERS = ['base.db.ArchiveRouter']
+# Messages not updated in this many days are archived
+MESSAGE_ARCHIVE_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_DAYS', 90))
+
+# Copy every activity event to the inbox of each participant of its room when
+# it happens (base/activity.py), so "activity in my rooms" doesn't need a join.
+# After turning it on, run `manage.py fill_activity_inboxes` once
+ACTIVITY_FAN_OUT = os.environ.get('ACTIVITY_FAN_OUT') == '1'
+
+# Where the deferred side effects of the writes run (base/tasks.py): the
+# search index and the activity inboxes. "immediate" runs them inside the
+# request, "thread" in a thread pool after the commit (local development) and
+# "database" saves them for `manage.py run_tasks` workers
+TASK_BACKEND = os.environ.get('TASK_BACKEND', 'immediate')
+TASK_THREADS = int(os.environ.get('TASK_THREADS', 2))
+TASK_MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled after every failure
+TASK_RETRY_DELAY = 2
+# A task running for longer than this is taken as lost (its worker died) and run again
+TASK_TIMEOUT = 300
+
+# PRAGMAs run on every new SQLite connection (base/db.py).
+# WAL lets readers keep reading while someone writes, and with synchronous=normal
+# a commit doesn't wait for fsync (still safe in WAL mode, a crash can only
+# lose the last commits, it can't corrupt the database)
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': 'normal',
+    'busy_timeout': 20000,
+    'cache_size': -20000,  # Negative means KiB, so 20 MB
+    'temp_store': 'memory',
+    'mmap_size': 134217728,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Local memory by default. CACHE_BACKEND=file stores it in CACHE_LOCATION (a
+# folder), and CACHE_BACKEND=redis uses the server in CACHE_LOCATION
+# (redis://host:6379), which is the one to use with more than one process
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get(
+            'CACHE_LOCATION', BASE_DIR / '.cache' if CACHE_BACKEND == 'file' else ''),
     }
 }
+# Whether every process sees the same cache. The version stamps
+# (base/caching.py) are bumped in the cache of the process that did the
+# write, so without a shared cache the other processes never see them. The
+# ETags made of them (base/conditional.py) are only used if it's shared.
+# SHARED_CACHE=1 with locmem is for a single process
+SHARED_CACHE = os.environ.get(
+    'SHARED_CACHE', '1' if CACHE_BACKEND in ('file', 'redis') else '0') == '1'
+
+# How long the cached template fragments (room and message cards, topics
+# sidebar) live. They are invalidated when the objects change, the timeout
+# only limits how old the "x minutes ago" dates can get
+FRAGMENT_CACHE_TIMEOUT = 300
+
+# Sessions and users read from the cache (base/auth.py), so a logged in
+# request doesn't query them. Sessions are still written to the database, a
+# cache miss reads them from there. It's only on by default with a shared
+# cache: with one cache per process, a logout, a new password or a disabled
+# user wouldn't be seen by the other processes. CACHED_AUTH=0 or 1 overrides it
+CACHED_AUTH = os.environ.get('CACHED_AUTH', '1' if SHARED_CACHE else '0') == '1'
+if CACHED_AUTH:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    AUTHENTICATION_BACKENDS = ['base.auth.CachedModelBackend']
+# Users are dropped from the cache when they change, this is only a safety net
+USER_CACHE_TIMEOUT = 300
+
+# Requests allowed per user (per IP when logged out) for the writes, see
+# base/ratelimit.py. Over the limit they get a 429 with Retry-After.
+# RATE_LIMIT=0 turns them off
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT', '1') == '1'
+RATE_LIMITER = 'base.ratelimit.SlidingWindow'
+RATE_LIMITS = {
+    'message': '30/m',  # Room form, chat WebSocket and POST /api/rooms/<pk>/messages/
+    'ingest': '3000/h',  # Messages (not requests) posted in batches to the API
+    'room': '10/h',
+    'login': '10/m',
+    'register': '5/h',
+}
 
 
 # Password validation
@@ -127,7 +343,15 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static'
 ]
 
-# STATIC_ROOT =
+# `python manage.py collectstatic` copies them here with hashed names and
+# precompressed copies (base/staticfiles.py), and the app serves them from here
+# when DEBUG is off
+STATIC_ROOT = os.environ.get('STATIC_ROOT', BASE_DIR / 'staticfiles')
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'base.staticfiles.CompressedManifestStorage'},
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
@@ -135,3 +359,33 @@ STATICFILES_DIRS = [
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
+
+REST_FRAMEWORK = {
+    # JSON with orjson when it's installed (base/api/renderers.py), and the
+    # browsable API for the browsers
+    'DEFAULT_RENDERER_CLASSES': [
+        'base.api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Serve the read only pages with the async views (base/async_views.py).
+# Only worth it under ASGI (daphne), under WSGI every async view gets its own
+# event loop
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+
+# Feeds (home, profile and activity) are paginated with a cursor, this is
+# how many rooms or messages each page shows
+FEED_PAGE_SIZE = 20
+# How many messages the "Recent Activities" sidebar shows
+RECENT_ACTIVITY_SIZE = 10
+# Most messages POST /api/rooms/<pk>/messages/ takes in one request
+INGEST_MAX_BATCH = 1000
+# How many messages the room page renders, and how many more each scroll loads
+ROOM_HISTORY_SIZE = 50
+# How many topics the topic input of the room form suggests
+TOPIC_AUTOCOMPLETE_SIZE = 10
+# How long a process keeps the topics in memory (base/topics.py) at most.
+# They're loaded again as soon as they change, this is only a safety net for
+# when the cache isn't shared
+TOPIC_REGISTRY_TIMEOUT = 60
@@ -13,11 +13,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('', include('base.urls')),
-    path('api/', include('base.api.urls'))
-]
+# Only the urls of this ROLE (see settings.py), an api process never imports the pages
+urlpatterns = []
+
+if settings.SERVES_PAGES:
+    from django.contrib import admin
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+        path('', include('base.urls')),
+    ]
+
+if settings.SERVES_API:
+    urlpatterns.append(path('api/', include('base.api.urls')))
+
+if settings.PROFILING_ENABLED:
+    from base import profiling
+    urlpatterns.append(path('metrics', profiling.metrics, name='metrics'))